@@ -4,34 +4,14 @@ sys.path.append('..')
 sys.path.append('.')
 from rdflib import Graph, URIRef
 import sqlite3
-import pandas as pd
 from rdflib import Literal
-from build_mimicsparql_kg.kg_complex_schema import addmissions_dtype, patients_dtype, procedures_dtype, prescriptions_dtype,\
-    diagnoses_dtype, lab_dtype, d_icd_procedures_dtype, d_icd_diagnoses_dtype, d_labitem_dtype
 
 PJT_ROOT_PATH = os.path.dirname(os.path.abspath(os.path.dirname(__file__)))
 print('PJT_ROOT_PATH: ', PJT_ROOT_PATH)
 
-domain = ''
-
-
-def isNoneNan(val):
-    if val is None:
-        return True
-
-    if (type(val) == str) and (val.lower() in ['none', 'nan']):
-        return True
-
-    if val != val:
-        return True
-
-    return False
-
-
-def clean_text(val):
-    if type(val) == str:
-        val = val.replace("\\", ' ')
-    return val
+# the table mapping is shared with MimicInterpreter, which builds the same KG straight from mimicsqlstar.db
+sys.path.append(os.path.join(os.path.dirname(PJT_ROOT_PATH), 'text2program-for-ehr'))
+from utils.kg_db import DOMAIN, is_none_nan, clean_text, read_kg_tables
 
 
 def wrap2uri(obj, literal_type):
@@ -51,20 +31,20 @@ def table2triples(df, parent_col, subject_col, col_types):
     for col_name, _ in col_types.items():
 
         if col_name == parent_col:
-            triples += [(wrap2uri(f'{domain}/{col_name}/{sub}', col_types[parent_col]),
-                         wrap2uri(f'{domain}/{subject_col}', 'relation'),
-                         wrap2uri(f'{domain}/{subject_col}/{obj}', col_types[subject_col]))
+            triples += [(wrap2uri(f'{DOMAIN}/{col_name}/{sub}', col_types[parent_col]),
+                         wrap2uri(f'{DOMAIN}/{subject_col}', 'relation'),
+                         wrap2uri(f'{DOMAIN}/{subject_col}/{obj}', col_types[subject_col]))
                         for (sub, obj) in zip(df[col_name], df[subject_col])]
             continue
 
         if col_name == subject_col:
             continue
 
-        triples += [(wrap2uri(f'{domain}/{subject_col}/{sub}', col_types[subject_col]),
-                     wrap2uri(f'{domain}/{col_name}', 'relation'),
-                     wrap2uri(f'{domain}/{col_name}/{obj}' if col_types[col_name] == 'entity' else f'{obj}',
+        triples += [(wrap2uri(f'{DOMAIN}/{subject_col}/{sub}', col_types[subject_col]),
+                     wrap2uri(f'{DOMAIN}/{col_name}', 'relation'),
+                     wrap2uri(f'{DOMAIN}/{col_name}/{obj}' if col_types[col_name] == 'entity' else f'{obj}',
                               col_types[col_name]))
-                    for (sub, obj) in zip(df[subject_col], df[col_name]) if not isNoneNan(obj)]
+                    for (sub, obj) in zip(df[subject_col], df[col_name]) if not is_none_nan(obj)]
 
     return triples
 
@@ -72,91 +52,12 @@ def table2triples(df, parent_col, subject_col, col_types):
 if __name__ == '__main__':
     db_conn = sqlite3.connect(os.path.join(PJT_ROOT_PATH, 'build_mimicsqlstar_db/mimicsqlstar.db'))
 
-    patients = pd.read_sql_query("SELECT * FROM PATIENTS", db_conn)
-    patients.info()
-
-    admissions = pd.read_sql_query("SELECT * FROM ADMISSIONS", db_conn)
-    admissions.info()
-
-    diagnoses = pd.read_sql_query("SELECT * FROM DIAGNOSES", db_conn)
-    diagnoses = diagnoses.rename({'ICD9_CODE': 'DIAGNOSES_ICD9_CODE'}, axis=1)
-    diagnoses.info()
-
-    d_icd_diagnoses = pd.read_sql_query("SELECT * FROM D_ICD_DIAGNOSES", db_conn)
-    d_icd_diagnoses = d_icd_diagnoses.rename({'ICD9_CODE': 'DIAGNOSES_ICD9_CODE',
-                                              'SHORT_TITLE': 'DIAGNOSES_SHORT_TITLE',
-                                              'LONG_TITLE': 'DIAGNOSES_LONG_TITLE'}, axis=1)
-    d_icd_diagnoses.info()
-
-    procedures = pd.read_sql_query("SELECT * FROM PROCEDURES", db_conn)
-    procedures = procedures.rename({'ICD9_CODE': 'PROCEDURES_ICD9_CODE'}, axis=1)
-    procedures.info()
-
-    d_icd_procedures = pd.read_sql_query("SELECT * FROM D_ICD_PROCEDURES", db_conn)
-    d_icd_procedures = d_icd_procedures.rename({'ICD9_CODE': 'PROCEDURES_ICD9_CODE',
-                                                'SHORT_TITLE': 'PROCEDURES_SHORT_TITLE',
-                                                'LONG_TITLE': 'PROCEDURES_LONG_TITLE'}, axis=1)
-    d_icd_procedures.info()
-
-    prescriptions = pd.read_sql_query("SELECT * FROM PRESCRIPTIONS", db_conn)
-    prescriptions['ICUSTAY_ID'] = prescriptions['ICUSTAY_ID'].apply(lambda x: str(x) if x == x else None)
-    prescriptions.info()
-
-    lab = pd.read_sql_query("SELECT * FROM LAB", db_conn)
-    lab.info()
-
-    d_labitem = pd.read_sql_query("SELECT * FROM D_LABITEM", db_conn)
-    d_labitem.info()
-
     triples = []
-
-    triples += table2triples(patients, parent_col='', subject_col='SUBJECT_ID', col_types=patients_dtype)
-    print(triples[:5])
-    print(triples[-5:])
-    print(len(triples))
-
-    triples += table2triples(admissions, parent_col='SUBJECT_ID', subject_col='HADM_ID',
-                             col_types=addmissions_dtype)
-    print(triples[-5:])
-    print(len(triples))
-
-    triples += table2triples(diagnoses, parent_col='HADM_ID', subject_col='DIAGNOSES', col_types=diagnoses_dtype)
-    # print(triples[:5])
-    print(triples[-5:])
-    print(len(triples))
-
-    triples += table2triples(d_icd_diagnoses, parent_col='', subject_col='DIAGNOSES_ICD9_CODE',
-                             col_types=d_icd_diagnoses_dtype)
-    # print(triples[:5])
-    print(triples[-5:])
-    print(len(triples))
-
-    triples += table2triples(procedures, parent_col='HADM_ID', subject_col='PROCEDURES', col_types=procedures_dtype)
-    # print(triples[:5])
-    print(triples[-5:])
-    print(len(triples))
-
-    triples += table2triples(d_icd_procedures, parent_col='', subject_col='PROCEDURES_ICD9_CODE',
-                             col_types=d_icd_procedures_dtype)
-    # print(triples[:5])
-    print(triples[-5:])
-    print(len(triples))
-
-    triples += table2triples(prescriptions, parent_col='HADM_ID', subject_col='PRESCRIPTIONS',
-                             col_types=prescriptions_dtype)
-    # print(triples[:5])
-    print(triples[-5:])
-    print(len(triples))
-
-    triples += table2triples(lab, parent_col='HADM_ID', subject_col='LAB', col_types=lab_dtype)
-    # print(triples[:5])
-    print(triples[-5:])
-    print(len(triples))
-
-    triples += table2triples(d_labitem, parent_col='', subject_col='ITEMID', col_types=d_labitem_dtype)
-    # print(triples[:5])
-    print(triples[-5:])
-    print(len(triples))
+    for df, parent_col, subject_col, col_types in read_kg_tables(db_conn):
+        df.info()
+        triples += table2triples(df, parent_col=parent_col, subject_col=subject_col, col_types=col_types)
+        print(triples[-5:])
+        print(len(triples))
 
     kg = Graph()
     for i, triple in enumerate(triples):
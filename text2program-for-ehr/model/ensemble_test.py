@@ -23,6 +23,7 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname( __file__ ), '..'))
 from utils.data_args import DataTrainingArguments
 from utils.model_args import ModelArguments
 from utils.training_args import TrainingArguments
+from utils.interpreter_service import ensure_interpreter_service
 
 from data_loader.data_loader import Text2TraceDataModule
 from model.pl_model import Text2TraceForTransformerModel
@@ -604,14 +605,15 @@ def evaluate_step(model_list, batch, batch_idx, eval_module, seed_gpu_dict):
             results["model_uncertainty"].append(model_uncertainty)
             results["total_uncertainty"].append(total_uncertainty)
 
-            ex_flag = eval_module._get_flag_for_execution_accuracy(gt='unknown', pred=pred, interpreter=eval_module.interpreter, answer=answer)
-            results["ex_acc"].append(ex_flag)
-
             pred_recover = recover_condition_value(pred, eval_module.look_up)
             results["recover_pred"].append(pred_recover)
-            
-            recover_ex_flag = eval_module._get_flag_for_execution_accuracy(gt='unknown', pred=pred_recover, interpreter=eval_module.interpreter, answer=answer)
-            results['recover_ex_acc'].append(recover_ex_flag)
+
+    results = eval_module.rerank_candidates(results, num_samples)
+    # the predictions and their recovered versions of the whole batch are executed at once
+    ex_flags = eval_module.get_flags_for_execution_accuracy(results["pred"] + results["recover_pred"],
+                                                            results["answer"] + results["answer"])
+    results["ex_acc"] = ex_flags[:len(results["pred"])]
+    results['recover_ex_acc'] = ex_flags[len(results["pred"]):]
 
     return results
 
@@ -660,6 +662,14 @@ def main():
 
     # Gather the arguments
     triple_args = {"data_args": data_args, "model_args": model_args, "training_args": training_args}
+
+    # every seed's model and the evaluation share one interpreter (one loaded KG)
+    if training_args.interpreter_socket:
+        cur_dir = os.getcwd()
+        ensure_interpreter_service(training_args.interpreter_socket,
+                                   f'{cur_dir}/data/db/mimicstar_kg/mimic_sparqlstar_kg.xml',
+                                   f'{cur_dir}/data/db/mimicstar_kg/mimicprogram_operations.json',
+                                   f'{cur_dir}/data/db/mimicstar_kg/mimic_sparqlstar_kg_snapshot')
     
     # Define pl.DataModule and pl.LightningModule
     SEEDS = model_args.ensemble_seed.split(',')
@@ -702,6 +712,8 @@ def main():
         torch.cuda.empty_cache()
     results = gather_evaluation_outputs(results)
     write_decode_output_file(save_file_path=results_fpath, save_file=results)
+    if training_args.type_check_programs:
+        print(f'{eval_module.n_type_pruned} predicted traces rejected by the type check without execution')
     
     mild_and_high, high = [], []
     with open(data_args.test_data_file) as f:
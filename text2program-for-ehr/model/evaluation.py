@@ -20,7 +20,13 @@ from sumeval.metrics.rouge import RougeCalculator
 
 # Custom pkgs
 from utils.interpreter import MimicInterpreter
-from utils.eval_utils import is_digit, clean_text_for_spacing, clean_for_condition_quote, recover_condition_value
+from utils.interpreter_service import connect_interpreter
+from utils.sharding import ShardedInterpreter, partition_kg, is_sharded_kg
+from utils.profiler import OpProfiler
+from utils.budget import ExecutionBudget, is_budget_exceeded
+from utils.type_checker import well_typed_first
+from utils.eval_utils import is_digit, clean_text_for_spacing, clean_for_condition_quote, recover_condition_value, \
+    clean_pred_for_execution
 
 
 logger = logging.getLogger(__name__)
@@ -48,7 +54,33 @@ class EvalForMimicProgram:
         cur_dir = os.getcwd()
         self.kg_path = f'{cur_dir}/data/db/mimicstar_kg/mimic_sparqlstar_kg.xml'
         self.ops_path  = f'{cur_dir}/data/db/mimicstar_kg/mimicprogram_operations.json'
-        self.interpreter = MimicInterpreter(self.kg_path, self.ops_path)
+        self.snapshot_path = f'{cur_dir}/data/db/mimicstar_kg/mimic_sparqlstar_kg_snapshot'
+        profiler = OpProfiler() if self.training_args.profile_interpreter else None
+        budget = None
+        budget_limits = (self.training_args.interpreter_max_cardinality, self.training_args.interpreter_max_bytes,
+                         self.training_args.interpreter_max_seconds)
+        if any(limit is not None for limit in budget_limits):
+            budget = ExecutionBudget(*budget_limits)
+        n_shards = self.training_args.interpreter_shards
+        if n_shards > 0:
+            if profiler is not None or budget is not None:
+                raise ValueError('profile_interpreter and interpreter budgets need interpreter_shards=0')
+            sharded_path = f'{self.snapshot_path}_shards{n_shards}'
+            if not is_sharded_kg(sharded_path):
+                partition_kg(MimicInterpreter(self.kg_path, self.ops_path, self.snapshot_path), sharded_path,
+                             n_shards)
+            self.interpreter = ShardedInterpreter(sharded_path, self.ops_path)
+            # one process per shard, interpreter_workers is for the unsharded KG
+            self.interpreter_workers = None
+        else:
+            self.interpreter = connect_interpreter(self.kg_path, self.ops_path, self.snapshot_path, profiler=profiler,
+                                                   budget=budget,
+                                                   branch_threads=self.training_args.interpreter_branch_threads)
+            self.interpreter_workers = self.training_args.interpreter_workers
+        # predicted traces stopped by the execution budget
+        self.n_budget_exceeded = 0
+        # predicted traces rejected by the static type check, never executed
+        self.n_type_pruned = 0
         
         f = open(f'{cur_dir}/data/cond_look_up.json', encoding='UTF-8')
         res = json.loads(f.read())
@@ -63,6 +95,12 @@ class EvalForMimicProgram:
         
     def evaluate(self):
         return None
+
+    def dump_op_profile(self, decode_file_path):
+        # per op histograms of the interpreter, written next to the decode output file
+        if self.interpreter.profiler is None:
+            return None
+        return self.interpreter.profiler.dump(os.path.splitext(decode_file_path)[0] + '_op_profile.json')
     
     def evaluate_step(self, model, batch, batch_idx):
         
@@ -180,18 +218,48 @@ class EvalForMimicProgram:
 
                 results["sequence_entropy"].append(entropy.tolist())
                 
-                ex_flag = self._get_flag_for_execution_accuracy(gt='unknown', pred=pred, interpreter=self.interpreter, answer=answer)
-                results["ex_acc"].append(ex_flag)
-                
                 if self.training_args.recover:
                     pred_recover = recover_condition_value(pred, self.look_up)
                     results["recover_pred"].append(pred_recover)
-                    
-                    recover_ex_flag = self._get_flag_for_execution_accuracy(gt='unknown', pred=pred_recover, interpreter=self.interpreter, answer=answer)
-                    results['recover_ex_acc'].append(recover_ex_flag)
+
+        results = self.rerank_candidates(results, num_samples)
+        preds, answers_for_preds = results["pred"], results["answer"]
+        if self.training_args.recover:
+            preds, answers_for_preds = preds + results["recover_pred"], answers_for_preds + results["answer"]
+        ex_flags = self.get_flags_for_execution_accuracy(preds, answers_for_preds)
+        results["ex_acc"] = ex_flags[:len(results["pred"])]
+        if self.training_args.recover:
+            results['recover_ex_acc'] = ex_flags[len(results["pred"]):]
 
         return results
         
+    def get_flags_for_execution_accuracy(self, preds, answers):
+        # execute every prediction of the batch at once (spread over interpreter_workers processes)
+        traces = [clean_pred_for_execution(pred) for pred in preds]
+        output_preds = self.execute_well_typed(traces)
+        self.n_budget_exceeded += sum(is_budget_exceeded(output_pred) for output_pred in output_preds)
+        return [self._check_execution_accuracy(output_pred, answer)
+                for output_pred, answer in zip(output_preds, answers)]
+
+    def rerank_candidates(self, results, num_samples):
+        # the num_samples candidates of each question come best first (beam score): the ones failing the type check
+        # are moved behind the others, so a question's top candidate is the best one that can give an answer
+        if not self.training_args.type_check_programs or num_samples == 1:
+            return results
+        flags = self.interpreter.check_trace_types([clean_pred_for_execution(pred) for pred in results["pred"]])
+        order = well_typed_first(flags, num_samples)
+        return {k: [v[idx] for idx in order] if len(v) == len(order) else v for k, v in results.items()}
+
+    def execute_well_typed(self, traces):
+        # interpreter.execute_traces of the traces that pass the static type check, None for the others
+        if not self.training_args.type_check_programs:
+            return self.interpreter.execute_traces(traces, workers=self.interpreter_workers)
+        flags = self.interpreter.check_trace_types(traces)
+        self.n_type_pruned += flags.count(False)
+        outputs = iter(self.interpreter.execute_traces([trace for trace, ok in zip(traces, flags) if ok],
+                                                       workers=self.interpreter_workers))
+        return [next(outputs) if ok else None for ok in flags]
+
     def load_question_ground_truth_data(self, data_file_path):
         with open(data_file_path) as json_file:
             questions, answers = [], []
@@ -228,6 +296,10 @@ class EvalForMimicProgram:
         pred = clean_text_for_spacing(pred)
         pred = clean_for_condition_quote(pred)
         try:
+            # the same prediction is pruned whether or not the gt trace is known
+            if self.training_args.type_check_programs and not interpreter.check_trace_types([pred])[0]:
+                self.n_type_pruned += 1
+                return False
             if gt != 'unknown':
                 gt = clean_for_condition_quote(gt)
                 output_gt = interpreter.execute_trace(gt)
@@ -241,13 +313,18 @@ class EvalForMimicProgram:
                     result2 = sorted(output_gt[0].tolist()) == sorted(output_pred[1].tolist()) and sorted(output_gt[1].tolist()) == sorted(output_pred[0].tolist())
                     return result1 or result2
                 return sorted(output_gt) == sorted(output_pred)
+            output_pred = interpreter.execute_trace(pred)
+        except:
+            return False
+        return self._check_execution_accuracy(output_pred, answer)
+
+    def _check_execution_accuracy(self, output_pred, answer):
+        try:
+            if type(answer) is str:
+                answer = [list(item) for item in set(tuple(row) for row in eval(answer))]
             else:
-                if type(answer) is str:
-                    answer = [list(item) for item in set(tuple(row) for row in eval(answer))]
-                else:
-                    answer = [list(item) for item in set(tuple(row) for row in eval(str(answer)))]
+                answer = [list(item) for item in set(tuple(row) for row in eval(str(answer)))]
             output_gt = answer
-            output_pred = interpreter.execute_trace(pred)
 
             ex_flag = False
             if len(answer[0]) == 2:
@@ -470,6 +470,9 @@ class Text2TraceForTransformerModel(pl.LightningModule):
             if self.training_args.recover:
                 final_recover_ex_cnt = sum(results['recover_ex_flag'])
             write_decode_output_file(save_file_path=results_fpath, save_file=results, recover=self.training_args.recover)
+            self.eval_module.dump_op_profile(results_fpath)
+            self.log(f'{state}_budget_exceeded', self.eval_module.n_budget_exceeded)
+            self.log(f'{state}_type_pruned', self.eval_module.n_type_pruned)
         
         # Write logging
         self.log(f'{state}_ex', final_ex_cnt)
@@ -754,6 +757,9 @@ class Text2TraceForUnilmModel(pl.LightningModule):
             if self.training_args.recover:
                 final_recover_ex_cnt = sum(results['recover_ex_flag'])
             write_decode_output_file(save_file_path=results_fpath, save_file=results, recover=self.training_args.recover)
+            self.eval_module.dump_op_profile(results_fpath)
+            self.log(f'{state}_budget_exceeded', self.eval_module.n_budget_exceeded)
+            self.log(f'{state}_type_pruned', self.eval_module.n_type_pruned)
         
         # Write logging
         self.log(f'{state}_ex', final_ex_cnt)
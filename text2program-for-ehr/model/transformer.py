@@ -20,8 +20,8 @@ from transformers import PretrainedConfig, AutoConfig
 
 from typing import Optional
 
-from utils.interpreter import MimicInterpreter
-from utils.eval_utils import recover_pred_for_subwords, get_flag_for_execution_accuracy
+from utils.interpreter_service import connect_interpreter
+from utils.eval_utils import recover_pred_for_subwords, get_flags_for_execution_accuracy
 
 
 
@@ -59,7 +59,9 @@ class Text2TraceT5Model(PreTrainedModel):
         cur_dir = os.getcwd()
         kg_path = f'{cur_dir}/data/db/mimicstar_kg/mimic_sparqlstar_kg.xml'
         ops_path  = f'{cur_dir}/data/db/mimicstar_kg/mimicprogram_operations.json'
-        self.interpreter = MimicInterpreter(kg_path, ops_path)
+        snapshot_path = f'{cur_dir}/data/db/mimicstar_kg/mimic_sparqlstar_kg_snapshot'
+        # the interpreter service of the run when there is one, else a KG loaded in this process
+        self.interpreter = connect_interpreter(kg_path, ops_path, snapshot_path)
     
     def get_input_embeddings(self):
         return self.model.shared
@@ -139,7 +141,7 @@ class Text2TraceT5Model(PreTrainedModel):
             max_length=seq_len
         )
 
-        ex_cnt = 0
+        preds, batch_answers = [], []
         for b_idx in range(bsz):
             # ignore CLS token
             gt = decoder_input_ids[b_idx][1:]
@@ -159,8 +161,10 @@ class Text2TraceT5Model(PreTrainedModel):
         
             answer = answers[b_idx]
             pred = self.tokenizer.decode(pred, skip_special_tokens=True)
-            ex_cnt += get_flag_for_execution_accuracy(pred, self.interpreter, answer)
+            preds.append(pred)
+            batch_answers.append(answer)
 
+        ex_cnt = sum(get_flags_for_execution_accuracy(preds, self.interpreter, batch_answers))
         result = ex_cnt
         return result
 
@@ -48,8 +48,8 @@ from .base_model import (
     BertPreTrainedModel,
 )
 
-from utils.interpreter import MimicInterpreter
-from utils.eval_utils import recover_pred_for_subwords, get_flag_for_execution_accuracy
+from utils.interpreter_service import connect_interpreter
+from utils.eval_utils import recover_pred_for_subwords, get_flags_for_execution_accuracy
 
 
 logger = logging.get_logger(__name__)
@@ -109,7 +109,9 @@ class Text2TraceBertForMaskedLM(BertPreTrainedModel):
         cur_dir = os.getcwd()
         kg_path = f'{cur_dir}/data/db/mimicstar_kg/mimic_sparqlstar_kg.xml'
         ops_path  = f'{cur_dir}/data/db/mimicstar_kg/mimicprogram_operations.json'
-        self.interpreter = MimicInterpreter(kg_path, ops_path)
+        snapshot_path = f'{cur_dir}/data/db/mimicstar_kg/mimic_sparqlstar_kg_snapshot'
+        # the interpreter service of the run when there is one, else a KG loaded in this process
+        self.interpreter = connect_interpreter(kg_path, ops_path, snapshot_path)
         f = open(f'{cur_dir}/data/cond_look_up.json', encoding='UTF-8')
         self.tokenizer_look_up_json = eval(json.loads(f.read()))
 
@@ -280,7 +282,7 @@ class Text2TraceBertForMaskedLM(BertPreTrainedModel):
         # we have to construct ground truth labels (due to fine-tune data_collator type)
         ground_labels = labels.not_equal(-100) * labels + (labels.eq(-100)) * input_ids
 
-        ex_cnt = 0
+        preds, batch_answers = [], []
         for b_idx in range(bsz):
             gt = ground_labels[b_idx][txt_len:]
             pred = output_ids[b_idx][txt_len:]
@@ -300,8 +302,10 @@ class Text2TraceBertForMaskedLM(BertPreTrainedModel):
             pred = self.tokenizer.decode(pred, skip_special_tokens=True)
 
             recover_pred = recover_pred_for_subwords(pred, self.tokenizer, self.tokenizer_look_up_json)
-            ex_cnt += get_flag_for_execution_accuracy(recover_pred, self.interpreter, answer)
+            preds.append(recover_pred)
+            batch_answers.append(answer)
 
+        ex_cnt = sum(get_flags_for_execution_accuracy(preds, self.interpreter, batch_answers))
         result = ex_cnt
         return result
     
@@ -0,0 +1,54 @@
+import os
+import sys
+import json
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic_kg import N_SUBJECTS, N_BASE_SUBJECTS, TRACES, write_kg, write_operations
+from make_expected_answers import EXPECTED_ANSWERS_FILE
+
+
+@pytest.fixture(scope='session')
+def kg_dir(tmp_path_factory):
+    return tmp_path_factory.mktemp('kg')
+
+
+@pytest.fixture(scope='session')
+def ops_path(kg_dir):
+    return write_operations(kg_dir / 'mimicprogram_operations.json')
+
+
+@pytest.fixture(scope='session')
+def kg_path(kg_dir):
+    return write_kg(kg_dir / 'kg.xml', N_SUBJECTS)
+
+
+@pytest.fixture(scope='session')
+def base_kg_path(kg_dir):
+    return write_kg(kg_dir / 'kg_base.xml', N_BASE_SUBJECTS)
+
+
+@pytest.fixture(scope='session')
+def traces():
+    return list(TRACES)
+
+
+@pytest.fixture(scope='session')
+def expected_answers():
+    # answers of the original eval() based interpreter, written by make_expected_answers.py
+    with open(EXPECTED_ANSWERS_FILE) as f:
+        expected = json.load(f)
+    assert expected['traces'] == TRACES, 'TRACES changed: run tests/make_expected_answers.py'
+    return expected
+
+
+@pytest.fixture(scope='session')
+def reference_answers(expected_answers):
+    return expected_answers['kg']
+
+
+@pytest.fixture(scope='session')
+def base_reference_answers(expected_answers):
+    return expected_answers['kg_base']
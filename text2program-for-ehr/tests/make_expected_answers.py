@@ -0,0 +1,55 @@
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+import importlib.util
+
+import numpy as np
+
+from synthetic_kg import N_SUBJECTS, N_BASE_SUBJECTS, TRACES, canonical_answers, write_kg, write_operations
+
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+EXPECTED_ANSWERS_FILE = os.path.join(TESTS_DIR, 'expected_answers.json')
+INTERPRETER_FILE = 'text2program-for-ehr/utils/interpreter.py'
+
+
+def load_baseline_interpreter(revision):
+    # MimicInterpreter of utils/interpreter.py at revision, the original eval() based interpreter whose answers
+    # every execution mode has to reproduce
+    source = subprocess.check_output(['git', 'show', f'{revision}:{INTERPRETER_FILE}'], cwd=TESTS_DIR)
+    with tempfile.NamedTemporaryFile('wb', suffix='.py', delete=False) as f:
+        f.write(source)
+    spec = importlib.util.spec_from_file_location('baseline_interpreter', f.name)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    os.unlink(f.name)
+    return module.MimicInterpreter
+
+
+def baseline_answers(interpreter_cls, kg_dir, n_subjects):
+    kg_path = write_kg(os.path.join(kg_dir, f'kg_{n_subjects}.xml'), n_subjects)
+    interpreter = interpreter_cls(kg_path, write_operations(os.path.join(kg_dir, 'operations.json')))
+    return canonical_answers([interpreter.execute_trace(trace) for trace in TRACES])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write the answers of the original interpreter to TRACES on the '
+                                                 'synthetic KGs, the expected answers of the tests')
+    parser.add_argument('--revision', default=None,
+                        help='git revision of the original interpreter (default: the first commit)')
+    args = parser.parse_args()
+
+    revision = args.revision or subprocess.check_output(['git', 'rev-list', '--max-parents=0', 'HEAD'],
+                                                        cwd=TESTS_DIR, text=True).split()[0]
+    interpreter_cls = load_baseline_interpreter(revision)
+    with tempfile.TemporaryDirectory() as kg_dir:
+        expected = {'revision': revision, 'numpy': np.__version__, 'traces': TRACES,
+                    'kg': baseline_answers(interpreter_cls, kg_dir, N_SUBJECTS),
+                    'kg_base': baseline_answers(interpreter_cls, kg_dir, N_BASE_SUBJECTS)}
+    with open(EXPECTED_ANSWERS_FILE, 'w') as f:
+        json.dump(expected, f, indent=1, ensure_ascii=False)
+    print(f'{len(TRACES)} traces, {sum(answer is None for answer in expected["kg"])} failing on the full KG, '
+          f'written to {EXPECTED_ANSWERS_FILE}', file=sys.stderr)
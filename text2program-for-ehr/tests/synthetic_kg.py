@@ -0,0 +1,177 @@
+import json
+import random
+import datetime
+
+import numpy as np
+from rdflib import Graph, URIRef, Literal, XSD
+
+
+N_SUBJECTS = 16
+# subjects of the base KG the delta and version tests extend to the full one
+N_BASE_SUBJECTS = 12
+
+OPERATIONS = [
+    ('gen_entset_down', ['entSet', 'rel_ent'], 'entSet'),
+    ('gen_entset_up', ['rel_ent', 'entSet'], 'entSet'),
+    ('gen_litset', ['entSet', 'rel_lit'], 'litSet'),
+    ('gen_entset_equal', ['rel_lit', 'value'], 'entSet'),
+    ('gen_entset_atleast', ['rel_lit', 'value'], 'entSet'),
+    ('gen_entset_less', ['rel_lit', 'value'], 'entSet'),
+    ('gen_entset_atmost', ['rel_lit', 'value'], 'entSet'),
+    ('gen_entset_more', ['rel_lit', 'value'], 'entSet'),
+    ('count_litset', ['litSet', 'None'], 'value'),
+    ('count_entset', ['entSet', 'None'], 'value'),
+    ('maximum_litset', ['litSet', 'None'], 'value'),
+    ('minimum_litset', ['litSet', 'None'], 'value'),
+    ('average_litset', ['litSet', 'None'], 'value'),
+    ('intersect_entsets', ['entSet', 'entSet'], 'entSet'),
+    ('intersect_litsets', ['litSet', 'litSet'], 'litSet'),
+    ('union_entsets', ['entSet', 'entSet'], 'entSet'),
+    ('union_litsets', ['litSet', 'litSet'], 'litSet'),
+    ('concat_litsets', ['litSet', 'litSet'], 'litSet'),
+]
+
+TITLES = ['perforation of intestine', 'hypertension nos', "alzheimer's disease", 'Mixed Case title', 'sepsis']
+LABELS = ['blood gas', 'glucose', 'potassium']
+
+
+def entity(path):
+    return URIRef(path.lower())
+
+
+def build_kg(n_subjects):
+    # mimic-like KG: patients, admissions, diagnoses, labs and prescriptions. every subject is drawn from its own
+    # seed, so the KG of fewer subjects is a subset of the KG of more
+    kg = Graph()
+    for code, title in enumerate(TITLES):
+        kg.add((entity(f'/diagnoses_icd9_code/{4000 + code}'), entity('/diagnoses_long_title'),
+                Literal(title, datatype=XSD.string)))
+        kg.add((entity(f'/diagnoses_icd9_code/{4000 + code}'), entity('/diagnoses_short_title'),
+                Literal(title[:8].lower(), datatype=XSD.string)))
+    for item, label in enumerate(LABELS):
+        kg.add((entity(f'/itemid/{50800 + item}'), entity('/label'), Literal(label, datatype=XSD.string)))
+        kg.add((entity(f'/itemid/{50800 + item}'), entity('/fluid'), Literal('blood', datatype=XSD.string)))
+
+    for s in range(1, n_subjects + 1):
+        rng = random.Random(s)
+        subject = entity(f'/subject_id/{s}')
+        dob = datetime.datetime(2050 + s, 1 + s % 12, 1 + s % 27)
+        kg.add((subject, entity('/gender'), Literal(rng.choice(['f', 'm']), datatype=XSD.string)))
+        kg.add((subject, entity('/name'), Literal(f'patient {s}', datatype=XSD.string)))
+        kg.add((subject, entity('/dob'), Literal(dob, datatype=XSD.dateTime)))
+        kg.add((subject, entity('/dob_year'), Literal(dob.year, datatype=XSD.integer)))
+        kg.add((subject, entity('/expire_flag'), Literal(s % 2, datatype=XSD.integer)))
+        if s % 3 == 0:
+            kg.add((subject, entity('/dod'), Literal(dob + datetime.timedelta(days=365 * 70), datatype=XSD.dateTime)))
+        for a in range(rng.randint(1, 3)):
+            admission = entity(f'/hadm_id/{100000 + 10 * s + a}')
+            admittime = datetime.datetime(2100 + rng.randint(0, 40), rng.randint(1, 12), rng.randint(1, 28),
+                                          rng.randint(0, 23))
+            kg.add((subject, entity('/hadm_id'), admission))
+            kg.add((admission, entity('/age'), Literal(rng.randint(20, 90), datatype=XSD.integer)))
+            kg.add((admission, entity('/days_stay'), Literal(rng.randint(0, 40), datatype=XSD.integer)))
+            kg.add((admission, entity('/admission_type'),
+                    Literal(rng.choice(['emergency', 'elective', 'urgent']), datatype=XSD.string)))
+            kg.add((admission, entity('/insurance'), Literal(rng.choice(['medicare', 'private']), datatype=XSD.string)))
+            kg.add((admission, entity('/admittime'), Literal(admittime, datatype=XSD.dateTime)))
+            kg.add((admission, entity('/admityear'), Literal(admittime.year, datatype=XSD.integer)))
+            for d in range(rng.randint(0, 3)):
+                diagnosis = entity(f'/diagnoses/{1000 * s + 10 * a + d}')
+                kg.add((admission, entity('/diagnoses'), diagnosis))
+                kg.add((diagnosis, entity('/diagnoses_icd9_code'),
+                        entity(f'/diagnoses_icd9_code/{4000 + rng.randint(0, len(TITLES) - 1)}')))
+            for l in range(rng.randint(0, 5)):
+                lab = entity(f'/lab/{1000 * s + 10 * a + l}')
+                kg.add((admission, entity('/lab'), lab))
+                kg.add((lab, entity('/itemid'), entity(f'/itemid/{50800 + rng.randint(0, len(LABELS) - 1)}')))
+                if rng.random() < .6:
+                    kg.add((lab, entity('/flag'), Literal(rng.choice(['abnormal', 'delta']), datatype=XSD.string)))
+                kg.add((lab, entity('/charttime'),
+                        Literal(admittime + datetime.timedelta(hours=l), datatype=XSD.dateTime)))
+                kg.add((lab, entity('/value_unit'),
+                        Literal(rng.choice(['mg/dl', '7.4', '12.5', '-3']), datatype=XSD.string)))
+            if a == 0:
+                prescription = entity(f'/prescriptions/{s}')
+                kg.add((admission, entity('/prescriptions'), prescription))
+                kg.add((prescription, entity('/drug'),
+                        Literal(rng.choice(['aspirin', 'heparin', 'café']), datatype=XSD.string)))
+    return kg
+
+
+TRACES = [
+    "<r1>=gen_entset_equal('/gender','f')<exe><r2>=count_entset(<r1>)<exe>",
+    "<r1>=gen_entset_equal('/gender','m')<exe><r2>=gen_entset_down(<r1>,'/hadm_id')<exe><r3>=gen_litset(<r2>,'/age')<exe><r4>=average_litset(<r3>)<exe>",
+    "<r1>=gen_entset_equal('/gender','m')<exe><r2>=gen_entset_down(<r1>,'/hadm_id')<exe><r3>=gen_litset(<r2>,'/days_stay')<exe><r4>=maximum_litset(<r3>)<exe>",
+    "<r1>=gen_entset_equal('/gender','f')<exe><r2>=gen_entset_down(<r1>,'/hadm_id')<exe><r3>=gen_litset(<r2>,'/days_stay')<exe><r4>=minimum_litset(<r3>)<exe>",
+    "<r1>=gen_entset_equal('/gender','f')<exe><r2>=gen_litset(<r1>,'/name')<exe>",
+    "<r1>=gen_entset_atleast('/age','50')<exe><r2>=gen_entset_up('/hadm_id',<r1>)<exe><r3>=count_entset(<r2>)<exe>",
+    "<r1>=gen_entset_less('/days_stay','10')<exe><r2>=gen_entset_up('/hadm_id',<r1>)<exe><r3>=count_entset(<r2>)<exe>",
+    "<r1>=gen_entset_atmost('/days_stay','10')<exe><r2>=gen_litset(<r1>,'/insurance')<exe>",
+    "<r1>=gen_entset_more('/age','60')<exe><r2>=gen_litset(<r1>,'/admission_type')<exe>",
+    "<r1>=gen_entset_more('/dob_year','2060')<exe><r2>=gen_litset(<r1>,'/name')<exe>",
+    "<r1>=gen_entset_equal('/name','patient 3')<exe><r2>=gen_litset(<r1>,'/dob')<exe><r3>=gen_litset(<r1>,'/gender')<exe><r4>=concat_litsets(<r2>,<r3>)<exe>",
+    "<r1>=gen_entset_equal('/name','patient 3')<exe><r2>=gen_entset_down(<r1>,'/hadm_id')<exe><r3>=gen_entset_down(<r2>,'/diagnoses')<exe><r4>=gen_entset_down(<r3>,'/diagnoses_icd9_code')<exe><r5>=gen_litset(<r4>,'/diagnoses_long_title')<exe>",
+    "<r1>=gen_entset_equal('/name','patient 14')<exe><r2>=gen_entset_down(<r1>,'/hadm_id')<exe><r3>=gen_litset(<r2>,'/admittime')<exe>",
+    "<r1>=gen_entset_equal('/diagnoses_long_title',\"alzheimer's disease\")<exe><r2>=gen_entset_up('/diagnoses_icd9_code',<r1>)<exe><r3>=gen_entset_up('/diagnoses',<r2>)<exe><r4>=gen_entset_up('/hadm_id',<r3>)<exe><r5>=count_entset(<r4>)<exe>",
+    "<r1>=gen_entset_equal('/diagnoses_long_title','Mixed Case title')<exe><r2>=gen_entset_up('/diagnoses_icd9_code',<r1>)<exe><r3>=count_entset(<r2>)<exe>",
+    "<r1>=gen_entset_equal('/diagnoses_long_title','mixed case title')<exe><r2>=gen_entset_up('/diagnoses_icd9_code',<r1>)<exe><r3>=count_entset(<r2>)<exe>",
+    "<r1>=gen_entset_equal('/admission_type','emergency')<exe><r2>=gen_entset_equal('/insurance','medicare')<exe><r3>=union_entsets(<r1>,<r2>)<exe><r4>=gen_entset_up('/hadm_id',<r3>)<exe><r5>=count_entset(<r4>)<exe>",
+    "<r1>=gen_entset_equal('/admission_type','emergency')<exe><r2>=gen_entset_equal('/insurance','medicare')<exe><r3>=intersect_entsets(<r1>,<r2>)<exe><r4>=gen_litset(<r3>,'/age')<exe><r5>=count_litset(<r4>)<exe>",
+    "<r1>=gen_entset_equal('/flag','abnormal')<exe><r2>=gen_entset_up('/lab',<r1>)<exe><r3>=gen_entset_up('/hadm_id',<r2>)<exe><r4>=gen_entset_equal('/diagnoses_long_title','sepsis')<exe><r5>=gen_entset_up('/diagnoses_icd9_code',<r4>)<exe><r6>=gen_entset_up('/diagnoses',<r5>)<exe><r7>=gen_entset_up('/hadm_id',<r6>)<exe><r8>=intersect_entsets(<r3>,<r7>)<exe><r9>=count_entset(<r8>)<exe>",
+    "<r1>=gen_entset_equal('/label','glucose')<exe><r2>=gen_entset_up('/itemid',<r1>)<exe><r3>=gen_litset(<r2>,'/value_unit')<exe><r4>=maximum_litset(<r3>)<exe>",
+    "<r1>=gen_entset_equal('/label','glucose')<exe><r2>=gen_entset_up('/itemid',<r1>)<exe><r3>=gen_litset(<r2>,'/charttime')<exe>",
+    "<r1>=gen_entset_equal('/label','glucose')<exe><r2>=gen_entset_up('/itemid',<r1>)<exe><r3>=gen_litset(<r2>,'/flag')<exe><r4>=gen_entset_equal('/label','potassium')<exe><r5>=gen_entset_up('/itemid',<r4>)<exe><r6>=gen_litset(<r5>,'/flag')<exe><r7>=union_litsets(<r3>,<r6>)<exe>",
+    "<r1>=gen_entset_equal('/label','glucose')<exe><r2>=gen_entset_up('/itemid',<r1>)<exe><r3>=gen_litset(<r2>,'/flag')<exe><r4>=gen_entset_equal('/label','potassium')<exe><r5>=gen_entset_up('/itemid',<r4>)<exe><r6>=gen_litset(<r5>,'/flag')<exe><r7>=intersect_litsets(<r3>,<r6>)<exe>",
+    "<r1>=gen_entset_equal('/gender','f')<exe><r2>=gen_entset_down(<r1>,'/hadm_id')<exe><r3>=gen_entset_down(<r2>,'/lab')<exe><r4>=gen_entset_equal('/flag','abnormal')<exe><r5>=intersect_entsets(<r3>,<r4>)<exe><r6>=gen_entset_up('/lab',<r5>)<exe><r7>=gen_entset_up('/hadm_id',<r6>)<exe><r8>=count_entset(<r7>)<exe>",
+    "<r1>=gen_entset_equal('/gender','f')<exe><r2>=gen_entset_down(<r1>,'/hadm_id')<exe><r3>=gen_entset_equal('/gender','f')<exe><r4>=gen_entset_down(<r3>,'/hadm_id')<exe><r5>=intersect_entsets(<r2>,<r4>)<exe><r6>=count_entset(<r5>)<exe>",
+    "<r1>=gen_entset_equal('/drug','café')<exe><r2>=gen_entset_up('/prescriptions',<r1>)<exe><r3>=gen_litset(<r2>,'/admission_type')<exe>",
+    "<r1>=gen_entset_equal('/expire_flag','1')<exe><r2>=gen_entset_down(<r1>,'/hadm_id')<exe><r3>=gen_litset(<r2>,'/age')<exe><r4>=average_litset(<r3>)<exe>",
+    "<r1>=gen_entset_atleast('/admityear','2120')<exe><r2>=gen_entset_up('/hadm_id',<r1>)<exe><r3>=gen_litset(<r2>,'/gender')<exe>",
+    "<r1>=gen_entset_equal('/gender','f')<exe><r2>=gen_entset_down(<r1>,'/hadm_id')<exe><r3>=gen_litset(<r2>,'/admittime')<exe><r4>=minimum_litset(<r3>)<exe>",
+    # an empty intersection: counted, or skipping the operands left once they cannot fail
+    "<r1>=gen_entset_equal('/gender','f')<exe><r2>=gen_entset_equal('/gender','m')<exe><r3>=intersect_entsets(<r1>,<r2>)<exe><r4>=count_entset(<r3>)<exe>",
+    "<r1>=gen_entset_equal('/gender','f')<exe><r2>=gen_entset_equal('/gender','m')<exe><r3>=intersect_entsets(<r1>,<r2>)<exe><r4>=gen_entset_equal('/gender','m')<exe><r5>=gen_entset_down(<r4>,'/hadm_id')<exe><r6>=gen_entset_up('/hadm_id',<r5>)<exe><r7>=intersect_entsets(<r3>,<r6>)<exe><r8>=count_entset(<r7>)<exe>",
+    # the value of an equality lookup computed by another op: a single item matches like that item
+    "<r1>=gen_entset_equal('/name','patient 3')<exe><r2>=gen_litset(<r1>,'/name')<exe><r3>=gen_entset_equal('/name',<r2>)<exe><r4>=count_entset(<r3>)<exe>",
+    "<r1>=gen_entset_equal('/name','patient 5')<exe><r2>=gen_entset_down(<r1>,'/hadm_id')<exe><r3>=gen_entset_down(<r2>,'/prescriptions')<exe><r4>=gen_litset(<r3>,'/drug')<exe><r5>=gen_entset_equal('/drug',<r4>)<exe><r6>=gen_litset(<r5>,'/drug')<exe>",
+    "<r1>=gen_entset_equal('/name','patient 5')<exe><r2>=gen_entset_down(<r1>,'/hadm_id')<exe><r3>=gen_entset_down(<r2>,'/prescriptions')<exe><r4>=gen_entset_equal('/prescriptions',<r3>)<exe><r5>=count_entset(<r4>)<exe>",
+    # failing traces: empty results, unknown relations or values, syntax and type errors
+    "<r1>=gen_entset_equal('/gender','f')<exe><r2>=gen_litset(<r1>,'/name')<exe><r3>=gen_entset_equal('/name',<r2>)<exe><r4>=count_entset(<r3>)<exe>",
+    "<r1>=gen_entset_equal('/gender','f')<exe><r2>=gen_entset_equal('/gender','m')<exe><r3>=intersect_entsets(<r1>,<r2>)<exe><r4>=gen_entset_down(<r3>,'/hadm_id')<exe><r5>=count_entset(<r4>)<exe>",
+    "<r1>=gen_entset_equal('/gender','f')<exe><r2>=gen_entset_equal('/gender','m')<exe><r3>=intersect_entsets(<r1>,<r2>)<exe><r4>=gen_entset_equal('/gender','x')<exe><r5>=gen_entset_down(<r4>,'/hadm_id')<exe><r6>=intersect_entsets(<r3>,<r5>)<exe><r7>=count_entset(<r6>)<exe>",
+    "<r1>=gen_entset_equal('/gender','x')<exe><r2>=gen_entset_down(<r1>,'/hadm_id')<exe><r3>=count_entset(<r2>)<exe>",
+    "<r1>=gen_entset_equal('/nosuchrel','x')<exe><r2>=count_entset(<r1>)<exe>",
+    "<r1>=gen_entset_atleast('/age','abc')<exe><r2>=count_entset(<r1>)<exe>",
+    "<r1>=gen_entset_equal('/gender','f')<exe><r2>=gen_entset_dwn(<r1>,'/hadm_id')<exe>",
+    "<r1>=gen_entset_equal('/gender','f'<exe>",
+    "<r1>=gen_entset_equal('/gender','f')<exe><r2>=count_entset(<r3>)<exe>",
+    "<r1>=gen_entset_equal('/gender','m')<exe><r2>=gen_litset(<r1>,'/hadm_id')<exe><r3>=gen_entset_down(<r2>,'/age')<exe>",
+    "<r1>=gen_entset_equal('/admission_type','emergency')<exe><r2>=count_entset(<r1>)<exe><r3>=count_entset(<r2>)<exe>",
+]
+
+
+def canonical(result):
+    # answers compared up to the order of multiset items and float rounding
+    if isinstance(result, np.ndarray):
+        return sorted(map(str, result.reshape(-1).tolist()))
+    if isinstance(result, list):
+        return [canonical(item) for item in result]
+    if isinstance(result, (float, np.floating)):
+        return round(float(result), 9)
+    return result
+
+
+def canonical_answers(results):
+    return [canonical(result) for result in results]
+
+
+def write_kg(path, n_subjects):
+    build_kg(n_subjects).serialize(str(path), format='xml')
+    return str(path)
+
+
+def write_operations(path, operations=OPERATIONS):
+    with open(path, 'w') as f:
+        for name, arg_types, out_type in operations:
+            f.write(json.dumps({'name': name, 'arg_types': arg_types, 'out_type': out_type}) + '\n')
+    return str(path)
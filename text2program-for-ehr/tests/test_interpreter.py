@@ -0,0 +1,148 @@
+import json
+import pickle
+
+import numpy as np
+import pytest
+
+import utils.interpreter
+from utils.interpreter import MimicInterpreter
+from utils.kg_snapshot import is_kg_snapshot
+from utils.kg_index import RelationCSR
+from utils.result_cache import SubResultCache
+from utils.profiler import OpProfiler
+from utils.path_views import mine_hop_chains, build_path_views, save_path_views
+
+from synthetic_kg import canonical_answers
+
+
+MODES = [
+    {},
+    {'reorder': False},
+    {'id_native': False},
+    {'id_native': False, 'reorder': False},
+    {'batched': False},
+    {'path_views': False},
+    {'result_cache': SubResultCache()},
+]
+
+
+def test_reference_answers_are_not_trivial(reference_answers):
+    # the traces exercise answers of every kind, and failures
+    assert any(answer is None for answer in reference_answers)
+    assert any(isinstance(answer, float) for answer in reference_answers)
+    assert any(isinstance(answer, list) and answer and isinstance(answer[0], str) for answer in reference_answers)
+    assert any(isinstance(answer, list) and answer and isinstance(answer[0], list) for answer in reference_answers)
+
+
+@pytest.mark.parametrize('kwargs', MODES, ids=lambda kwargs: ','.join(kwargs) or 'default')
+def test_execute_trace_matches_reference(kg_path, ops_path, traces, reference_answers, kwargs):
+    interpreter = MimicInterpreter(kg_path, ops_path, **kwargs)
+    assert canonical_answers([interpreter.execute_trace(trace) for trace in traces]) == reference_answers
+    # a second pass runs on cached programs (and cached sub-results)
+    assert canonical_answers([interpreter.execute_trace(trace) for trace in traces]) == reference_answers
+
+
+@pytest.mark.parametrize('kwargs', [{}, {'reorder': False}, {'casefold_equal': True}])
+def test_batched_execute_traces_matches_execute_trace(kg_path, ops_path, traces, kwargs):
+    interpreter = MimicInterpreter(kg_path, ops_path, **kwargs)
+    serial = canonical_answers([interpreter.execute_trace(trace) for trace in traces])
+    # repeated traces share their nodes across the batch
+    assert canonical_answers(interpreter.execute_traces(traces + traces[::-1])) == serial + serial[::-1]
+
+
+def test_casefold_equal_matches_reference(kg_path, ops_path, traces):
+    reference = MimicInterpreter(kg_path, ops_path, id_native=False, reorder=False, casefold_equal=True)
+    interpreter = MimicInterpreter(kg_path, ops_path, casefold_equal=True)
+    assert canonical_answers([interpreter.execute_trace(trace) for trace in traces]) == \
+        canonical_answers([reference.execute_trace(trace) for trace in traces])
+
+
+def test_branch_threads_match_reference(kg_path, ops_path, traces, reference_answers, monkeypatch):
+    # every operand is handed to a branch thread, however small
+    monkeypatch.setattr(utils.interpreter, 'BRANCH_MIN_CARD', 0)
+    interpreter = MimicInterpreter(kg_path, ops_path, branch_threads=4)
+    try:
+        assert canonical_answers([interpreter.execute_trace(trace) for trace in traces]) == reference_answers
+        assert canonical_answers(interpreter.execute_traces(traces)) == reference_answers
+    finally:
+        interpreter.close_pool()
+
+
+def test_snapshot_round_trip(kg_path, ops_path, traces, reference_answers, tmp_path):
+    snapshot_path = str(tmp_path / 'snapshot')
+    built = MimicInterpreter(kg_path, ops_path, snapshot_path)
+    assert is_kg_snapshot(snapshot_path)
+    # the second interpreter maps the snapshot, the KG is not read again
+    loaded = MimicInterpreter(str(tmp_path / 'missing.xml'), ops_path, snapshot_path)
+    assert isinstance(loaded.fwd_index, RelationCSR)
+    for interpreter in (built, loaded, pickle.loads(pickle.dumps(loaded))):
+        assert canonical_answers([interpreter.execute_trace(trace) for trace in traces]) == reference_answers
+
+
+def test_execute_traces_workers(kg_path, ops_path, traces, reference_answers, tmp_path):
+    interpreter = MimicInterpreter(kg_path, ops_path, str(tmp_path / 'snapshot'))
+    try:
+        assert canonical_answers(interpreter.execute_traces(traces, workers=2)) == reference_answers
+        # results come back in input order
+        assert canonical_answers(interpreter.execute_traces(traces[::-1], workers=2)) == reference_answers[::-1]
+    finally:
+        interpreter.close_pool()
+
+
+def test_execute_traces_workers_needs_snapshot(kg_path, ops_path, traces):
+    interpreter = MimicInterpreter(kg_path, ops_path)
+    with pytest.raises(ValueError):
+        interpreter.execute_traces(traces, workers=2)
+
+
+def test_path_views_match_reference(kg_path, ops_path, traces, reference_answers, tmp_path):
+    snapshot_path = str(tmp_path / 'snapshot')
+    trace_file = tmp_path / 'train.json'
+    with open(trace_file, 'w') as f:
+        for trace in traces:
+            f.write(json.dumps({'trace': trace}) + '\n')
+    chains = mine_hop_chains([str(trace_file)], min_count=1)
+    assert chains
+    save_path_views(snapshot_path, *build_path_views(MimicInterpreter(kg_path, ops_path, snapshot_path), chains))
+
+    interpreter = MimicInterpreter(kg_path, ops_path, snapshot_path)
+    assert interpreter.path_views
+    assert any(interpreter.planner.plan(interpreter.compile_trace(trace)).views for trace in traces
+               if interpreter.check_trace_types([trace])[0])
+    assert canonical_answers([interpreter.execute_trace(trace) for trace in traces]) == reference_answers
+    assert canonical_answers(interpreter.execute_traces(traces)) == reference_answers
+
+
+def test_hop_over_empty_entset_fails(kg_path, ops_path):
+    interpreter = MimicInterpreter(kg_path, ops_path)
+    with pytest.raises(ValueError):
+        interpreter.gen_entSet_down(np.array([], dtype=np.int64), '/hadm_id', readable=False)
+    with pytest.raises(ValueError):
+        interpreter.gen_entSet_up('/hadm_id', np.zeros(0, dtype='U1'))
+
+
+def test_empty_intersection_skips_safe_operands(kg_path, ops_path):
+    interpreter = MimicInterpreter(kg_path, ops_path)
+    empty = "<r1>=gen_entset_equal('/gender','f')<exe><r2>=gen_entset_equal('/gender','m')<exe>" \
+            "<r3>=intersect_entsets(<r1>,<r2>)<exe>"
+    # every admission has a patient: the hops cannot fail and are skipped
+    profiler = OpProfiler()
+    trace = empty + "<r4>=gen_entset_equal('/gender','m')<exe><r5>=gen_entset_down(<r4>,'/hadm_id')<exe>" \
+                    "<r6>=gen_entset_up('/hadm_id',<r5>)<exe><r7>=intersect_entsets(<r3>,<r6>)<exe>" \
+                    "<r8>=count_entset(<r7>)<exe>"
+    assert interpreter.execute_trace(trace, profiler) == 0.0
+    assert profiler.ops['gen_entset_up']['skipped'] == 1
+    # a hop over an empty lookup fails the trace, so it is not skipped
+    profiler = OpProfiler()
+    trace = empty + "<r4>=gen_entset_equal('/gender','x')<exe><r5>=gen_entset_down(<r4>,'/hadm_id')<exe>" \
+                    "<r6>=intersect_entsets(<r3>,<r5>)<exe><r7>=count_entset(<r6>)<exe>"
+    assert interpreter.execute_trace(trace, profiler) is None
+    assert all(stats['skipped'] == 0 for stats in profiler.ops.values())
+
+
+def test_type_check_prunes_failing_traces(kg_path, ops_path, traces, reference_answers):
+    interpreter = MimicInterpreter(kg_path, ops_path)
+    flags = interpreter.check_trace_types(traces)
+    # the pruned traces fail, the answered ones all pass
+    assert not all(flags)
+    assert all(answer is None for ok, answer in zip(flags, reference_answers) if not ok)
@@ -0,0 +1,60 @@
+import pytest
+
+from utils.interpreter import MimicInterpreter
+from utils.budget import ExecutionBudget, is_budget_exceeded
+from utils.profiler import OpProfiler
+
+from synthetic_kg import canonical_answers
+
+
+# op counters that do not depend on timing
+COUNTERS = ['calls', 'errors', 'skipped', 'cache_hits', 'in_card_hist', 'out_card_hist']
+
+
+@pytest.fixture
+def interpreter(kg_path, ops_path, tmp_path):
+    interpreter = MimicInterpreter(kg_path, ops_path, str(tmp_path / 'snapshot'))
+    yield interpreter
+    interpreter.close_pool()
+
+
+def op_counters(profiler):
+    return {op: {name: stats[name] for name in COUNTERS} for op, stats in profiler.state()['ops'].items()}
+
+
+def test_budget_through_pool(interpreter, traces, reference_answers):
+    budget = ExecutionBudget(max_cardinality=8)
+    serial = [interpreter.execute_trace(trace, budget=budget) for trace in traces]
+    pooled = interpreter.execute_traces(traces, workers=2, budget=budget)
+    assert [is_budget_exceeded(result) for result in pooled] == [is_budget_exceeded(result) for result in serial]
+    assert any(is_budget_exceeded(result) for result in pooled)
+    # traces within the budget are answered as without one
+    assert not all(is_budget_exceeded(result) for result in pooled)
+    for result, answer in zip(pooled, reference_answers):
+        if not is_budget_exceeded(result):
+            assert canonical_answers([result]) == [answer]
+    # an exceeded budget is not cached as the answer of the trace
+    assert canonical_answers(interpreter.execute_traces(traces, workers=2)) == reference_answers
+
+
+def test_profiler_through_pool(interpreter, traces, reference_answers):
+    serial = OpProfiler()
+    assert canonical_answers([interpreter.execute_trace(trace, profiler=serial) for trace in traces]) == \
+        reference_answers
+    pooled = OpProfiler()
+    assert canonical_answers(interpreter.execute_traces(traces, workers=2, profiler=pooled)) == reference_answers
+    # the profiles of the worker processes are merged into the caller's profiler
+    assert pooled.n_traces == serial.n_traces == len(traces)
+    assert pooled.n_failed == serial.n_failed == reference_answers.count(None)
+    assert op_counters(pooled) == op_counters(serial)
+
+
+def test_profiler_and_budget_through_pool(interpreter, traces):
+    budget = ExecutionBudget(max_cardinality=8)
+    serial = OpProfiler()
+    for trace in traces:
+        interpreter.execute_trace(trace, profiler=serial, budget=budget)
+    pooled = OpProfiler()
+    interpreter.execute_traces(traces, workers=2, profiler=pooled, budget=budget)
+    assert pooled.n_budget_exceeded == serial.n_budget_exceeded > 0
+    assert pooled.n_failed == serial.n_failed
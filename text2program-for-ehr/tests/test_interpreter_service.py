@@ -0,0 +1,151 @@
+import os
+import stat
+import socket
+import threading
+import multiprocessing as mp
+
+import numpy as np
+import pytest
+
+from utils.interpreter import MimicInterpreter
+from utils.interpreter_service import AUTHKEY_ENV, SOCKET_ENV, InterpreterClient, InterpreterService, \
+    connect_interpreter, ensure_interpreter_service, new_authkey, start_interpreter_service, \
+    stop_interpreter_service, wait_for_service
+
+from synthetic_kg import canonical_answers
+
+
+@pytest.fixture
+def socket_path(tmp_path):
+    return str(tmp_path / 'private' / 'interpreter.sock')
+
+
+@pytest.fixture
+def env(monkeypatch):
+    monkeypatch.delenv(SOCKET_ENV, raising=False)
+    monkeypatch.delenv(AUTHKEY_ENV, raising=False)
+    return os.environ
+
+
+@pytest.fixture
+def service(kg_path, ops_path, socket_path, env):
+    authkey = new_authkey()
+    process = start_interpreter_service(socket_path, kg_path, ops_path, authkey=authkey)
+    yield socket_path, authkey
+    stop_interpreter_service(socket_path, process, authkey)
+
+
+def serve_in_thread(service):
+    thread = threading.Thread(target=service.serve_forever, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_answers_through_the_service(service, traces, reference_answers):
+    socket_path, authkey = service
+    with InterpreterClient(socket_path, authkey) as client:
+        assert canonical_answers(client.execute_traces(traces)) == reference_answers
+        assert canonical_answers([client.execute_trace(trace) for trace in traces[:5]]) == reference_answers[:5]
+        assert len(client.check_trace_types(traces)) == len(traces)
+        assert client.ops_path.endswith('.json')
+
+
+def test_socket_is_private(service):
+    socket_path, _ = service
+    assert stat.S_ISSOCK(os.stat(socket_path).st_mode)
+    assert stat.S_IMODE(os.stat(socket_path).st_mode) == 0o600
+    assert stat.S_IMODE(os.stat(os.path.dirname(socket_path)).st_mode) == 0o700
+
+
+def test_clients_need_the_authkey(service):
+    socket_path, authkey = service
+    with pytest.raises(mp.AuthenticationError):
+        InterpreterClient(socket_path, new_authkey())
+    with pytest.raises(ValueError):
+        InterpreterClient(socket_path)
+    # the service keeps serving after rejecting a connection
+    with InterpreterClient(socket_path, authkey) as client:
+        assert client.ping() > 0
+
+
+def test_only_trace_methods_are_served(service, kg_path):
+    socket_path, authkey = service
+    with InterpreterClient(socket_path, authkey) as client:
+        for name in ['append_kg', 'compact', 'save_snapshot', 'load_snapshot']:
+            with pytest.raises(AttributeError):
+                getattr(client, name)
+            with pytest.raises(AttributeError):
+                client.request('call', name, kg_path)
+        with pytest.raises(AttributeError):
+            client.request('getattr', '__class__')
+        with pytest.raises(AttributeError):
+            client.request('remove_socket')
+        assert client.request('call', 'count_litSet', np.array(['a', 'b'])) == 2.0
+
+
+def test_live_socket_is_not_replaced(service, kg_path, ops_path):
+    socket_path, authkey = service
+    other = InterpreterService(MimicInterpreter(kg_path, ops_path), socket_path, new_authkey())
+    with pytest.raises(RuntimeError):
+        other.serve_forever()
+    with InterpreterClient(socket_path, authkey) as client:
+        assert client.ping() > 0
+
+
+def test_stale_socket_is_replaced(kg_path, ops_path, socket_path, env):
+    os.makedirs(os.path.dirname(socket_path), mode=0o700)
+    # bound by a service that is gone
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.bind(socket_path)
+    authkey = new_authkey()
+    service = InterpreterService(MimicInterpreter(kg_path, ops_path), socket_path, authkey)
+    thread = serve_in_thread(service)
+    try:
+        with wait_for_service(socket_path, timeout=30, authkey=authkey) as client:
+            assert client.ping() == os.getpid()
+    finally:
+        service.stop()
+        thread.join(10)
+    assert not os.path.exists(socket_path)
+
+
+def test_other_files_are_not_replaced(kg_path, ops_path, socket_path, env):
+    os.makedirs(os.path.dirname(socket_path), mode=0o700)
+    with open(socket_path, 'w') as f:
+        f.write('data')
+    with pytest.raises(FileExistsError):
+        InterpreterService(MimicInterpreter(kg_path, ops_path), socket_path, new_authkey()).serve_forever()
+    assert os.path.isfile(socket_path)
+
+
+def test_service_needs_a_private_dir_and_an_authkey(kg_path, ops_path, tmp_path, env):
+    shared = tmp_path / 'shared'
+    shared.mkdir()
+    shared.chmod(0o755)
+    with pytest.raises(PermissionError):
+        InterpreterService(MimicInterpreter(kg_path, ops_path), str(shared / 'interpreter.sock'),
+                           new_authkey()).serve_forever()
+    with pytest.raises(ValueError):
+        InterpreterService(MimicInterpreter(kg_path, ops_path), str(shared / 'interpreter.sock'))
+
+
+def test_ensure_service_passes_the_authkey_to_children(kg_path, ops_path, socket_path, env, traces,
+                                                       reference_answers):
+    process = ensure_interpreter_service(socket_path, kg_path, ops_path)
+    try:
+        assert process is not None
+        assert env[SOCKET_ENV] == socket_path
+        authkey = bytes.fromhex(env[AUTHKEY_ENV])
+        # what a child process started from here connects with
+        client = connect_interpreter(kg_path, ops_path)
+        assert isinstance(client, InterpreterClient)
+        with client:
+            assert canonical_answers(client.execute_traces(traces)) == reference_answers
+        # a second call reuses the running service
+        assert ensure_interpreter_service(socket_path, kg_path, ops_path) is None
+        assert env[AUTHKEY_ENV] == authkey.hex()
+        env[AUTHKEY_ENV] = new_authkey().hex()
+        with pytest.raises(RuntimeError):
+            ensure_interpreter_service(socket_path, kg_path, ops_path)
+    finally:
+        stop_interpreter_service(socket_path, process, authkey)
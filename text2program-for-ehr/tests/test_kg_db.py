@@ -0,0 +1,164 @@
+import os
+import sqlite3
+import importlib.util
+
+import pandas as pd
+import pytest
+from rdflib import Graph
+
+from utils.interpreter import MimicInterpreter
+from utils.kg_db import read_kg_columns, read_kg_tables
+
+from synthetic_kg import canonical_answers
+
+
+BUILD_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                            'mimic_sparql', 'build_mimicsparql_kg', 'build_complex_kg_from_mimicsqlstar_db.py')
+NAN = float('nan')
+
+TABLES = {
+    'PATIENTS': pd.DataFrame({
+        'SUBJECT_ID': [1, 2, 3],
+        'NAME': ['Anna Smith', 'Bo\\b Lee', 'Zoë Müller'],
+        'DOB': ['2080-03-01 00:00:00', '2090-12-31 00:00:00', None],
+        'GENDER': ['F', 'm', 'f'],
+        'EXPIRE_FLAG': [0, 1, 1],
+        'DOD': [None, '2150-01-01 00:00:00', '2160-06-30 00:00:00'],
+        'DOD_YEAR': [NAN, 2150.0, 2160.0],
+        'DOB_YEAR': [2080, 2090, NAN],
+    }),
+    'ADMISSIONS': pd.DataFrame({
+        'SUBJECT_ID': [1, 1, 2, 3],
+        'HADM_ID': [100, 101, 200, 300],
+        'MARITAL_STATUS': ['MARRIED', 'MARRIED', None, 'SINGLE'],
+        'AGE': [60, 61, 58, 'nan'],
+        'LANGUAGE': ['ENGL', 'ENGL', 'SPAN', None],
+        'RELIGION': ['CATHOLIC', 'NONE', 'JEWISH', 'CATHOLIC'],
+        'ADMISSION_TYPE': ['EMERGENCY', 'ELECTIVE', 'EMERGENCY', 'URGENT'],
+        'DAYS_STAY': [3, 10, 1, 7],
+        'INSURANCE': ['Medicare', 'Medicare', 'Private', 'Medicaid'],
+        'ETHNICITY': ['WHITE', 'WHITE', 'ASIAN', 'BLACK/AFRICAN AMERICAN'],
+        'ADMISSION_LOCATION': ['EMERGENCY ROOM ADMIT', 'PHYS REFERRAL', 'EMERGENCY ROOM ADMIT', 'TRANSFER'],
+        'DISCHARGE_LOCATION': ['HOME', 'SNF', 'HOME', 'DEAD/EXPIRED'],
+        'DIAGNOSIS': ['SEPSIS', 'CHEST PAIN<ANGINA>', 'FEVER & RASH', 'SEPSIS'],
+        'ADMITYEAR': [2140, 2141, 2148, 2155],
+        'ADMITTIME': ['2140-01-02 10:00:00', '2141-05-06 08:30:00', '2148-07-08 00:00:00', '2155-11-12 23:59:00'],
+        'DISCHTIME': ['2140-01-05 10:00:00', '2141-05-16 08:30:00', '2148-07-09 00:00:00', '2155-11-19 23:59:00'],
+    }),
+    'DIAGNOSES': pd.DataFrame({
+        'DIAGNOSES': [1, 2, 3, 4],
+        'HADM_ID': [100, 101, 200, 300],
+        'ICD9_CODE': ['0389', '4019', '0389', 'V5861'],
+    }),
+    'D_ICD_DIAGNOSES': pd.DataFrame({
+        'ICD9_CODE': ['0389', '4019', 'V5861'],
+        'SHORT_TITLE': ['Septicemia NOS', 'Hypertension NOS', 'Long-term anticoagulants'],
+        'LONG_TITLE': ['Unspecified septicemia', 'Unspecified essential hypertension',
+                       'Long-term (current) use of anticoagulants'],
+    }),
+    'PROCEDURES': pd.DataFrame({
+        'PROCEDURES': [1, 2],
+        'HADM_ID': [100, 300],
+        'ICD9_CODE': ['3893', '9604'],
+    }),
+    'D_ICD_PROCEDURES': pd.DataFrame({
+        'ICD9_CODE': ['3893', '9604'],
+        'SHORT_TITLE': ['Venous cath NEC', 'Insert endotracheal tube'],
+        'LONG_TITLE': ['Venous catheterization, not elsewhere classified', 'Insertion of endotracheal tube'],
+    }),
+    'PRESCRIPTIONS': pd.DataFrame({
+        'PRESCRIPTIONS': [1, 2, 3],
+        'HADM_ID': [100, 200, 200],
+        'ICUSTAY_ID': [5000.0, NAN, 5002.0],
+        'DRUG_TYPE': ['MAIN', 'BASE', 'MAIN'],
+        'DRUG': ['Heparin', 'NS', 'Vancomycin'],
+        'FORMULARY_DRUG_CD': ['HEPA5I', 'NS1000', 'VANC1F'],
+        'ROUTE': ['SC', 'IV', 'IV'],
+        'DRUG_DOSE': ['5000', '1000', '1'],
+    }),
+    'LAB': pd.DataFrame({
+        'LAB': [1, 2, 3],
+        'HADM_ID': [100, 101, 300],
+        'ITEMID': [50800, 50801, 50800],
+        'CHARTTIME': ['2140-01-02 11:00:00', '2141-05-06 09:00:00', '2155-11-13 01:00:00'],
+        'FLAG': ['abnormal', None, 'delta'],
+        'VALUE_UNIT': ['7.4', 'mg/dL', '7.2'],
+    }),
+    'D_LABITEM': pd.DataFrame({
+        'ITEMID': [50800, 50801],
+        'LABEL': ['pH', 'Glucose'],
+        'FLUID': ['Blood', 'Blood'],
+        'CATEGORY': ['Blood Gas', 'Chemistry'],
+    }),
+}
+
+TRACES = [
+    "<r1>=gen_entset_equal('/gender','f')<exe><r2>=count_entset(<r1>)<exe>",
+    "<r1>=gen_entset_equal('/gender','f')<exe><r2>=gen_entset_down(<r1>,'/hadm_id')<exe>"
+    "<r3>=gen_litset(<r2>,'/days_stay')<exe><r4>=average_litset(<r3>)<exe>",
+    "<r1>=gen_entset_equal('/diagnoses_short_title','septicemia nos')<exe>"
+    "<r2>=gen_entset_up('/diagnoses_icd9_code',<r1>)<exe><r3>=gen_entset_up('/diagnoses',<r2>)<exe>"
+    "<r4>=gen_litset(<r3>,'/admission_type')<exe>",
+    "<r1>=gen_entset_equal('/label','ph')<exe><r2>=gen_entset_up('/itemid',<r1>)<exe>"
+    "<r3>=gen_litset(<r2>,'/flag')<exe>",
+    "<r1>=gen_entset_atleast('/age','60')<exe><r2>=gen_litset(<r1>,'/admittime')<exe>",
+    "<r1>=gen_entset_equal('/name','bo b lee')<exe><r2>=gen_litset(<r1>,'/dod_year')<exe>",
+    "<r1>=gen_entset_equal('/diagnosis','fever & rash')<exe><r2>=gen_entset_down(<r1>,'/prescriptions')<exe>"
+    "<r3>=count_entset(<r2>)<exe>",
+]
+# answers of the original interpreter to TRACES on the KG the script serializes from TABLES
+EXPECTED_ANSWERS = [2.0, 6.666666667, ['emergency', 'emergency'], ['abnormal', 'delta'],
+                    ['2140-01-02 10:00:00', '2148-07-08 00:00:00'], ['2150.0'], 2.0]
+
+
+@pytest.fixture(scope='module')
+def build_script():
+    spec = importlib.util.spec_from_file_location('build_complex_kg_from_mimicsqlstar_db', BUILD_SCRIPT)
+    script = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(script)
+    return script
+
+
+@pytest.fixture(scope='module')
+def db_path(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('db') / 'mimicsqlstar.db')
+    db_conn = sqlite3.connect(path)
+    for table, df in TABLES.items():
+        df.to_sql(table, db_conn, index=False)
+    db_conn.close()
+    return path
+
+
+@pytest.fixture(scope='module')
+def xml_path(build_script, db_path):
+    # the KG as the script serializes it
+    db_conn = sqlite3.connect(db_path)
+    kg = Graph()
+    for df, parent_col, subject_col, col_types in read_kg_tables(db_conn):
+        for triple in build_script.table2triples(df, parent_col=parent_col, subject_col=subject_col,
+                                                 col_types=col_types):
+            kg.add(triple)
+    db_conn.close()
+    path = db_path.replace('.db', '_kg.xml')
+    kg.serialize(path, format='xml')
+    return path
+
+
+def test_script_uses_the_shared_mapping(build_script):
+    assert build_script.read_kg_tables is read_kg_tables
+    assert not hasattr(build_script, 'read_kg_columns')
+    assert not hasattr(build_script, 'table2columns')
+
+
+def test_db_columns_match_the_serialized_kg(ops_path, db_path, xml_path):
+    interpreter = MimicInterpreter(xml_path, ops_path)
+    sub, rel, obj = read_kg_columns(db_path)
+    assert len(set(zip(sub, rel, obj))) == len(sub)
+    assert sorted(zip(sub, rel, obj)) == sorted(zip(*interpreter.read_kg_strings(xml_path)))
+    assert ('/subject_id/2', '/name', 'bo b lee') in set(zip(sub, rel, obj))
+
+
+def test_interpreter_from_db(ops_path, db_path, xml_path):
+    for interpreter in [MimicInterpreter(xml_path, ops_path), MimicInterpreter(db_path, ops_path)]:
+        assert canonical_answers([interpreter.execute_trace(trace) for trace in TRACES]) == EXPECTED_ANSWERS
+        assert canonical_answers(interpreter.execute_traces(TRACES)) == EXPECTED_ANSWERS
@@ -0,0 +1,163 @@
+import os
+
+import pytest
+
+import utils.kg_delta
+from utils.interpreter import MimicInterpreter
+from utils.kg_delta import delta_segments, snapshot_delta_seq
+from utils.kg_index import RelationCSR, SegmentedCSR
+from utils.kg_snapshot import current_snapshot_version, snapshot_versions
+
+from synthetic_kg import canonical_answers
+
+
+def answers(interpreter, traces):
+    return canonical_answers([interpreter.execute_trace(trace) for trace in traces])
+
+
+def test_append_in_memory(base_kg_path, kg_path, ops_path, traces, base_reference_answers, reference_answers):
+    interpreter = MimicInterpreter(base_kg_path, ops_path)
+    assert answers(interpreter, traces) == base_reference_answers
+    added = interpreter.append_kg(kg_path)
+    assert added > 0
+    assert isinstance(interpreter.fwd_index, SegmentedCSR)
+    assert answers(interpreter, traces) == reference_answers
+    assert canonical_answers(interpreter.execute_traces(traces)) == reference_answers
+    # triples already in the KG are not appended again
+    assert interpreter.append_kg(kg_path) == 0
+    assert interpreter.delta_seq == 1
+
+
+@pytest.mark.parametrize('kwargs', [{'reorder': False}, {'id_native': False}])
+def test_append_other_modes(base_kg_path, kg_path, ops_path, traces, reference_answers, kwargs):
+    interpreter = MimicInterpreter(base_kg_path, ops_path, **kwargs)
+    interpreter.append_kg(kg_path)
+    assert answers(interpreter, traces) == reference_answers
+
+
+def test_append_in_parts(base_kg_path, kg_path, ops_path, traces, reference_answers, tmp_path):
+    snapshot_path = str(tmp_path / 'snapshot')
+    interpreter = MimicInterpreter(base_kg_path, ops_path, snapshot_path)
+    sub, rel, obj = interpreter.read_kg_strings(kg_path)
+    half = len(sub) // 2
+    # the first part repeats base triples, the second part repeats triples of the first
+    assert interpreter.append_triples(sub[:half], rel[:half], obj[:half]) > 0
+    assert interpreter.append_triples(sub, rel, obj) > 0
+    assert [seq for seq, _ in delta_segments(snapshot_path)] == [1, 2]
+    assert answers(interpreter, traces) == reference_answers
+
+
+def test_deltas_are_loaded_with_the_snapshot(base_kg_path, kg_path, ops_path, traces, base_reference_answers,
+                                             reference_answers, tmp_path):
+    snapshot_path = str(tmp_path / 'snapshot')
+    writer = MimicInterpreter(base_kg_path, ops_path, snapshot_path)
+    # loaded before the append, as by another process
+    reader = MimicInterpreter(base_kg_path, ops_path, snapshot_path)
+    writer.append_kg(kg_path)
+
+    assert answers(reader, traces) == base_reference_answers
+    assert reader.load_deltas() == 1
+    assert answers(reader, traces) == reference_answers
+    assert reader.load_deltas() == 0
+
+    loaded = MimicInterpreter(base_kg_path, ops_path, snapshot_path)
+    assert loaded.delta_seq == 1
+    assert loaded.base_seq == 0
+    assert answers(loaded, traces) == reference_answers
+    try:
+        assert canonical_answers(loaded.execute_traces(traces, workers=2)) == reference_answers
+    finally:
+        loaded.close_pool()
+
+
+def test_compact(base_kg_path, kg_path, ops_path, traces, reference_answers, tmp_path):
+    snapshot_path = str(tmp_path / 'snapshot')
+    interpreter = MimicInterpreter(base_kg_path, ops_path, snapshot_path)
+    reader = MimicInterpreter(base_kg_path, ops_path, snapshot_path)
+    interpreter.append_kg(kg_path)
+    reader.load_deltas()
+
+    assert interpreter.compact(background=False) == snapshot_path
+    assert interpreter.base_seq == interpreter.delta_seq == 1
+    assert snapshot_delta_seq(snapshot_path) == 1
+    assert delta_segments(snapshot_path) == []
+    assert isinstance(interpreter.fwd_index, RelationCSR)
+    assert answers(interpreter, traces) == reference_answers
+    # nothing left to merge
+    assert interpreter.compact(background=False) == snapshot_path
+
+    # a process that mapped the snapshot before compaction catches up on the compacted one
+    reader.load_deltas()
+    assert reader.base_seq == 1
+    assert isinstance(reader.fwd_index, RelationCSR)
+    assert answers(reader, traces) == reference_answers
+    assert answers(MimicInterpreter(base_kg_path, ops_path, snapshot_path), traces) == reference_answers
+
+
+def test_failed_compact_keeps_the_snapshot(base_kg_path, kg_path, ops_path, traces, reference_answers, tmp_path,
+                                           monkeypatch):
+    snapshot_path = str(tmp_path / 'snapshot')
+    interpreter = MimicInterpreter(base_kg_path, ops_path, snapshot_path)
+    interpreter.append_kg(kg_path)
+    rename = os.rename
+
+    def failing_rename(src, dst):
+        # the compacted snapshot cannot be moved in
+        if src.endswith(f'.compact-{os.getpid()}'):
+            raise OSError('rename failed')
+        rename(src, dst)
+
+    monkeypatch.setattr(utils.kg_delta.os, 'rename', failing_rename)
+    with pytest.raises(OSError):
+        interpreter.compact(background=False)
+    monkeypatch.setattr(utils.kg_delta.os, 'rename', rename)
+    assert sorted(os.listdir(tmp_path)) == ['snapshot', f'snapshot.compact-{os.getpid()}']
+    assert answers(MimicInterpreter(base_kg_path, ops_path, snapshot_path), traces) == reference_answers
+    assert answers(interpreter, traces) == reference_answers
+    # and a later compaction goes through, leaving nothing behind but the snapshot
+    assert interpreter.compact(background=False) == snapshot_path
+    assert os.listdir(tmp_path) == ['snapshot']
+    assert answers(MimicInterpreter(base_kg_path, ops_path, snapshot_path), traces) == reference_answers
+
+
+def test_background_compact_keeps_later_deltas(base_kg_path, kg_path, ops_path, traces, reference_answers,
+                                               tmp_path):
+    snapshot_path = str(tmp_path / 'snapshot')
+    interpreter = MimicInterpreter(base_kg_path, ops_path, snapshot_path)
+    sub, rel, obj = interpreter.read_kg_strings(kg_path)
+    half = len(sub) // 2
+    interpreter.append_triples(sub[:half], rel[:half], obj[:half])
+    thread = interpreter.compact()
+    # appended while (or after) the first delta is compacted: stays a delta of the compacted snapshot
+    interpreter.append_triples(sub, rel, obj)
+    thread.join()
+
+    assert interpreter.delta_seq == 2
+    assert interpreter.base_seq == 1
+    assert [seq for seq, _ in delta_segments(snapshot_path)] == [2]
+    assert answers(interpreter, traces) == reference_answers
+    assert answers(MimicInterpreter(base_kg_path, ops_path, snapshot_path), traces) == reference_answers
+
+
+def test_compact_versioned_root(base_kg_path, kg_path, ops_path, traces, reference_answers, tmp_path):
+    snapshot_root = str(tmp_path / 'versions')
+    MimicInterpreter(base_kg_path, ops_path).save_snapshot_version(snapshot_root)
+    base_version = current_snapshot_version(snapshot_root)
+    interpreter = MimicInterpreter(base_kg_path, ops_path, snapshot_root)
+    interpreter.append_kg(kg_path)
+
+    interpreter.compact(background=False)
+    # the merged KG is published as a new version, with the content hash of the full KG
+    version = current_snapshot_version(snapshot_root)
+    assert version != base_version
+    assert version == MimicInterpreter(kg_path, ops_path).save_snapshot_version(str(tmp_path / 'full'))
+    assert sorted(snapshot_versions(snapshot_root)) == sorted([base_version, version])
+    assert answers(interpreter, traces) == reference_answers
+    assert answers(MimicInterpreter(base_kg_path, ops_path, snapshot_root), traces) == reference_answers
+
+
+def test_compact_needs_snapshot(base_kg_path, kg_path, ops_path):
+    interpreter = MimicInterpreter(base_kg_path, ops_path)
+    interpreter.append_kg(kg_path)
+    with pytest.raises(ValueError):
+        interpreter.compact()
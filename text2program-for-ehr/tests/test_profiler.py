@@ -0,0 +1,139 @@
+import json
+import pickle
+
+import pytest
+
+from utils.interpreter import MimicInterpreter
+from utils.profiler import OpProfiler, cardinality, TIME_BUCKETS_MS, CARD_BUCKETS
+from utils.budget import ExecutionBudget
+from utils.result_cache import SubResultCache
+
+from synthetic_kg import TRACES, canonical_answers
+
+
+FEMALE = "<r1>=gen_entset_equal('/gender','f')<exe><r2>=count_entset(<r1>)<exe>"
+FEMALE_ADMISSIONS = "<r1>=gen_entset_equal('/gender','f')<exe><r2>=gen_entset_down(<r1>,'/hadm_id')<exe>" \
+                    "<r3>=gen_entset_equal('/gender','f')<exe><r4>=gen_entset_down(<r3>,'/hadm_id')<exe>" \
+                    "<r5>=intersect_entsets(<r2>,<r4>)<exe><r6>=count_entset(<r5>)<exe>"
+ADMISSIONS = "<r1>=gen_entset_equal('/gender','f')<exe><r2>=gen_entset_down(<r1>,'/hadm_id')<exe>" \
+             "<r3>=count_entset(<r2>)<exe>"
+
+
+@pytest.fixture
+def interpreter(kg_path, ops_path):
+    return MimicInterpreter(kg_path, ops_path)
+
+
+def answer_of(trace, reference_answers):
+    return reference_answers[TRACES.index(trace)]
+
+
+def line_of(explain, head):
+    # the node lines, below the trace header
+    return next(line for line in explain.split('\n')[1:] if head in line)
+
+
+def test_profiled_answers_match_reference(interpreter, traces, reference_answers):
+    profiler = OpProfiler()
+    assert canonical_answers([interpreter.execute_trace(trace, profiler) for trace in traces]) == reference_answers
+    assert profiler.n_traces == len(traces)
+    assert profiler.n_failed == reference_answers.count(None)
+    assert profiler.n_budget_exceeded == 0
+    # every node of every trace shows up in the op stats
+    n_nodes = sum(len(interpreter.explain_trace(trace).records) for trace in traces)
+    assert sum(stats['calls'] + stats['cache_hits'] + stats['skipped'] for stats in profiler.ops.values()) >= n_nodes
+
+
+def test_explain_tree(interpreter, reference_answers):
+    explain = str(interpreter.explain_trace(FEMALE_ADMISSIONS))
+    lines = explain.split('\n')
+    assert lines[0] == f'trace: {FEMALE_ADMISSIONS}'
+    assert lines[1].endswith('result=1')
+    assert lines[2].startswith('count_entset() [n3] time=')
+    assert lines[2].endswith('out=1')
+    assert lines[3].startswith('`- intersect_entsets() [n2] ')
+    # both operands below the intersection, the repeated hop is compiled once and shown once
+    assert [line[:6] for line in lines[4:]] == ['   |- ', '   |  ', '   `- ']
+    assert lines[-1] == "   `- gen_entset_down('/hadm_id') [n1] (shared, see above)"
+    # the output cardinalities are those of the answers
+    n_female, n_admissions = answer_of(FEMALE, reference_answers), answer_of(FEMALE_ADMISSIONS, reference_answers)
+    assert f'out={int(n_admissions)}' in lines[3]
+    assert line_of(explain, "gen_entset_equal('/gender', 'f') [n0]").endswith(f'out={int(n_female)}')
+    assert f'in=[{int(n_female)}] out={int(n_admissions)}' in line_of(explain, "gen_entset_down('/hadm_id') [n1]")
+
+
+def test_explain_failures(interpreter):
+    profile = interpreter.explain_trace("<r1>=gen_entset_equal('/gender','x')<exe>"
+                                        "<r2>=gen_entset_down(<r1>,'/hadm_id')<exe><r3>=count_entset(<r2>)<exe>")
+    explain = str(profile)
+    assert profile.result is None
+    assert explain.split('\n')[1].endswith('result=None')
+    assert line_of(explain, 'gen_entset_equal').endswith('out=None error=ValueError')
+    assert line_of(explain, 'gen_entset_down').endswith('not run')
+    assert line_of(explain, 'count_entset').endswith('not run')
+
+    explain = str(interpreter.explain_trace("<r1>=gen_entset_equal('/gender','f'<exe>"))
+    assert explain.split('\n')[1].startswith('compile error: ')
+
+
+def test_explain_skipped_operand(interpreter):
+    explain = str(interpreter.explain_trace(
+        "<r1>=gen_entset_equal('/gender','f')<exe><r2>=gen_entset_equal('/gender','m')<exe>"
+        "<r3>=intersect_entsets(<r1>,<r2>)<exe><r4>=gen_entset_equal('/gender','m')<exe>"
+        "<r5>=gen_entset_down(<r4>,'/hadm_id')<exe><r6>=gen_entset_up('/hadm_id',<r5>)<exe>"
+        "<r7>=intersect_entsets(<r3>,<r6>)<exe><r8>=count_entset(<r7>)<exe>"))
+    assert line_of(explain, 'gen_entset_up').endswith('skipped')
+    assert line_of(explain, "gen_entset_down").endswith('not run')
+    assert explain.split('\n')[1].endswith('result=1')
+
+
+def test_explain_cache_hit(kg_path, ops_path):
+    interpreter = MimicInterpreter(kg_path, ops_path, result_cache=SubResultCache())
+    first = str(interpreter.explain_trace(ADMISSIONS))
+    assert 'cache=miss' in line_of(first, 'count_entset')
+    second = str(interpreter.explain_trace(ADMISSIONS))
+    assert line_of(second, 'count_entset').endswith('cache=hit out=1')
+    assert line_of(second, 'gen_entset_down').endswith('not run')
+
+
+def test_explain_budget_exceeded(interpreter, reference_answers):
+    n_female = int(answer_of(FEMALE, reference_answers))
+    profiler = OpProfiler()
+    profile = interpreter.explain_trace(ADMISSIONS, profiler, ExecutionBudget(max_cardinality=n_female - 1))
+    explain = str(profile)
+    assert explain.split('\n')[1].endswith(f'result=budget exceeded (cardinality budget exceeded '
+                                           f'({n_female} > {n_female - 1}))')
+    assert line_of(explain, 'gen_entset_equal').endswith('error=BudgetExceeded')
+    assert profiler.n_budget_exceeded == 1
+    assert profiler.n_failed == 0
+
+
+def test_op_profiler_state(interpreter, traces, tmp_path):
+    profiler = OpProfiler()
+    for trace in traces:
+        interpreter.execute_trace(trace, profiler)
+    stats = profiler.ops['gen_entset_equal']
+    assert stats['calls'] > 0
+    assert sum(stats['time_hist']) == stats['calls']
+    assert len(stats['time_hist']) == len(TIME_BUCKETS_MS) + 1
+    assert len(stats['out_card_hist']) == len(CARD_BUCKETS) + 1
+
+    summary = json.loads(open(profiler.dump(str(tmp_path / 'profile.json'))).read())
+    assert summary['n_traces'] == len(traces)
+    assert summary['ops']['gen_entset_equal']['mean_ms'] == pytest.approx(stats['total_ms'] / stats['calls'])
+
+    copy = pickle.loads(pickle.dumps(profiler))
+    assert copy.state() == profiler.state()
+    merged = OpProfiler()
+    merged.merge(profiler.state())
+    merged.merge(copy.state())
+    assert merged.n_traces == 2 * len(traces)
+    assert merged.ops['gen_entset_equal']['calls'] == 2 * stats['calls']
+    assert merged.ops['gen_entset_equal']['max_ms'] == stats['max_ms']
+
+
+def test_cardinality():
+    assert cardinality(None) is None
+    assert cardinality(3.0) == 1
+    assert cardinality('a') == 1
+    assert cardinality([[1, 2], [3]]) == 3
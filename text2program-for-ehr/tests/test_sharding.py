@@ -0,0 +1,95 @@
+import json
+import os
+import pickle
+
+import pytest
+
+from utils.interpreter import MimicInterpreter
+from utils.profiler import OpProfiler
+from utils.budget import ExecutionBudget
+from utils.sharding import SHARDS_META_FILE, ShardedInterpreter, is_sharded_kg, partition_kg, shard_path
+
+from synthetic_kg import canonical_answers
+
+
+@pytest.fixture(scope='module')
+def sharded_paths(kg_path, base_kg_path, ops_path, tmp_path_factory):
+    root = tmp_path_factory.mktemp('shards')
+    interpreter, base_interpreter = MimicInterpreter(kg_path, ops_path), MimicInterpreter(base_kg_path, ops_path)
+    return {(kg, n_shards): partition_kg(kg_interpreter, str(root / f'{kg}_{n_shards}'), n_shards)
+            for kg, kg_interpreter in [('kg', interpreter), ('kg_base', base_interpreter)]
+            for n_shards in [1, 3, 4]}
+
+
+def test_partition(kg_path, ops_path, sharded_paths):
+    interpreter = MimicInterpreter(kg_path, ops_path)
+    path = sharded_paths[('kg', 3)]
+    assert is_sharded_kg(path)
+    assert not is_sharded_kg(os.path.dirname(path))
+    with open(os.path.join(path, SHARDS_META_FILE)) as f:
+        meta = json.load(f)
+    assert meta['n_shards'] == 3
+    assert '/gender' in meta['sub_owned'] and '/hadm_id' in meta['obj_owned']
+    assert '/diagnoses_long_title' not in meta['sub_owned']
+
+    shards = [MimicInterpreter(None, ops_path, shard_path(path, shard)) for shard in range(3)]
+    # owned triples are on exactly one shard, the others on all of them
+    n_triples = len(interpreter.triples['sub'])
+    n_owned = sum(rel in meta['sub_owned'] for rel in interpreter.rel_pool.decode(interpreter.triples['rel']))
+    assert sum(len(shard.triples['sub']) for shard in shards) == n_owned + 3 * (n_triples - n_owned)
+    assert all(0 < len(shard.triples['sub']) < n_triples for shard in shards)
+
+
+@pytest.mark.parametrize('kg', ['kg', 'kg_base'])
+@pytest.mark.parametrize('n_shards', [1, 3, 4])
+@pytest.mark.parametrize('workers', [0, 2])
+def test_sharded_answers(ops_path, sharded_paths, traces, expected_answers, kg, n_shards, workers):
+    interpreter = ShardedInterpreter(sharded_paths[(kg, n_shards)], ops_path, workers=workers)
+    try:
+        assert canonical_answers(interpreter.execute_traces(traces)) == expected_answers[kg]
+        if workers == 0:
+            assert canonical_answers([interpreter.execute_trace(trace) for trace in traces]) == expected_answers[kg]
+    finally:
+        interpreter.close()
+
+
+def test_workers_change(ops_path, sharded_paths, traces, reference_answers):
+    interpreter = ShardedInterpreter(sharded_paths[('kg', 3)], ops_path, workers=0)
+    try:
+        assert interpreter.shards.local is not None
+        assert canonical_answers(interpreter.execute_traces(traces, workers=2)) == reference_answers
+        assert interpreter.shards.workers == 2 and len(interpreter.shards.processes) == 2
+        # more workers than shards: one per shard
+        assert canonical_answers(interpreter.execute_traces(traces, workers=8)) == reference_answers
+        assert interpreter.shards.workers == 3 and len(interpreter.shards.processes) == 3
+        # None keeps the current pool
+        processes = interpreter.shards.processes
+        interpreter.execute_traces(traces[:2])
+        assert interpreter.shards.processes is processes
+        assert canonical_answers(interpreter.execute_traces(traces, workers=0)) == reference_answers
+        assert interpreter.shards.local is not None and not interpreter.shards.processes
+        assert all(not process.is_alive() for process in processes)
+    finally:
+        interpreter.close()
+
+
+def test_pickled_interpreter(ops_path, sharded_paths, traces, reference_answers):
+    interpreter = ShardedInterpreter(sharded_paths[('kg', 3)], ops_path, workers=0)
+    copy = pickle.loads(pickle.dumps(interpreter))
+    try:
+        assert copy.n_shards == 3
+        assert canonical_answers(copy.execute_traces(traces)) == reference_answers
+    finally:
+        interpreter.close()
+        copy.close()
+
+
+def test_profiling_and_budgets_are_rejected(ops_path, sharded_paths, traces):
+    interpreter = ShardedInterpreter(sharded_paths[('kg', 3)], ops_path, workers=0)
+    try:
+        with pytest.raises(ValueError):
+            interpreter.execute_traces(traces, profiler=OpProfiler())
+        with pytest.raises(ValueError):
+            interpreter.execute_trace(traces[0], budget=ExecutionBudget(max_cardinality=5))
+    finally:
+        interpreter.close()
@@ -0,0 +1,120 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from utils.interpreter import MimicInterpreter
+from utils.temporal import parse_datetime
+
+from synthetic_kg import N_SUBJECTS, build_kg, entity, canonical_answers
+
+
+# the original interpreter has no temporal ops: the expected answers are read off the rdflib graph
+def times(kg, rel):
+    return [(str(sub), obj.toPython()) for sub, obj in kg.subject_objects(entity(rel))]
+
+
+def names(kg, subjects):
+    return sorted(str(kg.value(entity(subject), entity('/name'))) for subject in subjects)
+
+
+@pytest.fixture(scope='module')
+def kg():
+    return build_kg(N_SUBJECTS)
+
+
+@pytest.fixture(scope='module')
+def temporal_cases(kg):
+    admittimes = times(kg, '/admittime')
+    charttimes = times(kg, '/charttime')
+    dobs = times(kg, '/dob')
+    # a time that occurs in the KG, for the bounds: before/after are exclusive, between is inclusive
+    admission, admittime = sorted(admittimes)[0]
+    stamp = admittime.isoformat()
+    return [
+        ("<r1>=gen_entset_before('/admittime','2120-01-01')<exe><r2>=gen_entset_up('/hadm_id',<r1>)<exe>"
+         "<r3>=count_entset(<r2>)<exe>",
+         float(sum(t < datetime.datetime(2120, 1, 1) for _, t in admittimes))),
+        ("<r1>=gen_entset_after('/dob','2060-01-01')<exe><r2>=gen_litset(<r1>,'/name')<exe>",
+         names(kg, [s for s, t in dobs if t > datetime.datetime(2060, 1, 1)])),
+        ("<r1>=gen_entset_between('/charttime','2110-01-01','2130-12-31')<exe><r2>=gen_entset_up('/lab',<r1>)<exe>"
+         "<r3>=count_entset(<r2>)<exe>",
+         float(sum(datetime.datetime(2110, 1, 1) <= t <= datetime.datetime(2130, 12, 31) for _, t in charttimes))),
+        # a year stands for its first second
+        ("<r1>=gen_entset_before('/dob','2060')<exe><r2>=gen_litset(<r1>,'/name')<exe>",
+         names(kg, [s for s, t in dobs if t < datetime.datetime(2060, 1, 1)])),
+        (f"<r1>=gen_entset_between('/admittime','{stamp}','{stamp}')<exe><r2>=gen_entset_up('/hadm_id',<r1>)<exe>"
+         f"<r3>=count_entset(<r2>)<exe>",
+         float(sum(t == admittime for _, t in admittimes))),
+        (f"<r1>=gen_entset_after('/admittime','{stamp}')<exe><r2>=count_entset(<r1>)<exe>",
+         float(sum(t > admittime for _, t in admittimes))),
+        # combined with the other ops
+        ("<r1>=gen_entset_equal('/gender','f')<exe><r2>=gen_entset_down(<r1>,'/hadm_id')<exe>"
+         "<r3>=gen_entset_after('/admittime','2120-01-01')<exe><r4>=intersect_entsets(<r2>,<r3>)<exe>"
+         "<r5>=count_entset(<r4>)<exe>",
+         float(sum(t > datetime.datetime(2120, 1, 1) and
+                   str(kg.value(kg.value(predicate=entity('/hadm_id'), object=entity(a)), entity('/gender'))) == 'f'
+                   for a, t in admittimes))),
+        # failing: no date, a relation without times, an empty result
+        ("<r1>=gen_entset_before('/admittime','abc')<exe><r2>=count_entset(<r1>)<exe>", None),
+        ("<r1>=gen_entset_before('/age','2100')<exe><r2>=count_entset(<r1>)<exe>", None),
+        ("<r1>=gen_entset_before('/admittime','1900-01-01')<exe><r2>=count_entset(<r1>)<exe>", None),
+    ]
+
+
+def check(answers, cases):
+    assert answers == canonical_answers([expected for _, expected in cases])
+
+
+def test_expected_answers_are_not_trivial(temporal_cases):
+    assert all(expected for _, expected in temporal_cases[:7])
+
+
+@pytest.mark.parametrize('kwargs', [{}, {'reorder': False}, {'id_native': False},
+                                    {'id_native': False, 'reorder': False}, {'batched': False}],
+                         ids=lambda kwargs: ','.join(kwargs) or 'default')
+def test_temporal_ops(kg_path, ops_path, temporal_cases, kwargs):
+    interpreter = MimicInterpreter(kg_path, ops_path, **kwargs)
+    traces = [trace for trace, _ in temporal_cases]
+    check(canonical_answers([interpreter.execute_trace(trace) for trace in traces]), temporal_cases)
+    check(canonical_answers(interpreter.execute_traces(traces)), temporal_cases)
+
+
+def test_temporal_ops_from_snapshot(kg_path, ops_path, temporal_cases, tmp_path):
+    snapshot_path = str(tmp_path / 'snapshot')
+    MimicInterpreter(kg_path, ops_path, snapshot_path)
+    interpreter = MimicInterpreter(str(tmp_path / 'missing.xml'), ops_path, snapshot_path)
+    traces = [trace for trace, _ in temporal_cases]
+    check(canonical_answers([interpreter.execute_trace(trace) for trace in traces]), temporal_cases)
+    try:
+        check(canonical_answers(interpreter.execute_traces(traces, workers=2)), temporal_cases)
+    finally:
+        interpreter.close_pool()
+
+
+def test_temporal_ops_after_append(base_kg_path, kg_path, ops_path, temporal_cases, tmp_path):
+    # the times of appended triples are indexed like those of the base KG
+    interpreter = MimicInterpreter(base_kg_path, ops_path, str(tmp_path / 'snapshot'))
+    interpreter.append_kg(kg_path)
+    traces = [trace for trace, _ in temporal_cases]
+    check(canonical_answers([interpreter.execute_trace(trace) for trace in traces]), temporal_cases)
+    interpreter.compact(background=False)
+    check(canonical_answers([interpreter.execute_trace(trace) for trace in traces]), temporal_cases)
+
+
+def test_time_estimates_are_exact(kg_path, ops_path, temporal_cases):
+    interpreter = MimicInterpreter(kg_path, ops_path)
+    for trace, expected in temporal_cases[:3]:
+        program = interpreter.compile_trace(trace)
+        idx = next(idx for idx in program.order if program.nodes[idx].op.startswith('gen_entset_'))
+        card = interpreter.planner.plan(program)[idx].card
+        assert card == len(interpreter.execute_trace(trace.split('<exe>')[0] + '<exe>'))
+
+
+def test_parse_datetime():
+    assert parse_datetime('2104-08-28') == np.datetime64('2104-08-28T00:00:00')
+    assert parse_datetime('2104-08-28 08:00:00') == np.datetime64('2104-08-28T08:00:00')
+    assert parse_datetime(2104) == np.datetime64('2104-01-01T00:00:00')
+    assert np.isnat(parse_datetime('abc'))
+    assert np.isnat(parse_datetime(None))
+    assert np.isnat(parse_datetime(True))
@@ -0,0 +1,119 @@
+import pickle
+import random
+
+import pytest
+
+from utils.interpreter import MimicInterpreter
+from utils.program import TRACE_OPS
+from utils.type_checker import ProgramTypeError, TypeChecker, well_typed_first
+
+from synthetic_kg import OPERATIONS, write_operations
+
+
+LITERALS = ['/gender', '/hadm_id', '/name', '/age', '/admittime', '/drug', '/prescriptions', '/lab', '/value_unit',
+            '/hadm_id/100010', 'f', 'patient 3', 'aspirin', 'mg/dl', '7.4', '60', '2120-01-01', 60, 7.4, 2120]
+
+
+def random_trace(rng):
+    # 1 to 5 steps of random ops on the results of earlier steps and literals of the synthetic KG
+    steps = []
+    for step in range(1, rng.randint(1, 5) + 1):
+        op = rng.choice(sorted(TRACE_OPS))
+        args = [f'<r{rng.randint(1, step - 1)}>' if step > 1 and rng.random() < .5 else repr(rng.choice(LITERALS))
+                for _ in range(TRACE_OPS[op].n_args)]
+        steps.append(f"<r{step}>={op}({','.join(args)})<exe>")
+    return ''.join(steps)
+
+
+@pytest.fixture
+def interpreter(kg_path, ops_path):
+    return MimicInterpreter(kg_path, ops_path)
+
+
+def check_error(interpreter, trace):
+    try:
+        TypeChecker().check(interpreter.compile_trace(trace))
+    except ProgramTypeError as e:
+        return str(e)
+    return None
+
+
+def test_answered_traces_are_well_typed(kg_path, base_kg_path, ops_path, traces, expected_answers):
+    for kg, path in [('kg', kg_path), ('kg_base', base_kg_path)]:
+        flags = MimicInterpreter(path, ops_path).check_trace_types(traces)
+        assert all(ok for ok, answer in zip(flags, expected_answers[kg]) if answer is not None)
+
+
+def test_only_failing_traces_are_pruned(interpreter):
+    rng = random.Random(0)
+    traces = [random_trace(rng) for _ in range(3000)]
+    flags = interpreter.check_trace_types(traces)
+    answers = interpreter.execute_traces(traces)
+    assert all(answer is None for ok, answer in zip(flags, answers) if not ok)
+    # the check prunes a good part of the traces that fail, and passes traces that fail on the data
+    n_failed = sum(answer is None for answer in answers)
+    assert flags.count(False) > n_failed / 4
+    assert sum(ok and answer is None for ok, answer in zip(flags, answers)) > 0
+    assert sum(answer is not None for answer in answers) > 100
+
+
+def test_type_errors(interpreter):
+    female = "<r1>=gen_entset_equal('/gender','f')<exe>"
+    assert check_error(interpreter, female + "<r2>=count_entset(<r1>)<exe>") is None
+    # a value where the op looks up entities or strings
+    assert check_error(interpreter, female + "<r2>=count_entset(<r1>)<exe><r3>=gen_entset_down(<r2>,'/hadm_id')<exe>") \
+        == 'argument 1 of gen_entset_down [n2]: expected entSet or litSet or litSets or str, ' \
+           'got the value of count_entset'
+    assert check_error(interpreter, "<r1>=gen_entset_equal('/age',60)<exe>").startswith(
+        'argument 2 of gen_entset_equal [n0]: expected ')
+    assert check_error(interpreter, "<r1>=gen_entset_up('/hadm_id',100010)<exe>") is not None
+    # relations are literal paths
+    assert check_error(interpreter, "<r1>=gen_entset_equal('gender','f')<exe>") is not None
+    assert check_error(interpreter, female + "<r2>=gen_litset(<r1>,<r1>)<exe>") is not None
+    assert check_error(interpreter, "<r1>=gen_entset_atleast(60,'/age')<exe>") is not None
+    # the aggregations need a set
+    assert check_error(interpreter, "<r1>=maximum_litset('7.4')<exe>") is not None
+    assert check_error(interpreter, female + "<r2>=count_entset(<r1>)<exe><r3>=average_litset(<r2>)<exe>") is not None
+
+
+def test_what_the_ops_accept_is_well_typed(interpreter):
+    female = "<r1>=gen_entset_equal('/gender','f')<exe>"
+    for trace in [
+        # the count of a count, a set op on a value and a literal
+        female + "<r2>=count_entset(<r1>)<exe><r3>=count_litset(<r2>)<exe>",
+        female + "<r2>=count_entset(<r1>)<exe><r3>=union_entsets(<r1>,<r2>)<exe>",
+        female + "<r2>=intersect_entsets(<r1>,'/subject_id/1')<exe>",
+        # a litSet into a hop or an equality, a literal entity into a hop
+        female + "<r2>=gen_litset(<r1>,'/name')<exe><r3>=gen_entset_equal('/name',<r2>)<exe>",
+        female + "<r2>=gen_litset(<r1>,'/hadm_id')<exe><r3>=gen_entset_down(<r2>,'/age')<exe>",
+        "<r1>=gen_entset_down('/hadm_id/100010','/age')<exe>",
+        # a number, a str or a value as a bound
+        "<r1>=gen_entset_atleast('/age',60)<exe>",
+        "<r1>=gen_entset_atleast('/age','60')<exe>",
+        female + "<r2>=count_entset(<r1>)<exe><r3>=gen_entset_more('/age',<r2>)<exe>",
+        "<r1>=gen_entset_between('/admittime','2110-01-01',2130)<exe>",
+        # the aggregations of an entSet
+        female + "<r2>=gen_entset_down(<r1>,'/hadm_id')<exe><r3>=gen_entset_down(<r2>,'/age')<exe>"
+                 "<r4>=maximum_litset(<r3>)<exe>",
+    ]:
+        assert check_error(interpreter, trace) is None, trace
+
+
+def test_check_is_built_on_first_use(kg_dir, kg_path, traces):
+    # the operations json plays no part: relation types named like op outputs do not break the interpreter
+    ops_path = write_operations(kg_dir / 'ambiguous_operations.json', [
+        (op, ['entSet' if _type.startswith('rel_') else _type for _type in arg_types], out_type)
+        for op, arg_types, out_type in OPERATIONS])
+    interpreter = MimicInterpreter(kg_path, ops_path)
+    assert interpreter.type_checker is None
+    flags = interpreter.check_trace_types(traces)
+    assert interpreter.type_checker is not None
+    assert flags == MimicInterpreter(kg_path, write_operations(kg_dir / 'operations.json')).check_trace_types(traces)
+    copy = pickle.loads(pickle.dumps(interpreter))
+    assert copy.type_checker is None
+    assert copy.check_trace_types(traces) == flags
+
+
+def test_well_typed_first():
+    assert well_typed_first([True, False, True, False, False, True, True], 3) == [0, 2, 1, 5, 3, 4, 6]
+    assert well_typed_first([], 5) == []
@@ -0,0 +1,78 @@
+import pytest
+
+from utils.interpreter import MimicInterpreter
+from utils.kg_snapshot import current_snapshot_version, snapshot_versions
+from utils.versioned_interpreter import VersionedInterpreter
+
+from synthetic_kg import canonical_answers
+
+
+@pytest.fixture
+def versioned(base_kg_path, ops_path, tmp_path):
+    # first run: publishes the base KG as the first version
+    interpreter = VersionedInterpreter(base_kg_path, ops_path, str(tmp_path / 'versions'))
+    yield interpreter
+    interpreter.close_pool()
+
+
+def test_first_run_publishes_a_version(versioned, traces, base_reference_answers):
+    assert snapshot_versions(versioned.snapshot_root) == [versioned.version]
+    assert current_snapshot_version(versioned.snapshot_root) == versioned.version
+    assert canonical_answers([versioned.execute_trace(trace) for trace in traces]) == base_reference_answers
+    assert canonical_answers(versioned.execute_traces(traces)) == base_reference_answers
+    # other attributes read the interpreter of the current version
+    assert versioned.check_trace_types(traces) == versioned.interpreter.check_trace_types(traces)
+
+
+def test_swap(versioned, kg_path, ops_path, traces, base_reference_answers, reference_answers):
+    base_version = versioned.version
+    # nothing published: the current version stays
+    assert versioned.swap() == base_version
+
+    version = MimicInterpreter(kg_path, ops_path).save_snapshot_version(versioned.snapshot_root)
+    assert version != base_version
+    # published, not picked up before the swap
+    assert canonical_answers([versioned.execute_trace(trace) for trace in traces]) == base_reference_answers
+    assert versioned.swap() == version
+    assert versioned.version == version
+    assert canonical_answers([versioned.execute_trace(trace) for trace in traces]) == reference_answers
+    assert canonical_answers(versioned.execute_traces(traces)) == reference_answers
+
+    # and back to an earlier version on request
+    assert versioned.swap(base_version) == base_version
+    assert canonical_answers(versioned.execute_traces(traces)) == base_reference_answers
+
+
+def test_swap_waits_for_leased_calls(versioned, kg_path, ops_path, traces, base_reference_answers,
+                                     reference_answers):
+    old = versioned.acquire()
+    version = MimicInterpreter(kg_path, ops_path).save_snapshot_version(versioned.snapshot_root)
+    versioned.swap()
+    # a call that started before the swap finishes on its version
+    assert canonical_answers([old.execute_trace(trace) for trace in traces]) == base_reference_answers
+    assert canonical_answers(versioned.execute_traces(traces)) == reference_answers
+    assert old.__dict__
+    versioned.release(old)
+    # its last call returned: the old version is dropped
+    assert not old.__dict__
+    assert versioned.leases == {}
+    assert versioned.version == version
+
+
+def test_swap_retires_idle_interpreter(versioned, kg_path, ops_path):
+    old = versioned.interpreter
+    MimicInterpreter(kg_path, ops_path).save_snapshot_version(versioned.snapshot_root)
+    versioned.swap()
+    assert not old.__dict__
+    assert versioned.interpreter is not old
+
+
+def test_second_run_maps_current_version(versioned, kg_path, ops_path, traces, reference_answers):
+    version = MimicInterpreter(kg_path, ops_path).save_snapshot_version(versioned.snapshot_root)
+    # the KG is not parsed again: the root already has a version
+    loaded = VersionedInterpreter(kg_path + '.missing', ops_path, versioned.snapshot_root)
+    try:
+        assert loaded.version == version
+        assert canonical_answers([loaded.execute_trace(trace) for trace in traces]) == reference_answers
+    finally:
+        loaded.close_pool()
@@ -13,6 +13,8 @@ from utils.data_args import DataTrainingArguments
 from utils.model_args import ModelArguments
 from utils.training_args import TrainingArguments
 
+from utils.interpreter_service import ensure_interpreter_service
+
 from data_loader.data_loader import Text2TraceDataModule
 from model.pl_model import Text2TraceForTransformerModel, Text2TraceForUnilmModel
 
@@ -72,6 +74,14 @@ def main():
 
     # Set seed
     pl.seed_everything(training_args.seed)
+
+    # Share one interpreter (one loaded KG) between the model, validation and evaluation
+    if training_args.interpreter_socket:
+        cur_dir = os.getcwd()
+        ensure_interpreter_service(training_args.interpreter_socket,
+                                   f'{cur_dir}/data/db/mimicstar_kg/mimic_sparqlstar_kg.xml',
+                                   f'{cur_dir}/data/db/mimicstar_kg/mimicprogram_operations.json',
+                                   f'{cur_dir}/data/db/mimicstar_kg/mimic_sparqlstar_kg_snapshot')
     
     # Integrate with TensorBoard
     tnesorboard_config = {}
@@ -4,4 +4,23 @@ from .model_args import *
 from .training_args import *
 from .eval_utils import *
 from .interpreter import *
-from .schema_mimic_trace import *
\ No newline at end of file
+from .schema_mimic_trace import *
+from .kg_snapshot import *
+from .string_pool import *
+from .kg_index import *
+from .program import *
+from .result_cache import *
+from .interpreter_pool import *
+from .entity_set import *
+from .planner import *
+from .temporal import *
+from .profiler import *
+from .budget import *
+from .sharding import *
+from .interpreter_service import *
+from .type_checker import *
+from .batch_executor import *
+from .path_views import *
+from .versioned_interpreter import *
+from .kg_delta import *
+from .kg_db import *
@@ -0,0 +1,142 @@
+from collections import defaultdict
+
+import numpy as np
+
+from utils.program import Ref
+from utils.entity_set import IdEntSet, IdLitSet
+from utils.planner import HOP_OPS, SUB
+
+
+EQUAL_OP = 'gen_entset_equal'
+# ops evaluated group-wise across the programs of a batch
+BATCH_OPS = {EQUAL_OP} | set(HOP_OPS)
+
+
+class BatchExecutor:
+    # id-native execute_traces over a batch of programs. nodes shared by several programs are evaluated once,
+    # and level by level the equality lookups and hops of all programs run as one vectorized probe of the CSR
+    # index (one segmented gather per op). their values seed the per program executions, which evaluate the
+    # remaining ops (set ops, aggregates, decoding) as execute_trace does, so results are identical.
+    # a node whose group evaluation fails or does not apply is left to its program
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+
+    def execute_traces(self, traces):
+        interpreter = self.interpreter
+        programs = []
+        for trace in traces:
+            try:
+                programs.append(interpreter.compile_trace(trace))
+            except Exception:
+                programs.append(None)
+
+        values = self.evaluate_groups([program for program in programs if program is not None])
+        results = []
+        for program in programs:
+            if program is None:
+                results.append(None)
+                continue
+            seeded = {idx: values[program.nodes[idx].key] for idx in program.order
+                      if program.nodes[idx].key in values}
+            try:
+                results.append(interpreter.execute_program(program, results=seeded))
+            except Exception:
+                results.append(None)
+        return results
+
+    def evaluate_groups(self, programs):
+        # node key -> value of every batch op node that could be evaluated group-wise
+        levels, values = defaultdict(dict), dict()
+        for program in programs:
+            depths = dict()
+            for idx in self.needed_nodes(program, values):
+                node = program.nodes[idx]
+                depths[idx] = 1 + max([depths.get(arg.idx, 0) for arg in node.args if isinstance(arg, Ref)] or [0])
+                if node.op in BATCH_OPS and node.key not in values:
+                    levels[depths[idx]].setdefault(node.key, (program, node))
+
+        for depth in sorted(levels):
+            groups = defaultdict(list)
+            for key, (program, node) in levels[depth].items():
+                groups[node.op].append((key, program, node))
+            for op, group in groups.items():
+                if op == EQUAL_OP:
+                    values.update(self.equal_group(group))
+                else:
+                    values.update(self.hop_group(op, group, values))
+        return values
+
+    def needed_nodes(self, program, values):
+        # nodes left to evaluate once the hop chains answered by path views are looked up (into values),
+        # in execution order
+        interpreter = self.interpreter
+        views = interpreter.planner.plan(program).views if interpreter.reorder else {}
+        needed, stack = set(), [program.root]
+        while stack:
+            idx = stack.pop()
+            if idx in needed:
+                continue
+            key = program.nodes[idx].key
+            if idx in views and key not in values:
+                value = interpreter.path_views.lookup(interpreter, *views[idx])
+                if value is not None:
+                    values[key] = value
+            if idx in views and key in values:
+                continue
+            needed.add(idx)
+            stack.extend(arg.idx for arg in program.nodes[idx].args if isinstance(arg, Ref))
+        return [idx for idx in program.order if idx in needed]
+
+    def equal_group(self, group):
+        interpreter = self.interpreter
+        keys, rels, value_ids = [], [], []
+        for key, _, node in group:
+            rel, value = node.args
+            if not isinstance(rel, str) or rel not in interpreter.rel2id or \
+                    not isinstance(value, (str, int, float)):
+                continue
+            ids = interpreter.equal_value_ids(value)
+            keys.append(key)
+            rels.append(np.full(len(ids), interpreter.rel2id[rel], dtype=np.int64))
+            value_ids.append(ids)
+        if not keys:
+            return {}
+        # rows of (rel, value id), the subjects of their triples
+        segments = np.repeat(np.arange(len(keys)), [len(ids) for ids in value_ids])
+        return self.split(keys, np.concatenate(rels), np.concatenate(value_ids), segments, interpreter.rev_index,
+                          interpreter.triples['sub'], IdEntSet)
+
+    def hop_group(self, op, group, values):
+        interpreter = self.interpreter
+        set_pos, rel_pos, in_side, _ = HOP_OPS[op]
+        keys, rels, sources = [], [], []
+        for key, program, node in group:
+            source, rel = node.args[set_pos], node.args[rel_pos]
+            if not isinstance(source, Ref) or not isinstance(rel, str) or rel not in interpreter.rel2id:
+                continue
+            source = values.get(program.nodes[source.idx].key)
+            # the input of a hop has to be a non-empty IdEntSet for the id-native op to apply
+            if not isinstance(source, IdEntSet) or len(source) == 0:
+                continue
+            keys.append(key)
+            rels.append(np.full(len(source.unique_ids()), interpreter.rel2id[rel], dtype=np.int64))
+            sources.append(source.unique_ids())
+        if not keys:
+            return {}
+        index = interpreter.fwd_index if in_side == SUB else interpreter.rev_index
+        column = interpreter.triples['obj'] if in_side == SUB else interpreter.triples['sub']
+        segments = np.repeat(np.arange(len(keys)), [len(ids) for ids in sources])
+        return self.split(keys, np.concatenate(rels), np.concatenate(sources), segments, index, column,
+                          IdLitSet if op == 'gen_litset' else IdEntSet)
+
+    def split(self, keys, rels, ids, segments, index, column, kind):
+        # per key the column values of the edges of its (rel, id) rows; empty results are left out (the op
+        # raises on them)
+        edges, counts = index.gather_keys(rels, ids, segments, len(keys))
+        ids = column[edges]
+        values = dict()
+        for key, part, count in zip(keys, np.split(ids, np.cumsum(counts)[:-1]), counts):
+            if count > 0:
+                values[key] = kind(part)
+        return values
+
@@ -0,0 +1,85 @@
+import time
+
+
+class BudgetExceeded(Exception):
+    # raised inside an execution whose ExecutionBudget ran out; never cached, turned into BUDGET_EXCEEDED
+    def __init__(self, kind, used, limit):
+        super().__init__(f'{kind} budget exceeded ({used} > {limit})')
+        self.kind = kind
+        self.used = used
+        self.limit = limit
+
+
+class BudgetExceededResult:
+    # result of a trace stopped by its budget, distinct from None (a failed trace)
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __reduce__(self):
+        return BudgetExceededResult, ()
+
+    def __bool__(self):
+        return False
+
+    def __repr__(self):
+        return 'BUDGET_EXCEEDED'
+
+
+BUDGET_EXCEEDED = BudgetExceededResult()
+
+
+def is_budget_exceeded(result):
+    return result is BUDGET_EXCEEDED
+
+
+class ExecutionBudget:
+    # resource limits of a single trace execution (None: unlimited):
+    #   max_cardinality: items of any intermediate result, checked before a hop gathers its edges
+    #   max_bytes: bytes held by all intermediate results of the execution
+    #   max_seconds: wall time, checked between ops
+    def __init__(self, max_cardinality=None, max_bytes=None, max_seconds=None):
+        self.max_cardinality = max_cardinality
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+
+    def start(self):
+        return BudgetMeter(self)
+
+    def __repr__(self):
+        return f'ExecutionBudget(max_cardinality={self.max_cardinality}, max_bytes={self.max_bytes}, ' \
+               f'max_seconds={self.max_seconds})'
+
+
+class BudgetMeter:
+    # usage of one execution against its budget
+    __slots__ = ('budget', 'deadline', 'bytes_used')
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.deadline = None if budget.max_seconds is None else time.perf_counter() + budget.max_seconds
+        self.bytes_used = 0
+
+    def check_time(self):
+        if self.deadline is not None:
+            now = time.perf_counter()
+            if now > self.deadline:
+                raise BudgetExceeded('time', f'{now - self.deadline + self.budget.max_seconds:.3f}s',
+                                     f'{self.budget.max_seconds}s')
+
+    def check_output(self, cardinality, nbytes=0):
+        # before an op materializes cardinality items of nbytes bytes
+        limit = self.budget.max_cardinality
+        if limit is not None and cardinality is not None and cardinality > limit:
+            raise BudgetExceeded('cardinality', cardinality, limit)
+        limit = self.budget.max_bytes
+        if limit is not None and self.bytes_used + nbytes > limit:
+            raise BudgetExceeded('bytes', self.bytes_used + nbytes, limit)
+
+    def charge(self, cardinality, nbytes):
+        # after an op produced its result
+        self.check_output(cardinality, nbytes)
+        self.bytes_used += nbytes
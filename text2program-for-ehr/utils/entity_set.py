@@ -0,0 +1,168 @@
+import numpy as np
+
+
+# sets covering at least this fraction of the id universe are stored as bitsets
+BITSET_DENSITY = 1 / 32
+POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.int64)
+
+
+def as_id_array(ids):
+    ids = np.asarray(ids)
+    if ids.dtype.kind not in 'iu':
+        raise TypeError(f'entity ids must be integers, got {ids.dtype}')
+    return ids.reshape(-1).astype(np.int64, copy=False)
+
+
+class EntitySet:
+    # set of dense integer ids in [0, universe):
+    #   sparse sets keep a sorted unique id array (ids), dense ones a packed little-endian uint64 bitset (words).
+    # the representation is picked from the density after every operation
+    __slots__ = ('universe', 'ids', 'words', '_count')
+
+    def __init__(self, universe, ids=None, words=None, count=None):
+        self.universe = universe
+        self.ids = ids
+        self.words = words
+        self._count = count
+
+    @classmethod
+    def from_ids(cls, ids, universe):
+        ids = as_id_array(ids)
+        if len(ids) and (ids.min() < 0 or ids.max() >= universe):
+            raise KeyError(int(ids[(ids < 0) | (ids >= universe)][0]))
+        if len(ids) >= universe * BITSET_DENSITY:
+            mask = np.zeros(cls.n_words(universe) * 64, dtype=bool)
+            mask[ids] = True
+            return cls.from_mask(mask, universe)
+        return cls(universe, ids=np.unique(ids))
+
+    @classmethod
+    def from_mask(cls, mask, universe):
+        return cls(universe, words=np.packbits(mask, bitorder='little').view(np.uint64)).normalized()
+
+    @staticmethod
+    def n_words(universe):
+        return (universe + 63) // 64
+
+    @property
+    def nbytes(self):
+        return (self.ids if self.ids is not None else self.words).nbytes
+
+    @property
+    def is_bitset(self):
+        return self.words is not None
+
+    def __len__(self):
+        if self._count is None:
+            self._count = len(self.ids) if self.ids is not None else \
+                int(POPCOUNT_TABLE[self.words.view(np.uint8)].sum())
+        return self._count
+
+    def to_ids(self):
+        # sorted unique ids, the same array np.unique / np.intersect1d / np.union1d would produce
+        if self.ids is not None:
+            return self.ids
+        bits = np.unpackbits(self.words.view(np.uint8), bitorder='little')
+        return np.flatnonzero(bits).astype(np.int64)
+
+    def to_words(self):
+        if self.words is not None:
+            return self.words
+        mask = np.zeros(self.n_words(self.universe) * 64, dtype=bool)
+        mask[self.ids] = True
+        return np.packbits(mask, bitorder='little').view(np.uint64)
+
+    def contains(self, ids):
+        # membership test of every id, ids must be inside the universe
+        ids = as_id_array(ids)
+        if self.words is not None:
+            return ((self.words[ids >> 6] >> (ids & 63).astype(np.uint64)) & np.uint64(1)).astype(bool)
+        pos = np.searchsorted(self.ids, ids)
+        pos[pos == len(self.ids)] = 0
+        return self.ids[pos] == ids if len(self.ids) else np.zeros(len(ids), dtype=bool)
+
+    def normalized(self):
+        dense = len(self) >= self.universe * BITSET_DENSITY
+        if dense and self.words is None:
+            return EntitySet(self.universe, words=self.to_words(), count=self._count)
+        if not dense and self.words is not None:
+            return EntitySet(self.universe, ids=self.to_ids(), count=self._count)
+        return self
+
+    def intersect(self, other):
+        self.check_universe(other)
+        if self.words is not None and other.words is not None:
+            return EntitySet(self.universe, words=self.words & other.words).normalized()
+        if self.words is not None:
+            return EntitySet(self.universe, ids=other.ids[self.contains(other.ids)])
+        if other.words is not None:
+            return EntitySet(self.universe, ids=self.ids[other.contains(self.ids)])
+        return EntitySet(self.universe, ids=np.intersect1d(self.ids, other.ids, assume_unique=True))
+
+    def union(self, other):
+        self.check_universe(other)
+        if self.words is not None or other.words is not None:
+            return EntitySet(self.universe, words=self.to_words() | other.to_words()).normalized()
+        return EntitySet(self.universe, ids=np.union1d(self.ids, other.ids)).normalized()
+
+    def check_universe(self, other):
+        if self.universe != other.universe:
+            raise ValueError(f'entity sets over different universes ({self.universe} != {other.universe})')
+
+    def __and__(self, other):
+        return self.intersect(other)
+
+    def __or__(self, other):
+        return self.union(other)
+
+    def __repr__(self):
+        kind = 'bitset' if self.words is not None else 'ids'
+        return f'EntitySet({len(self)} of {self.universe}, {kind})'
+
+
+class IdEntSet:
+    # id-native entSet: either a multiset of ids in triple order (output of a gen_* op, decoded as is)
+    # or a set (output of intersect/union, decoded as sorted unique strings of width chars like np.intersect1d)
+    __slots__ = ('ids', 'is_set', 'width', '_unique')
+
+    def __init__(self, ids, is_set=False, width=None):
+        self.ids = ids
+        self.is_set = is_set
+        self.width = width
+        self._unique = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def to_ids(self):
+        return self.ids.to_ids() if isinstance(self.ids, EntitySet) else self.ids
+
+    def unique_ids(self):
+        if self._unique is None:
+            self._unique = self.to_ids() if self.is_set else np.unique(self.ids)
+        return self._unique
+
+    @property
+    def nbytes(self):
+        return self.ids.nbytes
+
+    def __repr__(self):
+        return f"IdEntSet({len(self)} ids, {'set' if self.is_set else 'multiset'})"
+
+
+class IdLitSet:
+    # id-native litSet: obj ids in triple order, decoded (and shortened by obj_to_nl) only when materialized
+    __slots__ = ('ids',)
+
+    def __init__(self, ids):
+        self.ids = ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def nbytes(self):
+        return self.ids.nbytes
+
+    def __repr__(self):
+        return f'IdLitSet({len(self)} ids)'
@@ -9,6 +9,7 @@ from operator import itemgetter
 from sumeval.metrics.rouge import RougeCalculator
 
 from utils.interpreter import MimicInterpreter
+from utils.interpreter_service import InterpreterClient
 
 # util function for evaluation
 def gather_evaluation_outputs(epoch_outputs, recover=False):
@@ -116,16 +117,30 @@ def clean_for_condition_quote(pred):
             pred = pred.replace(filtered, new_value)
     return pred
 
-def get_flag_for_execution_accuracy(pred, interpreter, answer):
+def clean_pred_for_execution(pred):
     pred = clean_text_for_spacing(pred)
     pred = clean_for_condition_quote(pred)
+    return pred
+
+def get_flag_for_execution_accuracy(pred, interpreter, answer):
+    output_pred = interpreter.execute_trace(clean_pred_for_execution(pred))
+    return check_execution_accuracy(output_pred, answer)
+
+def get_flags_for_execution_accuracy(preds, interpreter, answers, workers=None):
+    # batched version of get_flag_for_execution_accuracy, the traces run through interpreter.execute_traces
+    # (an interpreter service checks the answers itself and only sends the flags back)
+    if isinstance(interpreter, InterpreterClient):
+        return interpreter.check_answers(preds, answers, workers)
+    output_preds = interpreter.execute_traces([clean_pred_for_execution(pred) for pred in preds], workers=workers)
+    return [check_execution_accuracy(output_pred, answer) for output_pred, answer in zip(output_preds, answers)]
+
+def check_execution_accuracy(output_pred, answer):
     try:
         if type(answer) is str:
             answer = [list(item) for item in set(tuple(row) for row in eval(answer))]
         else:
             answer = [list(item) for item in set(tuple(row) for row in eval(str(answer)))]
         output_gt = answer
-        output_pred = interpreter.execute_trace(pred)
         ex_flag = False
         first_all_digit, second_all_digit = True, True
         if len(answer[0]) == 2:
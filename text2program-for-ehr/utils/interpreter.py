@@ -3,19 +3,115 @@ import glob
 import json
 import re
 import time
+import threading
 from rdflib import Graph, URIRef
 import numpy as np
 import pandas as pd
 from collections import Counter
 from itertools import chain
 
+from utils.kg_snapshot import is_kg_snapshot, save_kg_snapshot, load_kg_snapshot, resolve_kg_snapshot, \
+    save_kg_snapshot_version, kg_content_hash
+from utils.string_pool import StringPool
+from utils.kg_index import RelationCSR, SortedValueIndex, SegmentedCSR
+from utils.program import TRACE_OPS, PROGRAM_CACHE, Ref, TraceSyntaxError, extend_operations
+from utils.result_cache import CachedError, result_nbytes
+from utils.interpreter_pool import InterpreterPool, BranchPool
+from utils.entity_set import EntitySet, IdEntSet, IdLitSet
+from utils.planner import KGStats, Planner, INTERSECT_OP, HOP_OPS, SUB
+from utils.type_checker import TypeChecker, ProgramTypeError
+from utils.batch_executor import BatchExecutor
+from utils.path_views import PathViews
+from utils.kg_delta import delta_segments, snapshot_delta_seq, save_kg_delta, build_kg_delta, apply_kg_delta, compact_kg
+from utils.kg_db import read_kg_columns
+from utils.temporal import build_time_column, time_triples_mask, parse_datetime
+from utils.profiler import TraceProfile, cardinality
+from utils.budget import BudgetExceeded, BUDGET_EXCEEDED
+
+
+# guards starting and replacing the process pools of execute_traces (the interpreter may serve several threads)
+POOL_LOCK = threading.RLock()
+# sub-programs estimated to produce fewer items than this are cheaper to evaluate than to hand to a branch thread
+BRANCH_MIN_CARD = 1000
+
+
+class Execution:
+    # state of one execute_program call: memoized (or seeded) node results, the plan (None: evaluation in
+    # program order), id-native mode, the optional TraceProfile and BudgetMeter, and the BranchPool running
+    # independent sub-programs (None: one thread)
+    __slots__ = ('program', 'results', 'plan', 'id_native', 'profile', 'meter', 'branches')
+
+    def __init__(self, program, plan=None, id_native=False, profile=None, meter=None, results=None, branches=None):
+        self.program = program
+        self.results = dict() if results is None else results
+        self.plan = plan
+        self.id_native = id_native
+        self.profile = profile
+        self.meter = meter
+        self.branches = branches
+
 
 class MimicInterpreter:
-    def __init__(self, kg_path, ops_path):
-        self.kg = Graph()
-        self.kg.parse(kg_path, format='xml', publicID='/')
-        self.triples = self.kg2triples(self.kg)
-        self.triples_num_idx = np.vectorize(self.isfloat)(self.triples['obj_str'])
+    def __init__(self, kg_path, ops_path, snapshot_path=None, casefold_equal=False, program_cache=None,
+                 result_cache=None, workers=1, reorder=True, id_native=True, profiler=None, budget=None,
+                 batched=True, branch_threads=1, path_views=True):
+        self.kg_path = kg_path
+        # a versioned snapshot root is pinned to its published version (swapped by VersionedInterpreter)
+        snapshot_path = resolve_kg_snapshot(snapshot_path)
+        self.snapshot_path = snapshot_path
+        self.casefold_equal = casefold_equal
+        # default number of processes used by execute_traces
+        self.workers = workers
+        self._pool = None
+        # cost-based evaluation order (most selective intersection operand first, early exit on empty)
+        self.reorder = reorder
+        self.planner = Planner(self)
+        # execute_traces evaluates the lookups and hops of all its programs group-wise (id-native only)
+        self.batched = batched
+        self.batch_executor = BatchExecutor(self)
+        # threads per execution: independent operands of set ops are evaluated concurrently (1: sequentially)
+        self.branch_threads = branch_threads
+        self._branch_pool = None
+        # execute_trace keeps intermediate results as ids and decodes only the final answer
+        self.id_native = id_native
+        self.program_cache = PROGRAM_CACHE if program_cache is None else program_cache
+        # optional SubResultCache shared by every program run on this KG (None disables memoization)
+        self.result_cache = result_cache
+        # optional OpProfiler every execute_trace reports to (per call: execute_trace(trace, profiler=...))
+        self.profiler = profiler
+        # optional ExecutionBudget of every trace, a trace running out of it returns BUDGET_EXCEEDED
+        self.budget = budget
+        # hop chains materialized in the snapshot by utils/path_views.py, answered by a lookup in planned programs
+        # (mapped with the snapshot, unused while delta segments extend it)
+        self.use_path_views = path_views
+        self.path_views = None
+        # delta segments (utils/kg_delta.py): last seq applied, last seq merged into the snapshot arrays.
+        # appends and compactions take delta_lock
+        self.delta_seq = self.base_seq = 0
+        self.delta_lock = threading.Lock()
+        if snapshot_path is not None and is_kg_snapshot(snapshot_path):
+            self.kg = None
+            self.load_snapshot(snapshot_path)
+        else:
+            if self.is_kg_db(kg_path):
+                # same triples as the xml serialized from this db, without rdflib and xml in between
+                self.kg = None
+                self.triples = self.db2triples(kg_path)
+            else:
+                self.kg = Graph()
+                self.kg.parse(kg_path, format='xml', publicID='/')
+                self.triples = self.kg2triples(self.kg)
+            self.sub_obj_isnum, self.sub_obj_num = self.build_numeric_pool(self.sub_obj_pool)
+            self.sub_obj_isuri, self.sub_obj_nl_isnum, self.sub_obj_nl_num = self.build_nl_numeric_pool(self.sub_obj_pool)
+            self.sub_obj_time = build_time_column(self.sub_obj_pool, self.triples, self.rel2id)
+            self.triples_num_idx = self.sub_obj_isnum[self.triples['obj']]
+            self.build_indexes()
+            if snapshot_path is not None:
+                self.save_snapshot(snapshot_path)
+                # from here on the arrays are the mapped snapshot: every process attached to it shares its pages
+                # instead of holding a private copy (the rdflib graph is not needed anymore)
+                self.kg = None
+                self.load_snapshot(snapshot_path)
 
         self.ops_path = ops_path
         self.idx2op, self.op2idx, self.idx2type, self.type2idx, self.op2argtypes_mat, self.op2outtype_mat, \
@@ -23,6 +119,192 @@ class MimicInterpreter:
 
         self.n_ops = len(self.idx2op)
         self.n_types = len(self.idx2type)
+        # static check of programs, built by the first check_trace_types
+        self.type_checker = None
+
+    def __getstate__(self):
+        # pickled (spawned DataLoader workers, DDP ranks) as a reference to the KG snapshot: the receiving
+        # process maps the same files instead of unpickling a copy of every array
+        if self.snapshot_path is None:
+            state = self.__dict__.copy()
+            state.update(_pool=None, _branch_pool=None, planner=None, type_checker=None, batch_executor=None,
+                         delta_lock=None)
+            return state
+        if not is_kg_snapshot(self.snapshot_path):
+            self.save_snapshot(self.snapshot_path)
+        interpreter_kwargs = {'casefold_equal': self.casefold_equal, 'result_cache': self.result_cache,
+                              'workers': self.workers, 'reorder': self.reorder, 'id_native': self.id_native,
+                              'profiler': self.profiler, 'budget': self.budget, 'batched': self.batched,
+                              'branch_threads': self.branch_threads, 'path_views': self.use_path_views}
+        if self.program_cache is not PROGRAM_CACHE:
+            interpreter_kwargs['program_cache'] = self.program_cache
+        return {'snapshot_ref': (self.kg_path, self.ops_path, self.snapshot_path, interpreter_kwargs)}
+
+    def __setstate__(self, state):
+        if 'snapshot_ref' in state:
+            kg_path, ops_path, snapshot_path, interpreter_kwargs = state['snapshot_ref']
+            self.__init__(kg_path, ops_path, snapshot_path, **interpreter_kwargs)
+        else:
+            self.__dict__.update(state)
+            self.delta_lock = threading.Lock()
+            self.planner = Planner(self)
+            self.batch_executor = BatchExecutor(self)
+
+    def save_snapshot(self, snapshot_path):
+        return save_kg_snapshot(snapshot_path, *self.snapshot_arrays())
+
+    def save_snapshot_version(self, snapshot_root, publish=True):
+        # new content-hashed version under a versioned snapshot root, see utils/versioned_interpreter.py
+        arrays, meta = self.snapshot_arrays()
+        version = kg_content_hash(self.sub_obj_pool.tolist(), self.rel_pool.tolist(), self.triples, arrays)
+        return save_kg_snapshot_version(snapshot_root, version, arrays, meta, publish)
+
+    def snapshot_arrays(self):
+        if isinstance(self.fwd_index, SegmentedCSR):
+            # delta segments are merged: full indexes over all the triples, built on a detached copy
+            merged = self.detached()
+            merged.build_indexes()
+            return merged.snapshot_arrays()
+        arrays = {
+            'sub': self.triples['sub'],
+            'rel': self.triples['rel'],
+            'obj': self.triples['obj'],
+            'triples_num_idx': self.triples_num_idx,
+            'sub_obj_isnum': self.sub_obj_isnum,
+            'sub_obj_num': self.sub_obj_num,
+            'sub_obj_isuri': self.sub_obj_isuri,
+            'sub_obj_nl_isnum': self.sub_obj_nl_isnum,
+            'sub_obj_nl_num': self.sub_obj_nl_num,
+            'sub_obj_time': self.sub_obj_time,
+        }
+        arrays.update(self.sub_obj_pool.to_arrays('sub_obj'))
+        arrays.update(self.rel_pool.to_arrays('rel'))
+        arrays.update(self.index_arrays())
+        meta = {'n_triples': int(len(self.triples['sub'])),
+                'n_sub_obj': len(self.sub_obj_pool),
+                'n_rel': len(self.rel_pool)}
+        return arrays, meta
+
+    def load_snapshot(self, snapshot_path):
+        arrays, meta = load_kg_snapshot(snapshot_path)
+        self.triples = {'sub': arrays['sub'], 'rel': arrays['rel'], 'obj': arrays['obj']}
+        self.triples_num_idx = arrays['triples_num_idx']
+        self.sub_obj_isnum = arrays['sub_obj_isnum']
+        self.sub_obj_num = arrays['sub_obj_num']
+        self.set_vocab(StringPool.from_arrays(arrays, 'sub_obj'), StringPool.from_arrays(arrays, 'rel'))
+        if 'sub_obj_nl_num' in arrays:
+            self.sub_obj_isuri = arrays['sub_obj_isuri']
+            self.sub_obj_nl_isnum = arrays['sub_obj_nl_isnum']
+            self.sub_obj_nl_num = arrays['sub_obj_nl_num']
+        else:
+            self.sub_obj_isuri, self.sub_obj_nl_isnum, self.sub_obj_nl_num = self.build_nl_numeric_pool(self.sub_obj_pool)
+        if 'sub_obj_time' in arrays:
+            self.sub_obj_time = arrays['sub_obj_time']
+        else:
+            self.sub_obj_time = build_time_column(self.sub_obj_pool, self.triples, self.rel2id)
+        self.build_indexes(arrays)
+        self.delta_seq = self.base_seq = meta.get('delta_seq', 0)
+        for seq, path in delta_segments(snapshot_path):
+            if seq > self.delta_seq:
+                self.apply_delta(*load_kg_snapshot(path), seq)
+        if self.use_path_views and self.delta_seq == self.base_seq:
+            self.path_views = PathViews(snapshot_path)
+
+    def reload_snapshot(self, snapshot_path):
+        # maps a compacted snapshot of the current KG (same ids, same triple order) in place of the arrays in use:
+        # executions reading a mix of both still see the same KG
+        self.snapshot_path = snapshot_path
+        self.load_snapshot(snapshot_path)
+        self.planner = Planner(self)
+
+    def detached(self):
+        # shallow copy of the attributes, unaffected by later appends (arrays are replaced, never modified)
+        interpreter = object.__new__(type(self))
+        interpreter.__dict__.update(self.__dict__)
+        return interpreter
+
+    def apply_delta(self, arrays, meta, seq):
+        state = apply_kg_delta(self, arrays, meta)
+        # plans and cached results were made without the delta, the path views do not hold it
+        state.update(delta_seq=seq, planner=Planner(self), path_views=None)
+        self.__dict__.update(state)
+        if self.result_cache is not None:
+            self.result_cache.clear()
+        if self._pool is not None:
+            # its workers mapped the KG without the delta
+            self._pool.terminate()
+            self._pool = None
+
+    def append_triples(self, sub, rel, obj):
+        # appends the (sub, rel, obj) string triples missing from the KG as a delta segment, saved in the snapshot
+        # when there is one; executions started afterwards see them. returns the number of triples added
+        with self.delta_lock:
+            self.load_deltas()
+            delta = build_kg_delta(self, sub, rel, obj)
+            if delta is None:
+                return 0
+            arrays, meta = delta
+            seq = self.delta_seq + 1
+            if self.snapshot_path is not None:
+                save_kg_delta(self.snapshot_path, seq, arrays, meta)
+            self.apply_delta(arrays, meta, seq)
+            return meta['n_new_triples']
+
+    def append_kg(self, kg_path):
+        # the triples of a KG xml or mimicsqlstar db (e.g. of new admissions only), see append_triples
+        return self.append_triples(*self.read_kg_strings(kg_path))
+
+    def load_deltas(self):
+        # applies the delta segments appended to the snapshot by another process since it was loaded, returns
+        # their number
+        if self.snapshot_path is None:
+            return 0
+        if snapshot_delta_seq(self.snapshot_path) > self.base_seq:
+            # compacted meanwhile: the same KG lineage, mapped again with the deltas that follow
+            delta_seq = self.delta_seq
+            self.reload_snapshot(self.snapshot_path)
+            return self.delta_seq - delta_seq
+        segments = [(seq, path) for seq, path in delta_segments(self.snapshot_path) if seq > self.delta_seq]
+        for seq, path in segments:
+            self.apply_delta(*load_kg_snapshot(path), seq)
+        return len(segments)
+
+    def compact(self, background=True):
+        # merges the delta segments into the snapshot (full indexes instead of one index per segment), by default
+        # in a thread (returned); executions and appends go on meanwhile
+        if self.snapshot_path is None:
+            raise ValueError('compact needs the interpreter built with a snapshot_path')
+        if background:
+            thread = threading.Thread(target=compact_kg, args=(self,), daemon=True)
+            thread.start()
+            return thread
+        return compact_kg(self)
+
+    def build_indexes(self, arrays=None):
+        # indexes stored in a snapshot are mapped as they are, missing ones are built from the triples
+        arrays = arrays or {}
+        n_rels = len(self.rel_pool)
+        self.fwd_index = RelationCSR.from_arrays(arrays, 'fwd') if RelationCSR.has_arrays(arrays, 'fwd') \
+            else RelationCSR.build(self.triples['sub'], self.triples['rel'], n_rels)
+        self.rev_index = RelationCSR.from_arrays(arrays, 'rev') if RelationCSR.has_arrays(arrays, 'rev') \
+            else RelationCSR.build(self.triples['obj'], self.triples['rel'], n_rels)
+        self.num_index = SortedValueIndex.from_arrays(arrays, 'num') if SortedValueIndex.has_arrays(arrays, 'num') \
+            else SortedValueIndex.build(self.sub_obj_num[self.triples['obj']], self.triples['rel'],
+                                        self.triples_num_idx, n_rels)
+        self.time_index = SortedValueIndex.from_arrays(arrays, 'time') if SortedValueIndex.has_arrays(arrays, 'time') \
+            else SortedValueIndex.build(self.sub_obj_time[self.triples['obj']], self.triples['rel'],
+                                        time_triples_mask(self.sub_obj_time, self.triples, self.rel2id), n_rels)
+        self.stats = KGStats.build(self.fwd_index, self.rev_index, self.num_index, self.triples,
+                                   len(self.sub_obj_pool), n_rels, arrays, self.time_index)
+
+    def index_arrays(self):
+        arrays = dict()
+        arrays.update(self.fwd_index.to_arrays('fwd'))
+        arrays.update(self.rev_index.to_arrays('rev'))
+        arrays.update(self.num_index.to_arrays('num'))
+        arrays.update(self.time_index.to_arrays('time'))
+        arrays.update(self.stats.to_arrays('stats'))
+        return arrays
 
     def build_ops(self):
         None_op = 'no_op'
@@ -35,13 +317,16 @@ class MimicInterpreter:
             for line in json_file:
                 ops.append(json.loads(line))
 
-                n_args4op = len(ops[-1]['arg_types'])
-                if n_args4op > max_args:
-                    max_args = n_args4op
+        # ops added to the interpreter after the json was generated are registered with it
+        ops = extend_operations(ops)
+        for op in ops:
+            n_args4op = len(op['arg_types'])
+            if n_args4op > max_args:
+                max_args = n_args4op
 
-                ops_c.update([ops[-1]['name']])
-                types_c.update(ops[-1]['arg_types'])
-                types_c.update([ops[-1]['out_type']])
+            ops_c.update([op['name']])
+            types_c.update(op['arg_types'])
+            types_c.update([op['out_type']])
 
         idx2op = [None_op] + [op for op, count in ops_c.items()]
         idx2type = [None_type] + [types for types, count in types_c.items() if types != "None"]
@@ -58,32 +343,103 @@ class MimicInterpreter:
         return idx2op, op2idx, idx2type, type2idx, op2argtypes_mat, op2outtype_mat, max_args
 
     def kg2triples(self, kg):
-        triples = dict()
+        return self.strings2triples(*self.graph_strings(kg))
+
+    def graph_strings(self, kg):
         sub, rel, obj = [], [], []
         for t in kg:
             sub.append(t[0].toPython())
             rel.append(t[1].toPython())
             obj.append(str(t[2].toPython()))#.replace(' ', '')) # if you recover space for subword, do not remove space for obj
+        return sub, rel, obj
 
-        self.sub_obj2id = self.build_vocab(sub + obj)
-        self.rel2id = self.build_vocab(rel)
+    def is_kg_db(self, kg_path):
+        return os.path.splitext(kg_path)[1] in ('.db', '.sqlite', '.sqlite3')
 
-        self.id2sub_obj = {i: key for key, i in self.sub_obj2id.items()}
-        self.id2rel = {i: key for key, i in self.rel2id.items()}
+    def db2triples(self, db_path):
+        # mimicsqlstar.db read with the table mapping of build_complex_kg_from_mimicsqlstar_db.py (see kg_db.py)
+        sub, rel, obj = read_kg_columns(db_path)
+        return self.strings2triples(sub, rel, obj)
 
-        self.np_sub_obj2id = np.vectorize(lambda x: self.sub_obj2id[x])
-        self.np_rel2id = np.vectorize(lambda x: self.rel2id[x])
+    def read_kg_strings(self, kg_path):
+        # (sub, rel, obj) string lists of a KG xml or db, as the interpreter reads them at load
+        if self.is_kg_db(kg_path):
+            return read_kg_columns(kg_path)
+        kg = Graph()
+        kg.parse(kg_path, format='xml', publicID='/')
+        return self.graph_strings(kg)
 
-        self.np_id2sub_obj = np.vectorize(lambda x: self.id2sub_obj[x])
-        self.np_id2rel = np.vectorize(lambda x: self.id2rel[x])
+    def strings2triples(self, sub, rel, obj):
+        triples = dict()
+        sub_obj2id = self.build_vocab(sub + obj)
+        rel2id = self.build_vocab(rel)
+        self.set_vocab(StringPool.from_strings(list(sub_obj2id)), StringPool.from_strings(list(rel2id)))
 
-        triples['sub'] = self.np_sub_obj2id(np.array(sub))
-        triples['rel'] = self.np_rel2id(np.array(rel))
-        triples['obj'] = self.np_sub_obj2id(np.array(obj))
-        triples['obj_str'] = np.array(obj)
+        triples['sub'] = np.array([sub_obj2id[x] for x in sub], dtype=np.int64)
+        triples['rel'] = np.array([rel2id[x] for x in rel], dtype=np.int64)
+        triples['obj'] = np.array([sub_obj2id[x] for x in obj], dtype=np.int64)
 
         return triples
 
+    def set_vocab(self, sub_obj_pool, rel_pool):
+        self.sub_obj_pool = sub_obj_pool
+        self.rel_pool = rel_pool
+        self.sub_obj2id, self.id2sub_obj = sub_obj_pool.index(), sub_obj_pool
+        self.rel2id, self.id2rel = rel_pool.index(), rel_pool
+        self._casefold2ids = None
+
+    # vectorized id <-> string translation over the string pools.
+    # like the np.vectorize based version they replace, empty inputs raise ValueError
+    # (execute_trace relies on this: a readable gen_* op with an empty result fails the trace)
+    def np_sub_obj2id(self, x):
+        return self.translate(x, self.sub_obj_pool.lookup)
+
+    def np_rel2id(self, x):
+        return self.translate(x, self.rel_pool.lookup)
+
+    def np_id2sub_obj(self, x):
+        return self.translate(x, self.sub_obj_pool.decode)
+
+    def np_id2rel(self, x):
+        return self.translate(x, self.rel_pool.decode)
+
+    def translate(self, x, fn):
+        x = np.asarray(x)
+        if x.size == 0:
+            raise ValueError('cannot translate size 0 inputs')
+        return fn(x.reshape(-1)).reshape(x.shape)
+
+    def casefold2ids(self, value):
+        # ids of every sub/obj string equal to value up to case, built on the first case-folded lookup
+        if self._casefold2ids is None:
+            groups = dict()
+            for i, key in enumerate(self.sub_obj_pool.tolist()):
+                groups.setdefault(key.casefold(), []).append(i)
+            self._casefold2ids = {key: np.array(ids, dtype=np.int64) for key, ids in groups.items()}
+        if not isinstance(value, str):
+            return np.zeros(0, dtype=np.int64)
+        return self._casefold2ids.get(value.casefold(), np.zeros(0, dtype=np.int64))
+
+    def build_numeric_pool(self, pool):
+        # numeric side arrays, indexed by sub/obj id: is the string a number, and its float value (nan otherwise)
+        strings = np.array(pool.tolist())
+        isnum = np.array([self.isfloat(s) for s in strings], dtype=bool)
+        num = np.full(len(strings), np.nan, dtype=np.float64)
+        num[isnum] = strings[isnum].astype(float)
+        return isnum, num
+
+    def build_nl_numeric_pool(self, pool):
+        # same as build_numeric_pool, for the strings gen_litSet shortens with obj_to_nl ('/hadm_id/123' -> '123'):
+        # does the string match the obj_to_nl pattern, and is its last path component a number
+        p = re.compile('/[a-zA-Z0-9_]*/[a-zA-Z0-9_]*')
+        strings = pool.tolist()
+        isuri = np.array([s.startswith('/') and p.match(s) is not None for s in strings], dtype=bool)
+        nl_strings = np.array([self.obj_to_nl(s) if uri else '' for s, uri in zip(strings, isuri)])
+        isnum = np.array([bool(uri) and self.isfloat(s) for s, uri in zip(nl_strings, isuri)], dtype=bool)
+        num = np.full(len(strings), np.nan, dtype=np.float64)
+        num[isnum] = nl_strings[isnum].astype(float)
+        return isuri, isnum, num
+
     def build_vocab(self, data, min_freq=1):
         PAD_TOKEN = '<PAD>'
         PAD_TOKEN_IDX = 0
@@ -112,25 +468,34 @@ class MimicInterpreter:
             rel_obj = rel_obj.split('/')[-1]
         return rel_obj
 
+    def entity_set(self, entSet):
+        return entSet if isinstance(entSet, EntitySet) else EntitySet.from_ids(entSet, len(self.sub_obj_pool))
+
+    def is_id_set(self, entSet):
+        # id entSets (readable=False) are integer arrays or EntitySets, readable ones are string arrays
+        return isinstance(entSet, EntitySet) or (isinstance(entSet, np.ndarray) and entSet.dtype.kind in 'iu')
+
     # hopping(down): entSet rel > entSet
     def gen_entSet_down(self, entSet, rel_ent, readable=True):
         if entSet is None:
             return None
 
+        if isinstance(entSet, EntitySet):
+            entSet = entSet.to_ids()
         if type(entSet) != np.ndarray:
             entSet = np.array([entSet])
 
         if len(entSet) == 0:
-            return np.array([], dtype=np.int)
+            # a hop over an empty entSet fails the trace. the original returned np.array([], dtype=np.int),
+            # which raises on numpy >= 1.24; the planner's safe estimates (early exit) rely on the failure
+            raise ValueError('hop over an empty entSet')
 
         if readable:
             entSet = self.np_sub_obj2id(entSet)
             rel_ent = self.np_rel2id(rel_ent)
 
-        triple_idx = np.where(np.in1d(self.triples['sub'], entSet))[0]
-        rels = self.triples['rel'][triple_idx]
-        rel_idx = np.where(rels == rel_ent)[0]
-        obj_set = self.triples['obj'][triple_idx[rel_idx]]
+        triple_idx = self.fwd_index.lookup(rel_ent, np.unique(entSet))
+        obj_set = self.triples['obj'][triple_idx]
 
         result = self.np_id2sub_obj(obj_set) if readable else obj_set
         return result
@@ -140,20 +505,21 @@ class MimicInterpreter:
         if entSet is None:
             return None
 
+        if isinstance(entSet, EntitySet):
+            entSet = entSet.to_ids()
         if type(entSet) != np.ndarray:
             entSet = np.array([entSet])
 
         if len(entSet) == 0:
-            return np.array([], dtype=np.int)
+            # same rule as gen_entSet_down
+            raise ValueError('hop over an empty entSet')
 
         if readable:
             entSet = self.np_sub_obj2id(entSet)
             rel_ent = self.np_rel2id(rel_ent)
 
-        triple_idx = np.where(np.in1d(self.triples['obj'], entSet))[0]
-        rels = self.triples['rel'][triple_idx]
-        rel_idx = np.where(rels == rel_ent)[0]
-        sub_set = self.triples['sub'][triple_idx[rel_idx]]
+        triple_idx = self.rev_index.lookup(rel_ent, np.unique(entSet))
+        sub_set = self.triples['sub'][triple_idx]
 
         result = self.np_id2sub_obj(sub_set) if readable else sub_set
         return result
@@ -164,30 +530,48 @@ class MimicInterpreter:
             return None
 
         litSet = self.gen_entSet_down(entSet, rel_lit, readable)
+        return self.litSet_to_nl(litSet)
+
+    def litSet_to_nl(self, litSet):
         p = re.compile('/[a-zA-Z0-9_]*/[a-zA-Z0-9_]*')
         if not(None in [p.match(item) for item in litSet]):
             litSet = np.array([self.obj_to_nl(item) for item in litSet])
         return litSet
 
-    def gen_entSet_equal(self, rel_lit, value, readable=True):
+    def gen_entSet_equal(self, rel_lit, value, readable=True, casefold=None):
         if value is None:
             return None
 
+        if casefold is None:
+            casefold = self.casefold_equal
+
         if readable:
             rel_lit = self.rel2id[rel_lit]
         else:
             value = self.id2sub_obj[value]
             
         #value = value.replace(' ', '')
-        triples_str = self.triples['obj_str']
-        triple_idx = np.where(triples_str == value)[0]
-        rels = self.triples['rel'][triple_idx]
-        rel_idx = np.where(rels == rel_lit)[0]
-        sub_set = self.triples['sub'][triple_idx[rel_idx]]
+        # (rel, literal) lookup on the reverse index: the literal's id is its key
+        triple_idx = self.rev_index.lookup(rel_lit, self.equal_value_ids(value, casefold))
+        sub_set = self.triples['sub'][triple_idx]
         
         result = self.np_id2sub_obj(sub_set) if readable else sub_set
         return result
 
+    def equal_value_ids(self, value, casefold=None):
+        # ids of the sub/obj strings gen_entSet_equal matches value against. a set value (the output of another
+        # op) is compared item-wise, as triples_str == value broadcast it: a single item matches like that
+        # item, any other length matches nothing
+        if casefold is None:
+            casefold = self.casefold_equal
+        if isinstance(value, (np.ndarray, IdEntSet, IdLitSet)):
+            if len(value) != 1:
+                return np.zeros(0, dtype=np.int64)
+            value = self.materialize(value).reshape(-1)[0]
+        if casefold:
+            return self.casefold2ids(value)
+        return np.array([self.sub_obj2id.get(value, -1)], dtype=np.int64)
+
     def gen_entSet_atleast(self, rel_lit, value, readable=True):
         if value is None:
             return None
@@ -203,11 +587,8 @@ class MimicInterpreter:
             except:
                 return None
 
-        triples_num = self.triples['obj_str'][self.triples_num_idx].astype(float)
-        triple_idx = np.where(triples_num <= value)[0]
-        rels = self.triples['rel'][self.triples_num_idx][triple_idx]
-        rel_idx = np.where(rels == rel_lit)[0]
-        sub_set = self.triples['sub'][self.triples_num_idx][triple_idx[rel_idx]]
+        triple_idx = self.num_index.range(rel_lit, upper=value)
+        sub_set = self.triples['sub'][triple_idx]
 
         result = self.np_id2sub_obj(sub_set) if readable else sub_set
         return result
@@ -227,11 +608,8 @@ class MimicInterpreter:
             except:
                 return None
 
-        triples_num = self.triples['obj_str'][self.triples_num_idx].astype(float)
-        triple_idx = np.where(triples_num < value)[0]
-        rels = self.triples['rel'][self.triples_num_idx][triple_idx]
-        rel_idx = np.where(rels == rel_lit)[0]
-        sub_set = self.triples['sub'][self.triples_num_idx][triple_idx[rel_idx]]
+        triple_idx = self.num_index.range(rel_lit, upper=value, upper_inclusive=False)
+        sub_set = self.triples['sub'][triple_idx]
         
         result = self.np_id2sub_obj(sub_set) if readable else sub_set
         return result
@@ -251,11 +629,8 @@ class MimicInterpreter:
             except:
                 return None
 
-        triples_num = self.triples['obj_str'][self.triples_num_idx].astype(float)
-        triple_idx = np.where(triples_num >= value)[0]
-        rels = self.triples['rel'][self.triples_num_idx][triple_idx]
-        rel_idx = np.where(rels == rel_lit)[0]
-        sub_set = self.triples['sub'][self.triples_num_idx][triple_idx[rel_idx]]
+        triple_idx = self.num_index.range(rel_lit, lower=value)
+        sub_set = self.triples['sub'][triple_idx]
 
         result = self.np_id2sub_obj(sub_set) if readable else sub_set
         return result
@@ -275,19 +650,79 @@ class MimicInterpreter:
             except:
                 return None
 
-        triples_num = self.triples['obj_str'][self.triples_num_idx].astype(float)
-        triple_idx = np.where(triples_num > value)[0]
-        rels = self.triples['rel'][self.triples_num_idx][triple_idx]
-        rel_idx = np.where(rels == rel_lit)[0]
-        sub_set = self.triples['sub'][self.triples_num_idx][triple_idx[rel_idx]]
+        triple_idx = self.num_index.range(rel_lit, lower=value, lower_inclusive=False)
+        sub_set = self.triples['sub'][triple_idx]
         
         result = self.np_id2sub_obj(sub_set) if readable else sub_set
         return result
 
+    # temporal selecting on the datetime64 column of /admittime, /dischtime, /charttime, /dob and /dod:
+    # before and after are strict, between includes both ends
+    def gen_entSet_before(self, rel_lit, value, readable=True):
+        if value is None:
+            return None
+
+        if readable:
+            rel_lit = self.rel2id[rel_lit]
+        else:
+            value = self.id2sub_obj[value]
+
+        sub_set = self.time_range(rel_lit, upper=value, upper_inclusive=False)
+        if sub_set is None:
+            return None
+
+        result = self.np_id2sub_obj(sub_set) if readable else sub_set
+        return result
+
+    def gen_entSet_after(self, rel_lit, value, readable=True):
+        if value is None:
+            return None
+
+        if readable:
+            rel_lit = self.rel2id[rel_lit]
+        else:
+            value = self.id2sub_obj[value]
+
+        sub_set = self.time_range(rel_lit, lower=value, lower_inclusive=False)
+        if sub_set is None:
+            return None
+
+        result = self.np_id2sub_obj(sub_set) if readable else sub_set
+        return result
+
+    def gen_entSet_between(self, rel_lit, start, end, readable=True):
+        if start is None or end is None:
+            return None
+
+        if readable:
+            rel_lit = self.rel2id[rel_lit]
+        else:
+            start, end = self.id2sub_obj[start], self.id2sub_obj[end]
+
+        sub_set = self.time_range(rel_lit, lower=start, upper=end)
+        if sub_set is None:
+            return None
+
+        result = self.np_id2sub_obj(sub_set) if readable else sub_set
+        return result
+
+    def time_range(self, rel_lit, lower=None, upper=None, lower_inclusive=True, upper_inclusive=True):
+        # subject ids (in triple order) of the rel_lit triples whose time lies within the bounds,
+        # None when a bound is not a date/time (as a non-numeric value for gen_entSet_atleast)
+        lower = None if lower is None else parse_datetime(lower)
+        upper = None if upper is None else parse_datetime(upper)
+        if (lower is not None and np.isnat(lower)) or (upper is not None and np.isnat(upper)):
+            return None
+
+        triple_idx = self.time_index.range(rel_lit, lower, upper, lower_inclusive, upper_inclusive)
+        return self.triples['sub'][triple_idx]
+
     def count_entSet(self, entSet, readable=True):
         if entSet is None:
             return None
 
+        if isinstance(entSet, EntitySet):
+            return float(len(entSet))
         if type(entSet) != np.ndarray:
             entSet = np.array([entSet])
         return float(len(entSet))
@@ -350,6 +785,10 @@ class MimicInterpreter:
         if entSet1 is None or entSet2 is None:
             return None
 
+        # id sets go through EntitySet (bitsets when dense), the result is the same sorted unique id array
+        if self.is_id_set(entSet1) and self.is_id_set(entSet2):
+            return self.entity_set(entSet1).intersect(self.entity_set(entSet2)).to_ids()
+
         if type(entSet1) != np.ndarray:
             entSet1 = np.array([entSet1])
         if type(entSet2) != np.ndarray:
@@ -368,6 +807,9 @@ class MimicInterpreter:
         if entSet1 is None or entSet2 is None:
             return None
 
+        if self.is_id_set(entSet1) and self.is_id_set(entSet2):
+            return self.entity_set(entSet1).union(self.entity_set(entSet2)).to_ids()
+
         if type(entSet1) != np.ndarray:
             entSet1 = np.array([entSet1])
         if type(entSet2) != np.ndarray:
@@ -391,40 +833,453 @@ class MimicInterpreter:
     def no_op(self, arg1, arg2, readable=False):
         return None
 
-    def execute_trace(self, trace):
-        gen_entset_down = lambda x, y: self.gen_entSet_down(x, y)
-        gen_entset_up = lambda x, y: self.gen_entSet_up(x, y)
-        gen_litset = lambda x, y: self.gen_litSet(x, y)
-        gen_entset_equal = lambda x, y: self.gen_entSet_equal(x, y)
-        gen_entset_atleast = lambda x, y: self.gen_entSet_atleast(x, y)
-        gen_entset_less = lambda x, y: self.gen_entSet_less(x, y)
-        gen_entset_atmost = lambda x, y: self.gen_entSet_atmost(x, y)
-        gen_entset_more = lambda x, y: self.gen_entSet_more(x, y)
-        count_litset = lambda x: self.count_litSet(x)
-        count_entset = lambda x: self.count_entSet(x)
-        maximum_litset = lambda x: self.maximum_litSet(x)
-        minimum_litset = lambda x: self.minimum_litSet(x)
-        average_litset = lambda x: self.average_litSet(x)
-        intersect_entsets = lambda x, y: self.intersect_entSets(x, y)
-        intersect_litsets = lambda x, y: self.intersect_litSets(x, y)
-        union_entsets = lambda x, y: self.union_entSets(x, y)
-        union_litsets = lambda x, y: self.union_litSets(x, y)
-        concat_litsets = lambda x, y: self.concat_litSets(x, y)
-
-        R = []
-        for r in trace.split('<exe>')[:-1]:
-            R.append(r.split('=')[-1])
-        idxs = ['1', '2', '3', '4', '5', '6', '7', '8', '9', '10', '11', '12']
-        idxs = list(reversed(idxs[:len(R)]))
-        for i, idx in enumerate(idxs):
-            new_trace = R[-1] if i == 0 else new_trace.replace(f'<r{idx}>', R[-(i+1)])
+    # id-native ops used by execute_trace: inputs and outputs are IdEntSet / IdLitSet instead of strings.
+    # they follow the readable ops exactly (an empty gen_* result raises), and return NotImplemented for
+    # inputs they do not handle, in which case the readable op runs on materialized inputs
+    def id_entSet(self, ids):
+        if len(ids) == 0:
+            raise ValueError('empty gen_* result')
+        return IdEntSet(ids)
+
+    def as_id_entSet(self, entSet):
+        if isinstance(entSet, IdEntSet):
+            return entSet
+        if isinstance(entSet, str):
+            return IdEntSet(self.sub_obj_pool.lookup([entSet]))
+        return None
+
+    def gen_entSet_down_ids(self, entSet, rel_ent):
+        if entSet is None:
+            return None
+        source = self.as_id_entSet(entSet)
+        if source is None or len(source) == 0 or not isinstance(rel_ent, str):
+            return NotImplemented
+
+        triple_idx = self.fwd_index.lookup(self.rel2id[rel_ent], source.unique_ids())
+        return self.id_entSet(self.triples['obj'][triple_idx])
+
+    def gen_entSet_up_ids(self, rel_ent, entSet):
+        if entSet is None:
+            return None
+        source = self.as_id_entSet(entSet)
+        if source is None or len(source) == 0 or not isinstance(rel_ent, str):
+            return NotImplemented
+
+        triple_idx = self.rev_index.lookup(self.rel2id[rel_ent], source.unique_ids())
+        return self.id_entSet(self.triples['sub'][triple_idx])
+
+    def gen_litSet_ids(self, entSet, rel_lit):
+        if entSet is None:
+            return None
+        obj_set = self.gen_entSet_down_ids(entSet, rel_lit)
+        if obj_set is NotImplemented:
+            return NotImplemented
+        return IdLitSet(obj_set.ids)
+
+    def gen_entSet_equal_ids(self, rel_lit, value, casefold=None):
+        if value is None:
+            return None
+        if not isinstance(value, (str, int, float, np.ndarray, IdEntSet, IdLitSet)):
+            return NotImplemented
+
+        triple_idx = self.rev_index.lookup(self.rel2id[rel_lit], self.equal_value_ids(value, casefold))
+        return self.id_entSet(self.triples['sub'][triple_idx])
+
+    def gen_entSet_range_ids(self, rel_lit, value, **bounds):
+        if value is None:
+            return None
+        if not isinstance(value, (str, int, float)):
+            return NotImplemented
+
+        rel_lit = self.rel2id[rel_lit]
+        if type(value) != float:
+            try:
+                value = float(value)
+            except:
+                return None
+        bounds = {name: value if bound is True else bound for name, bound in bounds.items()}
+        triple_idx = self.num_index.range(rel_lit, **bounds)
+        return self.id_entSet(self.triples['sub'][triple_idx])
+
+    def gen_entSet_atleast_ids(self, rel_lit, value):
+        return self.gen_entSet_range_ids(rel_lit, value, upper=True)
+
+    def gen_entSet_less_ids(self, rel_lit, value):
+        return self.gen_entSet_range_ids(rel_lit, value, upper=True, upper_inclusive=False)
+
+    def gen_entSet_atmost_ids(self, rel_lit, value):
+        return self.gen_entSet_range_ids(rel_lit, value, lower=True)
+
+    def gen_entSet_more_ids(self, rel_lit, value):
+        return self.gen_entSet_range_ids(rel_lit, value, lower=True, lower_inclusive=False)
+
+    def gen_entSet_time_ids(self, rel_lit, values, **bounds):
+        if any(value is None for value in values):
+            return None
+        if not all(isinstance(value, (str, int, float)) for value in values):
+            return NotImplemented
+
+        sub_set = self.time_range(self.rel2id[rel_lit], **bounds)
+        return None if sub_set is None else self.id_entSet(sub_set)
+
+    def gen_entSet_before_ids(self, rel_lit, value):
+        return self.gen_entSet_time_ids(rel_lit, [value], upper=value, upper_inclusive=False)
+
+    def gen_entSet_after_ids(self, rel_lit, value):
+        return self.gen_entSet_time_ids(rel_lit, [value], lower=value, lower_inclusive=False)
+
+    def gen_entSet_between_ids(self, rel_lit, start, end):
+        return self.gen_entSet_time_ids(rel_lit, [start, end], lower=start, upper=end)
+
+    def count_ids(self, entSet):
+        if entSet is None:
+            return None
+        if not isinstance(entSet, (IdEntSet, IdLitSet)):
+            return NotImplemented
+        return float(len(entSet))
+
+    def numeric_litSet_ids(self, litSet):
+        # float values of an IdLitSet read from the precomputed numeric columns, None where the readable
+        # litSet.astype(float) would fail. gen_litSet shortens every item with obj_to_nl only if all of them match
+        ids = litSet.ids
+        if self.sub_obj_isuri[ids].all():
+            isnum, num = self.sub_obj_nl_isnum, self.sub_obj_nl_num
+        else:
+            isnum, num = self.sub_obj_isnum, self.sub_obj_num
+        if not isnum[ids].all():
+            return None
+        return num[ids]
+
+    def maximum_ids(self, litSet):
+        return self.aggregate_ids(litSet, 'max')
+
+    def minimum_ids(self, litSet):
+        return self.aggregate_ids(litSet, 'min')
+
+    def average_ids(self, litSet):
+        return self.aggregate_ids(litSet, 'mean')
+
+    def aggregate_ids(self, litSet, agg):
+        if litSet is None:
+            return None
+        if not isinstance(litSet, IdLitSet):
+            return NotImplemented
+        if len(litSet) == 0:
+            return None
+
+        values = self.numeric_litSet_ids(litSet)
+        if values is None:
+            return None
+        if agg == 'mean':
+            return np.mean(values)
+        # builtin max/min (as in the readable ops) only matter when nan or signed zeros make the order count
+        if np.isnan(values).any() or (values == 0).any():
+            return max(values) if agg == 'max' else min(values)
+        return values.max() if agg == 'max' else values.min()
+
+    def set_op_ids(self, entSet1, entSet2, op):
+        if entSet1 is None or entSet2 is None:
+            return None
+        if not isinstance(entSet1, IdEntSet) or not isinstance(entSet2, IdEntSet):
+            return NotImplemented
+
+        entity_set1, entity_set2 = self.entity_set(entSet1.ids), self.entity_set(entSet2.ids)
+        entity_set = entity_set1.intersect(entity_set2) if op == 'intersect' else entity_set1.union(entity_set2)
+        # np.intersect1d / np.union1d over the readable sets keep the wider of the two string dtypes
+        width = max(self.id_entSet_width(entSet1), self.id_entSet_width(entSet2))
+        return IdEntSet(entity_set, is_set=True, width=width)
+
+    def intersect_ids(self, entSet1, entSet2):
+        return self.set_op_ids(entSet1, entSet2, 'intersect')
+
+    def union_ids(self, entSet1, entSet2):
+        return self.set_op_ids(entSet1, entSet2, 'union')
+
+    def id_entSet_width(self, entSet):
+        if entSet.width is None:
+            entSet.width = self.sub_obj_pool.max_width(entSet.to_ids())
+        return entSet.width
+
+    def materialize(self, value):
+        # readable value of an id-native result, identical to what the readable ops return
+        if isinstance(value, IdEntSet):
+            if not value.is_set:
+                return self.np_id2sub_obj(value.ids)
+            entSet = self.sub_obj_pool.decode(value.to_ids()).astype(f'U{self.id_entSet_width(value)}')
+            entSet.sort()
+            return entSet
+        if isinstance(value, IdLitSet):
+            return self.litSet_to_nl(self.np_id2sub_obj(value.ids))
+        if isinstance(value, list):
+            return [self.materialize(item) for item in value]
+        return value
+
+    def apply_op(self, op, args, id_native=False):
+        spec = TRACE_OPS[op]
+        if id_native:
+            if spec.native is not None:
+                value = getattr(self, spec.native)(*args)
+                if value is not NotImplemented:
+                    return value
+            args = [self.materialize(arg) for arg in args]
+        return getattr(self, spec.method)(*args)
+
+    def compile_trace(self, trace):
+        return self.program_cache.compile(trace)
+
+    def check_trace_types(self, traces):
+        # per trace True when it compiles and type checks; False marks a trace that can be skipped, it could only
+        # fail (or give an answer of the wrong kind)
+        if self.type_checker is None:
+            self.type_checker = TypeChecker()
+        flags = []
+        for trace in traces:
+            try:
+                self.type_checker.check(self.compile_trace(trace))
+            except (TraceSyntaxError, ProgramTypeError):
+                flags.append(False)
+            else:
+                flags.append(True)
+        return flags
+
+    def execute_program(self, program, id_native=None, profile=None, budget=None, results=None):
+        # results: node values known beforehand (id-native), e.g. evaluated group-wise by the BatchExecutor
+        id_native = self.id_native if id_native is None else id_native
+        plan = self.planner.plan(program) if self.reorder else None
+        # a budget meters the ops in the order they run, so a metered execution stays on one thread
+        branches = self.get_branch_pool() if budget is None else None
+        run = Execution(program, plan, id_native, profile, None if budget is None else budget.start(), results,
+                        branches)
+        value = self.evaluate_node(run, program.root)
+        if not id_native:
+            return value
+        if profile is None:
+            return self.materialize(value)
+        start = time.perf_counter()
+        value = self.materialize(value)
+        profile.decode_seconds = time.perf_counter() - start
+        return value
+
+    def evaluate_node(self, run, idx):
+        # top-down, so that a memoized node skips its whole sub-program and skipped operands are never run
+        if idx in run.results:
+            return run.results[idx]
+        node = run.program.nodes[idx]
+        if self.result_cache is None:
+            value = self.evaluate_op(run, idx)
+        else:
+            key = (node.key, self.casefold_equal, run.id_native)
+            found, value = self.result_cache.get(key)
+            if run.profile is not None:
+                run.profile.cache_lookup(idx, found, value)
+            if not found:
+                try:
+                    value = self.result_cache.put(key, self.evaluate_op(run, idx))
+                except BudgetExceeded:
+                    # depends on the budget of this execution, not on the sub-program
+                    raise
+                except Exception as e:
+                    self.result_cache.put(key, CachedError(e))
+                    raise
+            if isinstance(value, CachedError):
+                value.reraise()
+        run.results[idx] = value
+        return value
+
+    def evaluate_op(self, run, idx):
+        node = run.program.nodes[idx]
+        if run.plan is not None and idx in run.plan.views and run.id_native and run.meter is None:
+            value = self.evaluate_view(run, idx)
+            if value is not None:
+                return value
+        if run.plan is not None and node.op == INTERSECT_OP:
+            return self.evaluate_intersection(run, idx)
+        if run.branches is None or sum(isinstance(arg, Ref) for arg in node.args) < 2:
+            args = [self.evaluate_node(run, arg.idx) if isinstance(arg, Ref) else arg for arg in node.args]
+        else:
+            futures = [None] + [self.fork(run, arg) for arg in node.args[1:]]
+            args = [self.join(run, arg, future) for arg, future in zip(node.args, futures)]
+        return self.run_op(run, idx, node.op, args)
+
+    def evaluate_view(self, run, idx):
+        # the node read from the path view of its hop chain instead of running the chain (a budget counts the
+        # hops of the chain, metered executions run it), None when the view does not hold the lookup value
+        view, value = run.plan.views[idx]
+        start = time.perf_counter()
+        value = self.path_views.lookup(self, view, value)
+        if value is not None and run.profile is not None:
+            run.profile.op_done(idx, time.perf_counter() - start, [], value)
+        return value
+
+    def fork(self, run, arg):
+        # future of a Ref argument evaluated on a branch thread, None when it is evaluated by join
+        if run.branches is None or not isinstance(arg, Ref) or arg.idx in run.results:
+            return None
+        if run.plan is not None and run.plan[arg.idx].card < BRANCH_MIN_CARD:
+            return None
+        return run.branches.submit(self.evaluate_node, run, arg.idx)
+
+    def join(self, run, arg, future):
+        if future is not None:
+            return future.result()
+        return self.evaluate_node(run, arg.idx) if isinstance(arg, Ref) else arg
+
+    def evaluate_intersection(self, run, idx):
+        # a chain of intersect_entsets is folded over its operands, most selective first.
+        # once the running intersection is empty the remaining operands cannot change it; they are skipped
+        # when the planner proved they cannot fail (a failing operand would have made the trace fail)
+        # with branch threads the operands are all started at once, skipped ones are cancelled if still queued
+        entSet = None
+        branches = run.plan.intersection_branches(idx)
+        futures = [None] + [self.fork(run, arg) for arg in branches[1:]]
+        for i, (arg, future) in enumerate(zip(branches, futures)):
+            if i > 0 and self.is_empty_set(entSet) and (not isinstance(arg, Ref) or run.plan[arg.idx].safe):
+                if future is not None:
+                    run.branches.cancel(future)
+                if run.profile is not None and isinstance(arg, Ref):
+                    run.profile.skip(arg.idx)
+                continue
+            value = self.join(run, arg, future)
+            entSet = value if i == 0 else self.run_op(run, idx, INTERSECT_OP, [entSet, value])
+            if entSet is None:
+                return None
+        return entSet
+
+    def run_op(self, run, idx, op, args):
+        # apply_op within the budget of the execution, timed into its profile (the op itself only,
+        # its inputs are already evaluated)
+        if run.meter is None and run.profile is None:
+            return self.apply_op(op, args, run.id_native)
+        start = time.perf_counter()
+        try:
+            if run.meter is not None:
+                self.check_budget(run.meter, op, args)
+            value = self.apply_op(op, args, run.id_native)
+            if run.meter is not None:
+                run.meter.charge(cardinality(value), result_nbytes(value) if value is not None else 0)
+        except Exception as e:
+            if run.profile is not None:
+                run.profile.op_done(idx, time.perf_counter() - start, args, error=e)
+            raise
+        if run.profile is not None:
+            run.profile.op_done(idx, time.perf_counter() - start, args, value)
+        return value
+
+    def check_budget(self, meter, op, args):
+        # a hop is counted on the index before it gathers its edges, so that a blow-up stops before
+        # anything is materialized (the output size of the other ops is bounded by their inputs)
+        meter.check_time()
+        if op in HOP_OPS:
+            set_pos, rel_pos, in_side, _ = HOP_OPS[op]
+            n_edges = self.count_hop_edges(args[set_pos], args[rel_pos], in_side)
+            if n_edges is not None:
+                meter.check_output(n_edges, n_edges * np.dtype(np.int64).itemsize)
+
+    def count_hop_edges(self, entSet, rel, side):
+        # edges a hop from entSet over rel gathers, None when they cannot be counted cheaply
+        if not isinstance(rel, str) or rel not in self.rel2id:
+            return None
+        if isinstance(entSet, IdEntSet):
+            keys = entSet.unique_ids()
+        elif isinstance(entSet, EntitySet):
+            keys = entSet.to_ids()
+        elif isinstance(entSet, str):
+            keys = self.sub_obj_pool.lookup([entSet], default=-1)
+        elif isinstance(entSet, np.ndarray) and entSet.dtype.kind in 'iu':
+            keys = np.unique(entSet)
+        elif isinstance(entSet, np.ndarray) and entSet.dtype.kind == 'U':
+            keys = np.unique(self.sub_obj_pool.lookup(entSet.reshape(-1), default=-1))
+        else:
+            return None
+        index = self.fwd_index if side == SUB else self.rev_index
+        return index.count(self.rel2id[rel], keys)
 
+    def is_empty_set(self, entSet):
+        return isinstance(entSet, (np.ndarray, IdEntSet, EntitySet)) and len(entSet) == 0
+
+    def execute_trace(self, trace, profiler=None, budget=None):
+        profiler = self.profiler if profiler is None else profiler
+        budget = self.budget if budget is None else budget
+        if profiler is not None:
+            return self.explain_trace(trace, profiler, budget).result
         try:
-            result = eval(new_trace)
+            program = self.compile_trace(trace)
+            result = self.execute_program(program, budget=budget)
+        except BudgetExceeded:
+            result = BUDGET_EXCEEDED
         except:
             result = None
         return result
 
+    def explain_trace(self, trace, profiler=None, budget=None):
+        # execute_trace that also returns per node wall time, cardinalities and cache hits as a TraceProfile
+        # (str() is the EXPLAIN tree), added to profiler when given
+        budget = self.budget if budget is None else budget
+        profile = TraceProfile(trace)
+        start = time.perf_counter()
+        try:
+            profile.program = self.compile_trace(trace)
+            profile.compile_seconds = time.perf_counter() - start
+            profile.result = self.execute_program(profile.program, profile=profile, budget=budget)
+        except BudgetExceeded as e:
+            profile.result, profile.error = BUDGET_EXCEEDED, e
+        except Exception as e:
+            profile.result, profile.error = None, e
+        profile.total_seconds = time.perf_counter() - start
+        if profiler is not None:
+            profiler.add(profile)
+        return profile
+
+    def execute_traces(self, traces, workers=None, profiler=None, budget=None):
+        # same results as [execute_trace(t) for t in traces], in input order.
+        # with workers > 1 the traces are spread over a process pool attached to the KG snapshot
+        traces = list(traces)
+        workers = self.workers if workers is None else workers
+        profiler = self.profiler if profiler is None else profiler
+        budget = self.budget if budget is None else budget
+        if workers is None or workers <= 1 or len(traces) <= 1:
+            if self.batched and self.id_native and profiler is None and budget is None and len(traces) > 1:
+                return self.batch_executor.execute_traces(traces)
+            return [self.execute_trace(trace, profiler, budget) for trace in traces]
+        return self.get_pool(workers).execute_traces(traces, profiler, budget)
+
+    def get_pool(self, workers):
+        with POOL_LOCK:
+            return self.start_pool(workers)
+
+    def start_pool(self, workers):
+        if self._pool is not None and self._pool.workers != workers:
+            self.close_pool()
+        if self._pool is None:
+            if self.snapshot_path is None:
+                raise ValueError('execute_traces with workers > 1 needs the interpreter built with a snapshot_path')
+            if not is_kg_snapshot(self.snapshot_path):
+                self.save_snapshot(self.snapshot_path)
+            interpreter_kwargs = {'casefold_equal': self.casefold_equal, 'result_cache': self.result_cache,
+                                  'reorder': self.reorder, 'id_native': self.id_native, 'batched': self.batched,
+                                  'branch_threads': self.branch_threads,
+                                  'path_views': self.use_path_views}
+            self._pool = InterpreterPool(self.kg_path, self.ops_path, self.snapshot_path, workers,
+                                         interpreter_kwargs)
+        return self._pool
+
+    def get_branch_pool(self):
+        # shared by every execution of this interpreter; the calling thread is one of the branch_threads
+        if self.branch_threads is None or self.branch_threads <= 1:
+            return None
+        with POOL_LOCK:
+            if self._branch_pool is None:
+                self._branch_pool = BranchPool(self.branch_threads - 1)
+            return self._branch_pool
+
+    def close_pool(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+        if self._branch_pool is not None:
+            self._branch_pool.close()
+            self._branch_pool = None
+
 
 if __name__ == '__main__':
     # FOR TEST
@@ -0,0 +1,99 @@
+import threading
+import multiprocessing as mp
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+
+# per worker process interpreter, attached to the memory-mapped KG snapshot once in init_worker
+_worker_interpreter = None
+
+
+def init_worker(kg_path, ops_path, snapshot_path, interpreter_kwargs):
+    global _worker_interpreter
+    from utils.interpreter import MimicInterpreter
+    _worker_interpreter = MimicInterpreter(kg_path, ops_path, snapshot_path, **interpreter_kwargs)
+
+
+def execute_chunk(traces, profile=False, budget=None):
+    # results of the chunk, and with profile the state of an OpProfiler over it (merged by the caller)
+    if not profile:
+        return _worker_interpreter.execute_traces(traces, workers=1, budget=budget), None
+    from utils.profiler import OpProfiler
+    profiler = OpProfiler()
+    return [_worker_interpreter.execute_trace(trace, profiler, budget) for trace in traces], profiler.state()
+
+
+def split_chunks(items, n_chunks):
+    size = max(1, -(-len(items) // max(n_chunks, 1)))
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+class InterpreterPool:
+    # process pool of MimicInterpreters that all map the same KG snapshot (pages are shared by the OS)
+    def __init__(self, kg_path, ops_path, snapshot_path, workers, interpreter_kwargs=None, start_method=None,
+                 chunks_per_worker=4):
+        self.workers = workers
+        self.chunks_per_worker = chunks_per_worker
+        ctx = mp.get_context(start_method)
+        self.pool = ctx.Pool(workers, initializer=init_worker,
+                             initargs=(kg_path, ops_path, snapshot_path, dict(interpreter_kwargs or {})))
+
+    def execute_traces(self, traces, profiler=None, budget=None):
+        # results come back in input order, worker profiles are merged into profiler when given
+        traces = list(traces)
+        if len(traces) == 0:
+            return []
+        chunks = split_chunks(traces, self.workers * self.chunks_per_worker)
+        results = []
+        for chunk, state in self.pool.map(partial(execute_chunk, profile=profiler is not None, budget=budget), chunks):
+            results.extend(chunk)
+            if state is not None:
+                profiler.merge(state)
+        return results
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def terminate(self):
+        self.pool.terminate()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.terminate()
+
+
+class BranchPool:
+    # threads evaluating independent sub-programs of one execution. a branch is only handed over while a thread is
+    # free (submit returns None otherwise and the caller evaluates it itself), so nested branches never wait for
+    # a thread that is waiting on them
+    def __init__(self, threads):
+        self.threads = threads
+        self.slots = threading.Semaphore(threads)
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix='interpreter-branch')
+
+    def submit(self, fn, *args):
+        if not self.slots.acquire(blocking=False):
+            return None
+        try:
+            return self.executor.submit(self.run, fn, *args)
+        except RuntimeError:
+            self.slots.release()
+            return None
+
+    def run(self, fn, *args):
+        try:
+            return fn(*args)
+        finally:
+            self.slots.release()
+
+    def cancel(self, future):
+        # a branch that is not needed anymore; its thread is given back if it has not started yet
+        if future.cancel():
+            self.slots.release()
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,411 @@
+import os
+import stat
+import time
+import socket
+import atexit
+import logging
+import argparse
+import threading
+import multiprocessing as mp
+from multiprocessing.connection import Listener, Client
+
+from utils.program import TRACE_OPS
+from utils.profiler import TIME_BUCKETS_MS, OpProfiler, bucket
+from utils.kg_snapshot import is_versioned_snapshot
+
+
+logger = logging.getLogger(__name__)
+
+# processes started with this variable set (models, evaluation) use the service instead of loading the KG,
+# authenticating with the hex key in AUTHKEY_ENV
+SOCKET_ENV = 'MIMIC_INTERPRETER_SOCKET'
+AUTHKEY_ENV = 'MIMIC_INTERPRETER_AUTHKEY'
+CONNECT_TIMEOUT = 600.0
+# interpreter methods clients may call through rpc_call: trace execution and the trace ops, nothing that
+# changes the served KG
+CALL_METHODS = {'execute_trace', 'explain_trace', 'check_trace_types', 'litSet_to_nl', 'obj_to_nl'} | \
+    {op.method for op in TRACE_OPS.values()}
+
+
+def new_authkey():
+    return os.urandom(32)
+
+
+def env_authkey():
+    authkey = os.environ.get(AUTHKEY_ENV)
+    return bytes.fromhex(authkey) if authkey else None
+
+
+def prepare_socket_dir(socket_path):
+    # the socket is created in a directory only this user can enter, missing directories are created so
+    directory = os.path.dirname(os.path.abspath(socket_path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    st = os.stat(directory)
+    if st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise PermissionError(f'{directory} is open to other users, the interpreter service socket has to be '
+                              f'in a private (0700) directory')
+
+
+def is_service_alive(socket_path):
+    # something accepts connections on socket_path
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+            return True
+        except OSError:
+            return False
+
+
+class LatencyStats:
+    # per method request count, total/max time and histogram over TIME_BUCKETS_MS
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.methods = dict()
+
+    def add(self, method, seconds):
+        ms = seconds * 1000
+        with self.lock:
+            stats = self.methods.setdefault(method, {'requests': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                                                     'time_hist': [0] * (len(TIME_BUCKETS_MS) + 1)})
+            stats['requests'] += 1
+            stats['total_ms'] += ms
+            stats['max_ms'] = max(stats['max_ms'], ms)
+            stats['time_hist'][bucket(TIME_BUCKETS_MS, ms)] += 1
+
+    def summary(self):
+        with self.lock:
+            summary = {method: dict(stats, time_hist=list(stats['time_hist']),
+                                    mean_ms=stats['total_ms'] / stats['requests'])
+                       for method, stats in self.methods.items()}
+        return {'time_buckets_ms': TIME_BUCKETS_MS, 'methods': summary}
+
+
+class InterpreterService:
+    # serves one MimicInterpreter over a unix socket, one thread per connected client.
+    # a request is (method, args, kwargs), the response (ok, value or exception, server seconds)
+    RPC_METHODS = ['ping', 'execute_traces', 'check_answers', 'call', 'getattr', 'stats', 'swap_snapshot',
+                   'shutdown']
+
+    def __init__(self, interpreter, socket_path, authkey=None):
+        self.interpreter = interpreter
+        self.socket_path = socket_path
+        self.authkey = authkey or env_authkey()
+        if not self.authkey:
+            raise ValueError(f'the interpreter service needs an authkey (or {AUTHKEY_ENV} set)')
+        self.latency = LatencyStats()
+        self.n_clients = 0
+        self.listener = None
+        self.stopped = threading.Event()
+
+    def serve_forever(self):
+        prepare_socket_dir(self.socket_path)
+        if os.path.lexists(self.socket_path):
+            # only the stale socket of a service that is gone is replaced
+            if not stat.S_ISSOCK(os.lstat(self.socket_path).st_mode):
+                raise FileExistsError(f'{self.socket_path} exists and is not a socket')
+            if is_service_alive(self.socket_path):
+                raise RuntimeError(f'an interpreter service is already listening on {self.socket_path}')
+            os.remove(self.socket_path)
+        # created 0600 rather than chmod-ed after the bind, so that it is never open to others
+        umask = os.umask(0o177)
+        try:
+            self.listener = Listener(self.socket_path, family='AF_UNIX', authkey=self.authkey)
+        finally:
+            os.umask(umask)
+        logger.info(f'interpreter service listening on {self.socket_path}')
+        try:
+            while True:
+                try:
+                    conn = self.listener.accept()
+                except (mp.AuthenticationError, EOFError, ConnectionError) as e:
+                    logger.warning(f'rejected an interpreter service connection: {e!r}')
+                    if self.stopped.is_set():
+                        break
+                    continue
+                if self.stopped.is_set():
+                    conn.close()
+                    break
+                self.n_clients += 1
+                threading.Thread(target=self.serve_client, args=(conn,), daemon=True).start()
+        finally:
+            self.close()
+
+    def serve_client(self, conn):
+        with conn:
+            while not self.stopped.is_set():
+                try:
+                    method, args, kwargs = conn.recv()
+                except (EOFError, OSError):
+                    return
+                start = time.perf_counter()
+                try:
+                    if method not in self.RPC_METHODS:
+                        raise AttributeError(f'unknown interpreter service method {method!r}')
+                    response = (True, getattr(self, f'rpc_{method}')(*args, **kwargs))
+                except Exception as e:
+                    response = (False, e)
+                seconds = time.perf_counter() - start
+                self.latency.add(method, seconds)
+                logger.debug(f'{method} took {seconds * 1000:.3f}ms')
+                try:
+                    conn.send(response + (seconds,))
+                except Exception as e:
+                    # the value or the exception does not pickle
+                    conn.send((False, RuntimeError(f'{method}: {e!r}'), seconds))
+                if method == 'shutdown':
+                    self.stop()
+                    return
+
+    def rpc_ping(self):
+        return os.getpid()
+
+    def rpc_execute_traces(self, traces, workers=None, profile=False, budget=None):
+        # results, and with profile the state of an OpProfiler over them (merged by the client)
+        profiler = OpProfiler() if profile else None
+        results = self.interpreter.execute_traces(traces, workers=workers, profiler=profiler, budget=budget)
+        return results, None if profiler is None else profiler.state()
+
+    def rpc_check_answers(self, preds, answers, workers=None):
+        from utils.eval_utils import get_flags_for_execution_accuracy
+        return get_flags_for_execution_accuracy(preds, self.interpreter, answers, workers)
+
+    def rpc_call(self, name, *args, **kwargs):
+        if name not in CALL_METHODS:
+            raise AttributeError(f'interpreter method {name!r} is not served')
+        return getattr(self.interpreter, name)(*args, **kwargs)
+
+    def rpc_getattr(self, name):
+        # (True, None) for served methods, called through rpc_call; (False, value) for public attributes
+        if name.startswith('_'):
+            raise AttributeError(f'interpreter attribute {name!r} is not served')
+        value = getattr(self.interpreter, name)
+        if not callable(value):
+            return False, value
+        if name not in CALL_METHODS:
+            raise AttributeError(f'interpreter method {name!r} is not served')
+        return True, None
+
+    def rpc_stats(self):
+        return {'pid': os.getpid(), 'clients': self.n_clients, 'latency': self.latency.summary(),
+                'snapshot_version': getattr(self.interpreter, 'version', None)}
+
+    def rpc_swap_snapshot(self, version=None):
+        # requests already running finish on the version they started on
+        if not hasattr(self.interpreter, 'swap'):
+            raise TypeError('the service interpreter is not on a versioned KG snapshot root')
+        return self.interpreter.swap(version)
+
+    def rpc_shutdown(self):
+        return True
+
+    def stop(self):
+        # closing the listener does not interrupt a blocked accept, a last connection does
+        if self.stopped.is_set():
+            return
+        self.stopped.set()
+        try:
+            Client(self.socket_path, family='AF_UNIX', authkey=self.authkey).close()
+        except (OSError, EOFError):
+            pass
+
+    def close(self):
+        self.stopped.set()
+        if self.listener is not None:
+            self.listener.close()
+        if hasattr(self.interpreter, 'close_pool'):
+            self.interpreter.close_pool()
+        if self.listener is not None and os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+
+class InterpreterClient:
+    # stand-in for a MimicInterpreter living in an InterpreterService: execute_trace(s) (profiler and budget as
+    # in MimicInterpreter, profiles are merged into the local profiler), check_answers, and every other
+    # served interpreter method or attribute forwarded to the service. safe to share between threads.
+    # authkey defaults to $MIMIC_INTERPRETER_AUTHKEY
+    def __init__(self, socket_path, authkey=None, profiler=None, budget=None):
+        authkey = authkey or env_authkey()
+        if not authkey:
+            raise ValueError(f'connecting to the interpreter service needs its authkey (or {AUTHKEY_ENV} set)')
+        self.socket_path = socket_path
+        self.conn = Client(socket_path, family='AF_UNIX', authkey=authkey)
+        self.lock = threading.Lock()
+        self.profiler = profiler
+        self.budget = budget
+        # per request round trip of this client; last_latency is (server seconds, round trip seconds)
+        self.latency = LatencyStats()
+        self.last_latency = None
+        self._attrs = dict()
+
+    def request(self, method, *args, **kwargs):
+        start = time.perf_counter()
+        with self.lock:
+            self.conn.send((method, args, kwargs))
+            ok, value, server_seconds = self.conn.recv()
+        seconds = time.perf_counter() - start
+        self.latency.add(method, seconds)
+        self.last_latency = (server_seconds, seconds)
+        if not ok:
+            raise value
+        return value
+
+    def execute_trace(self, trace, profiler=None, budget=None):
+        return self.execute_traces([trace], profiler=profiler, budget=budget)[0]
+
+    def execute_traces(self, traces, workers=None, profiler=None, budget=None):
+        profiler = self.profiler if profiler is None else profiler
+        budget = self.budget if budget is None else budget
+        results, state = self.request('execute_traces', list(traces), workers=workers,
+                                      profile=profiler is not None, budget=budget)
+        if state is not None:
+            profiler.merge(state)
+        return results
+
+    def check_answers(self, preds, answers, workers=None):
+        # execution accuracy flags of preds, computed next to the KG (only the flags come back)
+        return self.request('check_answers', list(preds), list(answers), workers=workers)
+
+    def ping(self):
+        return self.request('ping')
+
+    def swap_snapshot(self, version=None):
+        # swaps the service to version (default: the published one) of its versioned snapshot root
+        return self.request('swap_snapshot', version)
+
+    def stats(self):
+        # latency per method, as seen by the service and by this client
+        stats = self.request('stats')
+        stats['client_latency'] = self.latency.summary()
+        return stats
+
+    def shutdown(self):
+        self.request('shutdown')
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name in ('conn', 'lock'):
+            raise AttributeError(name)
+        if name not in self._attrs:
+            is_method, value = self.request('getattr', name)
+            if is_method:
+                def method(*args, **kwargs):
+                    return self.request('call', name, *args, **kwargs)
+                value = method
+            self._attrs[name] = value
+        return self._attrs[name]
+
+    def __getstate__(self):
+        return {'socket_path': self.socket_path, 'budget': self.budget}
+
+    def __setstate__(self, state):
+        self.__init__(state['socket_path'], budget=state['budget'])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def run_service(socket_path, kg_path, ops_path, snapshot_path=None, interpreter_kwargs=None, authkey=None):
+    interpreter = load_interpreter(kg_path, ops_path, snapshot_path, **dict(interpreter_kwargs or {}))
+    InterpreterService(interpreter, socket_path, authkey).serve_forever()
+
+
+def wait_for_service(socket_path, timeout=CONNECT_TIMEOUT, process=None, authkey=None):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            client = InterpreterClient(socket_path, authkey)
+            client.ping()
+            return client
+        except (OSError, EOFError):
+            if process is not None and not process.is_alive():
+                raise RuntimeError(f'interpreter service on {socket_path} exited with {process.exitcode}')
+            if time.time() > deadline:
+                raise TimeoutError(f'no interpreter service on {socket_path} after {timeout}s')
+            time.sleep(0.1)
+
+
+def start_interpreter_service(socket_path, kg_path, ops_path, snapshot_path=None, interpreter_kwargs=None,
+                              authkey=None, start_method=None, timeout=CONNECT_TIMEOUT):
+    # background process serving the KG on socket_path, returned once it answers. it is not a daemon (its
+    # execute_traces may start a process pool) and is shut down when this process exits
+    ctx = mp.get_context(start_method)
+    process = ctx.Process(target=run_service,
+                          args=(socket_path, kg_path, ops_path, snapshot_path, interpreter_kwargs, authkey))
+    process.start()
+    atexit.register(stop_interpreter_service, socket_path, process, authkey)
+    wait_for_service(socket_path, timeout, process, authkey).close()
+    return process
+
+
+def stop_interpreter_service(socket_path, process=None, authkey=None, timeout=10.0):
+    if process is not None and not process.is_alive():
+        return
+    try:
+        InterpreterClient(socket_path, authkey).shutdown()
+    except (OSError, EOFError):
+        pass
+    if process is not None:
+        process.join(timeout)
+        if process.is_alive():
+            process.terminate()
+
+
+def ensure_interpreter_service(socket_path, kg_path, ops_path, snapshot_path=None, interpreter_kwargs=None):
+    # reuse the service listening on socket_path (started by a parent, whose authkey is in the env) or start
+    # one with a new authkey, and point connect_interpreter of this process and its children at it.
+    # returns the started process (None when one was already running)
+    process = None
+    authkey = env_authkey() or new_authkey()
+    try:
+        wait_for_service(socket_path, timeout=0, authkey=authkey).close()
+    except mp.AuthenticationError:
+        raise RuntimeError(f'the interpreter service on {socket_path} was started with another authkey')
+    except (TimeoutError, RuntimeError):
+        process = start_interpreter_service(socket_path, kg_path, ops_path, snapshot_path, interpreter_kwargs,
+                                            authkey)
+    os.environ[SOCKET_ENV] = socket_path
+    os.environ[AUTHKEY_ENV] = authkey.hex()
+    return process
+
+
+def connect_interpreter(kg_path, ops_path, snapshot_path=None, socket_path=None, **interpreter_kwargs):
+    # InterpreterClient of the service on socket_path (default: $MIMIC_INTERPRETER_SOCKET), or a local
+    # MimicInterpreter when there is none. profiler and budget are kept by the client
+    socket_path = socket_path or os.environ.get(SOCKET_ENV)
+    if socket_path:
+        try:
+            return InterpreterClient(socket_path, profiler=interpreter_kwargs.get('profiler'),
+                                     budget=interpreter_kwargs.get('budget'))
+        except (OSError, EOFError) as e:
+            logger.warning(f'no interpreter service on {socket_path} ({e!r}), loading the KG in this process')
+    return load_interpreter(kg_path, ops_path, snapshot_path, **interpreter_kwargs)
+
+
+def load_interpreter(kg_path, ops_path, snapshot_path=None, **interpreter_kwargs):
+    # a VersionedInterpreter (hot-swappable) on a versioned snapshot root, a MimicInterpreter otherwise
+    if is_versioned_snapshot(snapshot_path):
+        from utils.versioned_interpreter import VersionedInterpreter
+        return VersionedInterpreter(kg_path, ops_path, snapshot_path, **interpreter_kwargs)
+    from utils.interpreter import MimicInterpreter
+    return MimicInterpreter(kg_path, ops_path, snapshot_path, **interpreter_kwargs)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve a MimicInterpreter over a unix socket')
+    parser.add_argument('--socket', required=True)
+    parser.add_argument('--kg_path', default=f'{os.getcwd()}/data/db/mimicstar_kg/mimic_sparqlstar_kg.xml')
+    parser.add_argument('--ops_path', default=f'{os.getcwd()}/data/db/mimicstar_kg/mimicprogram_operations.json')
+    parser.add_argument('--snapshot_path',
+                        default=f'{os.getcwd()}/data/db/mimicstar_kg/mimic_sparqlstar_kg_snapshot')
+    parser.add_argument('--workers', type=int, default=1)
+    args = parser.parse_args()
+    if env_authkey() is None:
+        parser.error(f'set {AUTHKEY_ENV} to the hex authkey clients of the service connect with')
+    logging.basicConfig(level=logging.INFO)
+    run_service(args.socket, args.kg_path, args.ops_path, args.snapshot_path, {'workers': args.workers})
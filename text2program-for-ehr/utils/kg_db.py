@@ -0,0 +1,204 @@
+import sqlite3
+
+import pandas as pd
+from rdflib import Literal, URIRef, XSD
+
+
+# the table mapping of the mimicsqlstar KG (the *_dtype maps of mimic_sparql/build_mimicsparql_kg/kg_complex_schema.py).
+# build_complex_kg_from_mimicsqlstar_db.py reads the tables it serializes with read_kg_tables, the interpreter loads a
+# db with read_kg_columns, so both build the same KG
+DOMAIN = ''
+
+PATIENTS_DTYPE = {
+    'SUBJECT_ID': 'entity',
+    'NAME': XSD.string,
+    'DOB': XSD.dateTime,
+    'GENDER': XSD.string,
+    'EXPIRE_FLAG': XSD.integer,
+    'DOD': XSD.dateTime,
+    'DOD_YEAR': XSD.float,
+    'DOB_YEAR': XSD.integer,
+}
+ADMISSIONS_DTYPE = {
+    'SUBJECT_ID': 'entity',
+    'HADM_ID': 'entity',
+    'MARITAL_STATUS': XSD.string,
+    'AGE': XSD.integer,
+    'LANGUAGE': XSD.string,
+    'RELIGION': XSD.string,
+    'ADMISSION_TYPE': XSD.string,
+    'DAYS_STAY': XSD.integer,
+    'INSURANCE': XSD.string,
+    'ETHNICITY': XSD.string,
+    'ADMISSION_LOCATION': XSD.string,
+    'DISCHARGE_LOCATION': XSD.string,
+    'DIAGNOSIS': XSD.string,
+    'ADMITYEAR': XSD.integer,
+    'ADMITTIME': XSD.dateTime,
+    # (sic) XSD.datetime in kg_complex_schema.py, the datatype of the serialized KG (spelled out: rdflib warns
+    # on the undefined XSD term)
+    'DISCHTIME': URIRef(f'{XSD}datetime'),
+}
+DIAGNOSES_DTYPE = {
+    'DIAGNOSES': 'entity',
+    'HADM_ID': 'entity',
+    'DIAGNOSES_ICD9_CODE': 'entity',
+}
+D_ICD_DIAGNOSES_DTYPE = {
+    'DIAGNOSES_ICD9_CODE': 'entity',
+    'DIAGNOSES_SHORT_TITLE': XSD.string,
+    'DIAGNOSES_LONG_TITLE': XSD.string,
+}
+PROCEDURES_DTYPE = {
+    'PROCEDURES': 'entity',
+    'HADM_ID': 'entity',
+    'PROCEDURES_ICD9_CODE': 'entity',
+}
+D_ICD_PROCEDURES_DTYPE = {
+    'PROCEDURES_ICD9_CODE': 'entity',
+    'PROCEDURES_SHORT_TITLE': XSD.string,
+    'PROCEDURES_LONG_TITLE': XSD.string,
+}
+PRESCRIPTIONS_DTYPE = {
+    'PRESCRIPTIONS': 'entity',
+    'HADM_ID': 'entity',
+    'ICUSTAY_ID': 'entity',
+    'DRUG_TYPE': XSD.string,
+    'DRUG': XSD.string,
+    'FORMULARY_DRUG_CD': XSD.string,
+    'ROUTE': XSD.string,
+    'DRUG_DOSE': XSD.string,
+}
+LAB_DTYPE = {
+    'LAB': 'entity',
+    'HADM_ID': 'entity',
+    'ITEMID': 'entity',
+    'CHARTTIME': XSD.string,
+    'FLAG': XSD.string,
+    'VALUE_UNIT': XSD.string,
+}
+D_LABITEM_DTYPE = {
+    'ITEMID': 'entity',
+    'LABEL': XSD.string,
+    'FLUID': XSD.string,
+    'CATEGORY': XSD.string,
+}
+
+
+def is_none_nan(val):
+    if val is None:
+        return True
+    if isinstance(val, str) and val.lower() in ['none', 'nan']:
+        return True
+    return val != val
+
+
+def clean_text(val):
+    if isinstance(val, str):
+        val = val.replace('\\', ' ')
+    return val
+
+
+def uri2str(uri):
+    return uri.lower()
+
+
+def literal2str(obj, literal_type):
+    # (identity, string) of a literal of the serialized KG as MimicInterpreter reads it:
+    # identity is the normalized lexical form rdflib compares literals by, string is str() of its python value.
+    # the script lower cases every value, literals included
+    literal = Literal(clean_text(obj.lower()), datatype=literal_type)
+    return str(literal), str(literal.toPython())
+
+
+def table2columns(df, parent_col, subject_col, col_types):
+    # the triples of a table as (sub, rel, obj identity, obj string) rows, without building rdflib terms per
+    # triple: every distinct value of a column is converted once
+    rows = []
+    # keyed by type as well: 1 and 1.0 are equal keys but format differently
+    sub_strs = dict()
+    for col_name in col_types:
+        if col_name == parent_col:
+            sub_prefix, sub_values, obj_col, values, keep = col_name, df[col_name], subject_col, df[subject_col], False
+        elif col_name == subject_col:
+            continue
+        else:
+            sub_prefix, sub_values, obj_col, values, keep = subject_col, df[subject_col], col_name, df[col_name], True
+
+        rel = uri2str(f'{DOMAIN}/{obj_col}')
+        obj_strs = dict()
+        for sub, obj in zip(sub_values, values):
+            if keep and is_none_nan(obj):
+                continue
+            sub_key, obj_key = (sub_prefix, type(sub), sub), (type(obj), obj)
+            if sub_key not in sub_strs:
+                sub_strs[sub_key] = uri2str(f'{DOMAIN}/{sub_prefix}/{sub}')
+            if obj_key not in obj_strs:
+                if col_types[obj_col] == 'entity':
+                    uri = uri2str(f'{DOMAIN}/{obj_col}/{obj}')
+                    obj_strs[obj_key] = (uri, uri)
+                else:
+                    obj_strs[obj_key] = literal2str(f'{obj}', col_types[obj_col])
+            rows.append((sub_strs[sub_key], rel) + obj_strs[obj_key])
+    return rows
+
+
+def read_kg_tables(db_conn):
+    # (table, parent_col, subject_col, col_types) of every table of the KG, in the order they are added
+    patients = pd.read_sql_query("SELECT * FROM PATIENTS", db_conn)
+    admissions = pd.read_sql_query("SELECT * FROM ADMISSIONS", db_conn)
+
+    diagnoses = pd.read_sql_query("SELECT * FROM DIAGNOSES", db_conn)
+    diagnoses = diagnoses.rename({'ICD9_CODE': 'DIAGNOSES_ICD9_CODE'}, axis=1)
+
+    d_icd_diagnoses = pd.read_sql_query("SELECT * FROM D_ICD_DIAGNOSES", db_conn)
+    d_icd_diagnoses = d_icd_diagnoses.rename({'ICD9_CODE': 'DIAGNOSES_ICD9_CODE',
+                                              'SHORT_TITLE': 'DIAGNOSES_SHORT_TITLE',
+                                              'LONG_TITLE': 'DIAGNOSES_LONG_TITLE'}, axis=1)
+
+    procedures = pd.read_sql_query("SELECT * FROM PROCEDURES", db_conn)
+    procedures = procedures.rename({'ICD9_CODE': 'PROCEDURES_ICD9_CODE'}, axis=1)
+
+    d_icd_procedures = pd.read_sql_query("SELECT * FROM D_ICD_PROCEDURES", db_conn)
+    d_icd_procedures = d_icd_procedures.rename({'ICD9_CODE': 'PROCEDURES_ICD9_CODE',
+                                                'SHORT_TITLE': 'PROCEDURES_SHORT_TITLE',
+                                                'LONG_TITLE': 'PROCEDURES_LONG_TITLE'}, axis=1)
+
+    prescriptions = pd.read_sql_query("SELECT * FROM PRESCRIPTIONS", db_conn)
+    prescriptions['ICUSTAY_ID'] = prescriptions['ICUSTAY_ID'].apply(lambda x: str(x) if x == x else None)
+
+    lab = pd.read_sql_query("SELECT * FROM LAB", db_conn)
+    d_labitem = pd.read_sql_query("SELECT * FROM D_LABITEM", db_conn)
+
+    return [(patients, '', 'SUBJECT_ID', PATIENTS_DTYPE),
+            (admissions, 'SUBJECT_ID', 'HADM_ID', ADMISSIONS_DTYPE),
+            (diagnoses, 'HADM_ID', 'DIAGNOSES', DIAGNOSES_DTYPE),
+            (d_icd_diagnoses, '', 'DIAGNOSES_ICD9_CODE', D_ICD_DIAGNOSES_DTYPE),
+            (procedures, 'HADM_ID', 'PROCEDURES', PROCEDURES_DTYPE),
+            (d_icd_procedures, '', 'PROCEDURES_ICD9_CODE', D_ICD_PROCEDURES_DTYPE),
+            (prescriptions, 'HADM_ID', 'PRESCRIPTIONS', PRESCRIPTIONS_DTYPE),
+            (lab, 'HADM_ID', 'LAB', LAB_DTYPE),
+            (d_labitem, '', 'ITEMID', D_LABITEM_DTYPE)]
+
+
+def read_kg_columns(db_path):
+    # sub, rel and obj strings of the KG build_complex_kg_from_mimicsqlstar_db.py serializes, as MimicInterpreter
+    # reads them back from the xml, built straight from mimicsqlstar.db. like the rdflib graph, repeated triples
+    # are kept once
+    db_conn = sqlite3.connect(db_path)
+    try:
+        tables = read_kg_tables(db_conn)
+    finally:
+        db_conn.close()
+
+    seen = set()
+    sub, rel, obj = [], [], []
+    for df, parent_col, subject_col, col_types in tables:
+        for s, r, obj_id, o in table2columns(df, parent_col, subject_col, col_types):
+            if (s, r, obj_id) in seen:
+                continue
+            seen.add((s, r, obj_id))
+            sub.append(s)
+            rel.append(r)
+            obj.append(o)
+    return sub, rel, obj
@@ -0,0 +1,204 @@
+import os
+import json
+import shutil
+
+import numpy as np
+
+from utils.kg_snapshot import SNAPSHOT_META_FILE, is_kg_snapshot, save_kg_snapshot, save_kg_snapshot_version, \
+    is_versioned_snapshot, publish_snapshot_version, kg_content_hash
+from utils.string_pool import StringPool, unicode_array
+from utils.kg_index import RelationCSR, SortedValueIndex, SegmentedCSR, SegmentedValueIndex
+from utils.planner import KGStats, update_role_subset
+from utils.temporal import TEMPORAL_RELATIONS, TIME_DTYPE, NAT, parse_datetime
+
+
+# delta segments of a snapshot live in <snapshot>/deltas/<seq>, applied in seq order on top of the snapshot
+# arrays (the snapshot meta records the last seq merged into them as delta_seq)
+DELTAS_DIR = 'deltas'
+# per sub/obj id columns of the interpreter computed from the string alone, extended for the new strings
+STRING_COLUMNS = ['sub_obj_isnum', 'sub_obj_num', 'sub_obj_isuri', 'sub_obj_nl_isnum', 'sub_obj_nl_num']
+
+
+def delta_segments(snapshot_path):
+    # [(seq, path)] of the delta segments appended to a snapshot, in order
+    root = os.path.join(snapshot_path, DELTAS_DIR)
+    if not os.path.isdir(root):
+        return []
+    return sorted((int(name), os.path.join(root, name)) for name in os.listdir(root)
+                  if name.isdigit() and is_kg_snapshot(os.path.join(root, name)))
+
+
+def snapshot_delta_seq(snapshot_path):
+    # last delta seq merged into the snapshot arrays
+    with open(os.path.join(snapshot_path, SNAPSHOT_META_FILE)) as f:
+        return json.load(f).get('delta_seq', 0)
+
+
+def save_kg_delta(snapshot_path, seq, arrays, meta):
+    return save_kg_snapshot(os.path.join(snapshot_path, DELTAS_DIR, f'{seq:06d}'), arrays, meta)
+
+
+def new_strings(pool, strings):
+    # StringPool of the strings missing from pool, in order of first appearance
+    missing = strings[pool.lookup(strings, default=-1) < 0]
+    _, first = np.unique(missing, return_index=True)
+    return StringPool.from_strings(missing[np.sort(first)].tolist())
+
+
+def existing_triples(interpreter, triples):
+    # mask of the (sub, rel, obj) id rows already in the KG: the (rel, sub) row of the forward index holds obj
+    known = np.flatnonzero((triples < [len(interpreter.sub_obj_pool), len(interpreter.rel_pool),
+                                       len(interpreter.sub_obj_pool)]).all(axis=1))
+    edges, counts = interpreter.fwd_index.gather_keys(triples[known, 1], triples[known, 0], np.arange(len(known)),
+                                                      len(known))
+    segments = np.repeat(np.arange(len(known)), counts)
+    found = segments[interpreter.triples['obj'][edges] == triples[known[segments], 2]]
+    exists = np.zeros(len(triples), dtype=bool)
+    exists[known[found]] = True
+    return exists
+
+
+def build_kg_delta(interpreter, sub, rel, obj):
+    # (arrays, meta) of the delta segment adding the string triples missing from the KG, None when there are
+    # none. the work is proportional to the delta: only its strings are parsed and hashed and only its triples
+    # indexed (edges numbered from 0, shifted by the KG size when applied)
+    sub, rel, obj = unicode_array(sub), unicode_array(rel), unicode_array(obj)
+    n_sub_obj, n_rels, n_triples = len(interpreter.sub_obj_pool), len(interpreter.rel_pool), \
+        len(interpreter.triples['sub'])
+    new_sub_obj = new_strings(interpreter.sub_obj_pool, np.concatenate([sub, obj]))
+    new_rel = new_strings(interpreter.rel_pool, rel)
+    sub_obj_pool, rel_pool = interpreter.sub_obj_pool.extend(new_sub_obj), interpreter.rel_pool.extend(new_rel)
+
+    triples = np.stack([sub_obj_pool.lookup(sub), rel_pool.lookup(rel), sub_obj_pool.lookup(obj)], axis=1)
+    _, first = np.unique(triples, axis=0, return_index=True)
+    triples = triples[np.sort(first)]
+    triples = triples[~existing_triples(interpreter, triples)]
+    if len(triples) == 0:
+        return None
+    delta = {'sub': triples[:, 0], 'rel': triples[:, 1], 'obj': triples[:, 2]}
+
+    arrays = dict()
+    arrays.update(new_sub_obj.to_arrays('sub_obj'))
+    arrays.update(new_rel.to_arrays('rel'))
+    arrays.update(delta)
+    arrays['sub_obj_isnum'], arrays['sub_obj_num'] = interpreter.build_numeric_pool(new_sub_obj)
+    arrays['sub_obj_isuri'], arrays['sub_obj_nl_isnum'], arrays['sub_obj_nl_num'] = \
+        interpreter.build_nl_numeric_pool(new_sub_obj)
+    # objects of temporal relations, existing ones included: an old string can become a date of a new triple
+    temporal = rel_pool.lookup(TEMPORAL_RELATIONS, default=-1)
+    time_ids = np.unique(delta['obj'][np.isin(delta['rel'], temporal[temporal >= 0])])
+    arrays['sub_obj_time_ids'] = time_ids
+    # (named apart from the time_ arrays of the time index)
+    arrays['sub_obj_time_values'] = np.array([parse_datetime(s) for s in sub_obj_pool.decode(time_ids).tolist()],
+                                             dtype=TIME_DTYPE)
+
+    # values of the delta objects in the extended id columns
+    old = delta['obj'] < n_sub_obj
+    num = np.where(old, interpreter.sub_obj_num[np.where(old, delta['obj'], 0)],
+                   arrays['sub_obj_num'][np.where(old, 0, delta['obj'] - n_sub_obj)])
+    isnum = np.where(old, interpreter.sub_obj_isnum[np.where(old, delta['obj'], 0)],
+                     arrays['sub_obj_isnum'][np.where(old, 0, delta['obj'] - n_sub_obj)])
+    times = np.full(len(delta['obj']), NAT, dtype=TIME_DTYPE)
+    in_time = np.isin(delta['obj'], time_ids)
+    times[in_time] = arrays['sub_obj_time_values'][np.searchsorted(time_ids, delta['obj'][in_time])]
+    arrays['triples_num_idx'] = isnum
+
+    n_rels_after = len(rel_pool)
+    fwd = RelationCSR.build(delta['sub'], delta['rel'], n_rels_after)
+    rev = RelationCSR.build(delta['obj'], delta['rel'], n_rels_after)
+    arrays.update(fwd.to_arrays('fwd'))
+    arrays.update(rev.to_arrays('rev'))
+    arrays.update(SortedValueIndex.build(num, delta['rel'], isnum, n_rels_after).to_arrays('num'))
+    arrays.update(SortedValueIndex.build(times, delta['rel'], np.isin(delta['rel'], temporal) & ~np.isnat(times),
+                                         n_rels_after).to_arrays('time'))
+    arrays['stats_role_subset'] = update_role_subset(
+        interpreter.stats.role_subset, SegmentedCSR.extend(interpreter.fwd_index, fwd, n_triples),
+        SegmentedCSR.extend(interpreter.rev_index, rev, n_triples), np.unique(triples[:, [0, 2]]), n_rels_after)
+    meta = {'n_triples': n_triples, 'n_sub_obj': n_sub_obj, 'n_rel': n_rels, 'n_new_triples': int(len(triples))}
+    return arrays, meta
+
+
+def apply_kg_delta(interpreter, arrays, meta):
+    # interpreter attributes of the KG extended by a delta segment, as a dict assigned in one update (the
+    # arrays of the interpreter are not modified: executions still holding them read a consistent KG)
+    n_triples = len(interpreter.triples['sub'])
+    if (meta['n_triples'], meta['n_sub_obj'], meta['n_rel']) != \
+            (n_triples, len(interpreter.sub_obj_pool), len(interpreter.rel_pool)):
+        raise ValueError(f"the delta extends a KG of {meta['n_triples']} triples, {meta['n_sub_obj']} strings and "
+                         f"{meta['n_rel']} relations, not this one")
+    new_sub_obj = StringPool.from_arrays(arrays, 'sub_obj')
+    sub_obj_pool = interpreter.sub_obj_pool.extend(new_sub_obj)
+    rel_pool = interpreter.rel_pool.extend(StringPool.from_arrays(arrays, 'rel'))
+
+    state = {name: np.concatenate([getattr(interpreter, name), arrays[name]]) for name in STRING_COLUMNS}
+    times = np.concatenate([interpreter.sub_obj_time, np.full(len(new_sub_obj), NAT, dtype=TIME_DTYPE)])
+    times[arrays['sub_obj_time_ids']] = arrays['sub_obj_time_values']
+    state['sub_obj_time'] = times
+    state.update(sub_obj_pool=sub_obj_pool, rel_pool=rel_pool, sub_obj2id=sub_obj_pool.index(),
+                 id2sub_obj=sub_obj_pool, rel2id=rel_pool.index(), id2rel=rel_pool, _casefold2ids=None)
+    # the columns and strings are extended before the triples, and the triples before the indexes pointing
+    # into them
+    state['triples'] = {name: np.concatenate([interpreter.triples[name], arrays[name]])
+                        for name in ('sub', 'rel', 'obj')}
+    state['triples_num_idx'] = np.concatenate([interpreter.triples_num_idx, arrays['triples_num_idx']])
+    state['fwd_index'] = SegmentedCSR.extend(interpreter.fwd_index, RelationCSR.from_arrays(arrays, 'fwd'),
+                                             n_triples)
+    state['rev_index'] = SegmentedCSR.extend(interpreter.rev_index, RelationCSR.from_arrays(arrays, 'rev'),
+                                             n_triples)
+    state['num_index'] = SegmentedValueIndex.extend(interpreter.num_index,
+                                                    SortedValueIndex.from_arrays(arrays, 'num'), n_triples)
+    state['time_index'] = SegmentedValueIndex.extend(interpreter.time_index,
+                                                     SortedValueIndex.from_arrays(arrays, 'time'), n_triples)
+    state['stats'] = KGStats(state['fwd_index'], state['rev_index'], state['num_index'],
+                             arrays['stats_role_subset'], state['time_index'])
+    return state
+
+
+def compact_kg(interpreter):
+    # merges the delta segments of the interpreter's snapshot into new snapshot arrays with full indexes, and maps
+    # them. deltas appended while the indexes are built are moved over and stay deltas. a snapshot that is a
+    # version of a versioned root is compacted into a new published version. returns the compacted snapshot path
+    snapshot_path = interpreter.snapshot_path
+    with interpreter.delta_lock:
+        seq = interpreter.delta_seq
+        # the KG as of seq: a detached copy of the interpreter's attributes (its arrays are never modified)
+        merged = object.__new__(type(interpreter))
+        merged.__dict__.update(interpreter.__dict__)
+    if seq == interpreter.base_seq:
+        return snapshot_path
+    merged.build_indexes()
+    arrays, meta = merged.snapshot_arrays()
+    meta['delta_seq'] = seq
+
+    root = os.path.dirname(snapshot_path)
+    versioned = is_versioned_snapshot(root)
+    if versioned:
+        version = kg_content_hash(merged.sub_obj_pool.tolist(), merged.rel_pool.tolist(), merged.triples, arrays)
+        compacted_path = os.path.join(root, version)
+        save_kg_snapshot_version(root, version, arrays, meta, publish=False)
+    else:
+        compacted_path = save_kg_snapshot(f'{snapshot_path}.compact-{os.getpid()}', arrays, meta)
+    del merged, arrays
+
+    with interpreter.delta_lock:
+        # deltas appended meanwhile extend the compacted KG as they extended the old one (same ids and order)
+        for later_seq, path in delta_segments(snapshot_path):
+            if later_seq > seq:
+                os.makedirs(os.path.join(compacted_path, DELTAS_DIR), exist_ok=True)
+                os.rename(path, os.path.join(compacted_path, DELTAS_DIR, os.path.basename(path)))
+        if versioned:
+            publish_snapshot_version(root, version)
+        else:
+            # the old snapshot is moved aside, not deleted, until the compacted one is in its place: there is a
+            # complete snapshot at snapshot_path but for the instant between the two renames
+            old_path = f'{snapshot_path}.old-{os.getpid()}'
+            os.rename(snapshot_path, old_path)
+            try:
+                os.rename(compacted_path, snapshot_path)
+            except OSError:
+                os.rename(old_path, snapshot_path)
+                raise
+            shutil.rmtree(old_path)
+            compacted_path = snapshot_path
+        interpreter.reload_snapshot(compacted_path)
+    return compacted_path
@@ -0,0 +1,253 @@
+import numpy as np
+
+
+def ranges_to_index(starts, ends):
+    # concatenation of arange(s, e) for every (s, e) pair, without a python loop
+    lengths = ends - starts
+    total = int(lengths.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    shifts = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+    return np.arange(total, dtype=np.int64) + shifts
+
+
+class RelationCSR:
+    # CSR adjacency keyed by relation id:
+    #   rows of relation r are row_keys[rel_ptr[r]:rel_ptr[r + 1]] (sorted, unique key ids),
+    #   triples of row i are edges[row_ptr[i]:row_ptr[i + 1]] (ascending triple index)
+    ARRAYS = ['rel_ptr', 'row_keys', 'row_ptr', 'edges']
+
+    def __init__(self, rel_ptr, row_keys, row_ptr, edges):
+        self.rel_ptr = rel_ptr
+        self.row_keys = row_keys
+        self.row_ptr = row_ptr
+        self.edges = edges
+
+    @classmethod
+    def build(cls, keys, rels, n_rels):
+        edges = np.lexsort((keys, rels)).astype(np.int64)
+        sorted_keys, sorted_rels = keys[edges], rels[edges]
+
+        new_row = np.ones(len(edges), dtype=bool)
+        new_row[1:] = (sorted_rels[1:] != sorted_rels[:-1]) | (sorted_keys[1:] != sorted_keys[:-1])
+        row_start = np.flatnonzero(new_row)
+
+        row_ptr = np.append(row_start, len(edges)).astype(np.int64)
+        row_keys = sorted_keys[row_start].astype(np.int64)
+        rel_ptr = np.searchsorted(sorted_rels[row_start], np.arange(n_rels + 1)).astype(np.int64)
+        return cls(rel_ptr, row_keys, row_ptr, edges)
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix):
+        return cls(*[arrays[f'{prefix}_{name}'] for name in cls.ARRAYS])
+
+    def to_arrays(self, prefix):
+        return {f'{prefix}_{name}': getattr(self, name) for name in self.ARRAYS}
+
+    @classmethod
+    def has_arrays(cls, arrays, prefix):
+        return all(f'{prefix}_{name}' in arrays for name in cls.ARRAYS)
+
+    def lookup(self, rel, keys):
+        # triple indices (in triple order) of every (key, rel, *) edge, keys must be unique
+        rows = self.rows(rel, keys)
+        edges = self.edges[ranges_to_index(self.row_ptr[rows], self.row_ptr[rows + 1])]
+        edges.sort()
+        return edges
+
+    def rows(self, rel, keys):
+        # row positions of the keys present under rel (keys must be unique)
+        if rel < 0 or rel >= len(self.rel_ptr) - 1 or len(keys) == 0:
+            return np.zeros(0, dtype=np.int64)
+        lo, hi = self.rel_ptr[rel], self.rel_ptr[rel + 1]
+        segment = self.row_keys[lo:hi]
+        if len(segment) == 0:
+            return np.zeros(0, dtype=np.int64)
+        pos = np.searchsorted(segment, keys)
+        pos[pos == len(segment)] = 0
+        return lo + pos[segment[pos] == keys]
+
+    def find_rows(self, rels, keys):
+        # row position of every (rel, key) pair (-1 when absent): one searchsorted per distinct relation
+        # over all the keys asked under it
+        rels, keys = np.asarray(rels, dtype=np.int64), np.asarray(keys, dtype=np.int64)
+        rows = np.full(len(keys), -1, dtype=np.int64)
+        distinct, inverse = np.unique(rels, return_inverse=True)
+        for i, rel in enumerate(distinct):
+            if rel < 0 or rel >= len(self.rel_ptr) - 1:
+                continue
+            lo, hi = self.rel_ptr[rel], self.rel_ptr[rel + 1]
+            segment = self.row_keys[lo:hi]
+            if len(segment) == 0:
+                continue
+            members = np.flatnonzero(inverse == i)
+            pos = np.searchsorted(segment, keys[members])
+            pos[pos == len(segment)] = 0
+            found = segment[pos] == keys[members]
+            rows[members[found]] = lo + pos[found]
+        return rows
+
+    def gather(self, rows, segments, n_segments):
+        # edges of the rows grouped by segment (ascending triple index within each), and the edge count of
+        # every segment. segmented version of lookup: rows of one segment must be distinct
+        lengths = self.row_ptr[rows + 1] - self.row_ptr[rows]
+        edges = self.edges[ranges_to_index(self.row_ptr[rows], self.row_ptr[rows + 1])]
+        edge_segments = np.repeat(segments, lengths)
+        # one sort of (segment, edge) packed into a single integer
+        packed = edge_segments * len(self.edges) + edges
+        packed.sort()
+        return packed % len(self.edges), np.bincount(edge_segments, minlength=n_segments)
+
+    def has_keys(self, rels, keys):
+        return self.find_rows(rels, keys) >= 0
+
+    def gather_keys(self, rels, keys, segments, n_segments):
+        # gather of the rows of the (rel, key) pairs present in the index
+        rows = self.find_rows(rels, keys)
+        found = rows >= 0
+        return self.gather(rows[found], segments[found], n_segments)
+
+    def keys(self, rel):
+        if rel < 0 or rel >= len(self.rel_ptr) - 1:
+            return np.zeros(0, dtype=np.int64)
+        return self.row_keys[self.rel_ptr[rel]:self.rel_ptr[rel + 1]]
+
+    def count(self, rel, keys):
+        # number of (key, rel, *) edges, without gathering them
+        rows = self.rows(rel, keys)
+        return int((self.row_ptr[rows + 1] - self.row_ptr[rows]).sum())
+
+    def n_edges(self, rel):
+        if rel < 0 or rel >= len(self.rel_ptr) - 1:
+            return 0
+        return int(self.row_ptr[self.rel_ptr[rel + 1]] - self.row_ptr[self.rel_ptr[rel]])
+
+    def n_rows(self, rel):
+        if rel < 0 or rel >= len(self.rel_ptr) - 1:
+            return 0
+        return int(self.rel_ptr[rel + 1] - self.rel_ptr[rel])
+
+
+class SortedValueIndex:
+    # per-relation value column sorted by value (nan last):
+    #   relation r owns values[rel_ptr[r]:rel_ptr[r + 1]] and the matching triple indices in edges
+    ARRAYS = ['rel_ptr', 'values', 'edges']
+
+    def __init__(self, rel_ptr, values, edges):
+        self.rel_ptr = rel_ptr
+        self.values = values
+        self.edges = edges
+
+    @classmethod
+    def build(cls, values, rels, mask, n_rels):
+        triple_idx = np.flatnonzero(mask).astype(np.int64)
+        order = np.lexsort((values[triple_idx], rels[triple_idx]))
+        edges = triple_idx[order]
+        rel_ptr = np.searchsorted(rels[edges], np.arange(n_rels + 1)).astype(np.int64)
+        return cls(rel_ptr, values[edges], edges)
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix):
+        return cls(*[arrays[f'{prefix}_{name}'] for name in cls.ARRAYS])
+
+    def to_arrays(self, prefix):
+        return {f'{prefix}_{name}': getattr(self, name) for name in self.ARRAYS}
+
+    @classmethod
+    def has_arrays(cls, arrays, prefix):
+        return all(f'{prefix}_{name}' in arrays for name in cls.ARRAYS)
+
+    def range(self, rel, lower=None, upper=None, lower_inclusive=True, upper_inclusive=True):
+        # triple indices (in triple order) of relation rel whose value lies within the bounds
+        start, end = self.bounds(rel, lower, upper, lower_inclusive, upper_inclusive)
+        edges = np.array(self.edges[start:end])
+        edges.sort()
+        return edges
+
+    def count(self, rel, lower=None, upper=None, lower_inclusive=True, upper_inclusive=True):
+        start, end = self.bounds(rel, lower, upper, lower_inclusive, upper_inclusive)
+        return int(end - start)
+
+    def bounds(self, rel, lower, upper, lower_inclusive, upper_inclusive):
+        # [start, end) positions in values/edges of the matching triples
+        if rel < 0 or rel >= len(self.rel_ptr) - 1:
+            return 0, 0
+        if (lower is not None and lower != lower) or (upper is not None and upper != upper):
+            return 0, 0
+
+        lo, hi = self.rel_ptr[rel], self.rel_ptr[rel + 1]
+        segment = self.values[lo:hi]
+        start = 0 if lower is None else np.searchsorted(segment, lower, 'left' if lower_inclusive else 'right')
+        if upper is None:
+            end = self.n_valid(segment)
+        else:
+            end = np.searchsorted(segment, upper, 'right' if upper_inclusive else 'left')
+        return lo + start, lo + max(start, end)
+
+    def n_valid(self, segment):
+        # nan sorts last, everything before it is comparable
+        if segment.dtype.kind == 'f':
+            return np.searchsorted(segment, np.inf, 'right')
+        return len(segment)
+
+
+class SegmentedCSR:
+    # RelationCSR of a KG with appended delta segments: one index per segment, its triple indices shifted by
+    # the offset of the segment. segments hold consecutive triple ranges in order, so concatenating the
+    # per-segment results keeps them in triple order
+    def __init__(self, parts):
+        # [(index, offset)]
+        self.parts = parts
+
+    @classmethod
+    def extend(cls, index, part, offset):
+        parts = index.parts if isinstance(index, SegmentedCSR) else [(index, 0)]
+        return cls(parts + [(part, offset)])
+
+    def lookup(self, rel, keys):
+        return np.concatenate([index.lookup(rel, keys) + offset for index, offset in self.parts])
+
+    def gather_keys(self, rels, keys, segments, n_segments):
+        edges, edge_segments, counts = [], [], np.zeros(n_segments, dtype=np.int64)
+        for index, offset in self.parts:
+            part_edges, part_counts = index.gather_keys(rels, keys, segments, n_segments)
+            edges.append(part_edges + offset)
+            edge_segments.append(np.repeat(np.arange(n_segments), part_counts))
+            counts += part_counts
+        # stable: within a segment the edges of earlier parts come first
+        order = np.argsort(np.concatenate(edge_segments), kind='stable')
+        return np.concatenate(edges)[order], counts
+
+    def has_keys(self, rels, keys):
+        return np.logical_or.reduce([index.has_keys(rels, keys) for index, _ in self.parts])
+
+    def keys(self, rel):
+        return np.unique(np.concatenate([index.keys(rel) for index, _ in self.parts]))
+
+    def count(self, rel, keys):
+        return sum(index.count(rel, keys) for index, _ in self.parts)
+
+    def n_edges(self, rel):
+        return sum(index.n_edges(rel) for index, _ in self.parts)
+
+    def n_rows(self, rel):
+        # a key present in several segments counts once per segment (degree estimates only)
+        return sum(index.n_rows(rel) for index, _ in self.parts)
+
+
+class SegmentedValueIndex:
+    # SortedValueIndex over delta segments, as SegmentedCSR
+    def __init__(self, parts):
+        self.parts = parts
+
+    @classmethod
+    def extend(cls, index, part, offset):
+        parts = index.parts if isinstance(index, SegmentedValueIndex) else [(index, 0)]
+        return cls(parts + [(part, offset)])
+
+    def range(self, rel, lower=None, upper=None, lower_inclusive=True, upper_inclusive=True):
+        return np.concatenate([index.range(rel, lower, upper, lower_inclusive, upper_inclusive) + offset
+                               for index, offset in self.parts])
+
+    def count(self, rel, lower=None, upper=None, lower_inclusive=True, upper_inclusive=True):
+        return sum(index.count(rel, lower, upper, lower_inclusive, upper_inclusive) for index, _ in self.parts)
@@ -0,0 +1,123 @@
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+
+
+SNAPSHOT_FORMAT_VERSION = 1
+SNAPSHOT_META_FILE = 'meta.json'
+# a versioned snapshot root holds one snapshot per content hash, CURRENT names the published one
+SNAPSHOT_CURRENT_FILE = 'CURRENT'
+SNAPSHOT_HASH_LENGTH = 16
+
+
+def is_kg_snapshot(snapshot_path):
+    return os.path.isfile(os.path.join(snapshot_path, SNAPSHOT_META_FILE))
+
+
+def save_kg_snapshot(snapshot_path, arrays, meta=None):
+    # write into a sibling directory first so readers never see a half-written snapshot
+    tmp_path = f'{snapshot_path}.tmp-{os.getpid()}'
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_path, f'{name}.npy'), np.ascontiguousarray(array), allow_pickle=False)
+
+    meta = dict(meta or {})
+    meta['format_version'] = SNAPSHOT_FORMAT_VERSION
+    meta['arrays'] = sorted(arrays.keys())
+    with open(os.path.join(tmp_path, SNAPSHOT_META_FILE), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+    if os.path.exists(snapshot_path):
+        shutil.rmtree(snapshot_path)
+    os.rename(tmp_path, snapshot_path)
+    return snapshot_path
+
+
+def load_kg_snapshot(snapshot_path, mmap_mode='r'):
+    with open(os.path.join(snapshot_path, SNAPSHOT_META_FILE)) as f:
+        meta = json.load(f)
+
+    if meta.get('format_version') != SNAPSHOT_FORMAT_VERSION:
+        raise ValueError(f"unsupported KG snapshot format {meta.get('format_version')} in {snapshot_path}")
+
+    # read-only memory maps: pages are shared by every process that opens the same snapshot
+    arrays = {name: np.load(os.path.join(snapshot_path, f'{name}.npy'), mmap_mode=mmap_mode, allow_pickle=False)
+              for name in meta['arrays']}
+    return arrays, meta
+
+
+def kg_content_hash(sub_obj_strings, rel_strings, triples, array_names):
+    # hash of the KG as a set of (sub, rel, obj) strings and of the snapshot layout. the ids and the triple order
+    # depend on the order the KG was parsed in (rdflib's varies between processes), so both are canonicalized:
+    # ids are replaced by the rank of their string, triples sorted
+    digest = hashlib.sha256(json.dumps([SNAPSHOT_FORMAT_VERSION, sorted(array_names)]).encode())
+    ranks = []
+    for strings in (sub_obj_strings, rel_strings):
+        order = sorted(range(len(strings)), key=strings.__getitem__)
+        digest.update(json.dumps([strings[i] for i in order]).encode())
+        rank = np.empty(len(strings), dtype=np.int64)
+        rank[order] = np.arange(len(strings))
+        ranks.append(rank)
+    canonical = np.stack([ranks[0][triples['sub']], ranks[1][triples['rel']], ranks[0][triples['obj']]], axis=1)
+    canonical = canonical[np.lexsort(canonical.T[::-1])]
+    digest.update(canonical.astype('<i8').tobytes())
+    return digest.hexdigest()[:SNAPSHOT_HASH_LENGTH]
+
+
+def is_versioned_snapshot(snapshot_root):
+    return snapshot_root is not None and os.path.isfile(os.path.join(snapshot_root, SNAPSHOT_CURRENT_FILE))
+
+
+def current_snapshot_version(snapshot_root):
+    with open(os.path.join(snapshot_root, SNAPSHOT_CURRENT_FILE)) as f:
+        return f.read().strip()
+
+
+def resolve_kg_snapshot(snapshot_path):
+    # the published version of a versioned root, any other path as it is
+    if is_versioned_snapshot(snapshot_path):
+        return os.path.join(snapshot_path, current_snapshot_version(snapshot_path))
+    return snapshot_path
+
+
+def snapshot_versions(snapshot_root):
+    if not os.path.isdir(snapshot_root):
+        return []
+    return sorted(name for name in os.listdir(snapshot_root) if is_kg_snapshot(os.path.join(snapshot_root, name)))
+
+
+def save_kg_snapshot_version(snapshot_root, version, arrays, meta=None, publish=True):
+    # snapshot under <snapshot_root>/<version> (a content hash), written once per content. returns the version
+    if is_kg_snapshot(snapshot_root):
+        raise ValueError(f'{snapshot_root} is an unversioned KG snapshot')
+    if not is_kg_snapshot(os.path.join(snapshot_root, version)):
+        os.makedirs(snapshot_root, exist_ok=True)
+        save_kg_snapshot(os.path.join(snapshot_root, version), arrays, dict(meta or {}, content_hash=version))
+    if publish:
+        publish_snapshot_version(snapshot_root, version)
+    return version
+
+
+def publish_snapshot_version(snapshot_root, version):
+    # CURRENT is replaced by one rename: readers see the previous version or this one, never a partial name
+    if not is_kg_snapshot(os.path.join(snapshot_root, version)):
+        raise ValueError(f'no KG snapshot version {version} in {snapshot_root}')
+    tmp_path = os.path.join(snapshot_root, f'{SNAPSHOT_CURRENT_FILE}.tmp-{os.getpid()}')
+    with open(tmp_path, 'w') as f:
+        f.write(f'{version}\n')
+    os.replace(tmp_path, os.path.join(snapshot_root, SNAPSHOT_CURRENT_FILE))
+
+
+def prune_snapshot_versions(snapshot_root, keep=()):
+    # removes every version but the published one and keep. a process still mapping a removed version reads on:
+    # the unlinked files live until their last mapping is closed
+    keep = set(keep) | {current_snapshot_version(snapshot_root)}
+    removed = [version for version in snapshot_versions(snapshot_root) if version not in keep]
+    for version in removed:
+        shutil.rmtree(os.path.join(snapshot_root, version))
+    return removed
@@ -0,0 +1,176 @@
+import os
+import json
+import argparse
+from collections import Counter
+
+import numpy as np
+
+from utils.program import Ref, compile_trace
+from utils.kg_snapshot import SNAPSHOT_META_FILE, is_kg_snapshot, save_kg_snapshot, load_kg_snapshot
+from utils.entity_set import IdEntSet, IdLitSet
+from utils.planner import HOP_OPS, SUB
+
+
+VIEWS_DIR = 'views'
+EQUAL_OP = 'gen_entset_equal'
+
+
+def chain_signatures(program):
+    # idx -> signature of every hop chain in the program: (rel of a gen_entset_equal with literal arguments,
+    # ((hop op, rel), ...)) from that lookup up to the node. the lookup value itself is not part of it
+    signatures, values = dict(), dict()
+    for idx in program.order:
+        node = program.nodes[idx]
+        if node.op == EQUAL_OP:
+            rel, value = node.args
+            if isinstance(rel, str) and isinstance(value, (str, int, float)):
+                signatures[idx], values[idx] = (rel, ()), value
+        elif node.op in HOP_OPS:
+            set_pos, rel_pos, _, _ = HOP_OPS[node.op]
+            source, rel = node.args[set_pos], node.args[rel_pos]
+            # a litSet ends the chain, hops only take entity sets
+            if isinstance(source, Ref) and source.idx in signatures and isinstance(rel, str) and \
+                    program.nodes[source.idx].op != 'gen_litset':
+                start, hops = signatures[source.idx]
+                signatures[idx], values[idx] = (start, hops + ((node.op, rel),)), values[source.idx]
+    return signatures, values
+
+
+def mine_hop_chains(trace_files, min_count=20, min_hops=2, max_views=32):
+    # the most frequent hop chains of the `trace` field of jsonl files, each counted once per trace,
+    # as [(signature, count)]
+    counts = Counter()
+    for trace_file in trace_files:
+        with open(trace_file) as f:
+            for line in f:
+                try:
+                    program = compile_trace(json.loads(line)['trace'])
+                except Exception:
+                    continue
+                signatures, _ = chain_signatures(program)
+                counts.update({signature for signature in signatures.values() if len(signature[1]) >= min_hops})
+    return [(signature, count) for signature, count in counts.most_common(max_views) if count >= min_count]
+
+
+def materialize_chain(interpreter, signature):
+    # (keys, ptr, ids, kind) of a chain: for every value id under its start relation (keys, ascending) the ids
+    # execute_trace produces at the end of the chain, ids[ptr[i]:ptr[i + 1]]. values for which any step comes
+    # out empty (the trace would fail) are left out. None when the start relation is unknown
+    rel, hops = signature
+    if rel not in interpreter.rel2id:
+        return None
+    index = interpreter.rev_index
+    rel_id = interpreter.rel2id[rel]
+    keys = np.array(index.keys(rel_id), dtype=np.int64)
+    # level 0: gen_entset_equal of every value, one segment per key
+    edges, counts = index.gather_keys(np.full(len(keys), rel_id), keys, np.arange(len(keys)), len(keys))
+    ids, segments = interpreter.triples['sub'][edges], np.repeat(np.arange(len(keys)), counts)
+    for op, hop_rel in hops:
+        if hop_rel not in interpreter.rel2id:
+            return None
+        _, _, in_side, _ = HOP_OPS[op]
+        index = interpreter.fwd_index if in_side == SUB else interpreter.rev_index
+        column = interpreter.triples['obj'] if in_side == SUB else interpreter.triples['sub']
+        # the unique input ids of every segment, as unique_ids() of the hop input
+        packed = np.unique(segments * len(interpreter.sub_obj_pool) + ids)
+        in_segments, in_ids = packed // len(interpreter.sub_obj_pool), packed % len(interpreter.sub_obj_pool)
+        edges, counts = index.gather_keys(np.full(len(in_ids), interpreter.rel2id[hop_rel]), in_ids, in_segments,
+                                          len(keys))
+        ids, segments = column[edges], np.repeat(np.arange(len(keys)), counts)
+    # a key with items at the end of the chain had items at every step before
+    counts = np.bincount(segments, minlength=len(keys))
+    alive = counts > 0
+    kind = 'litSet' if hops[-1][0] == 'gen_litset' else 'entSet'
+    return keys[alive], np.concatenate([[0], np.cumsum(counts[alive])]).astype(np.int64), ids, kind
+
+
+def build_path_views(interpreter, chains, max_items=50000000):
+    # arrays and meta of the views of the mined chains, skipping chains whose view would hold more than max_items
+    # ids in total
+    arrays, views = dict(), []
+    for signature, count in chains:
+        view = materialize_chain(interpreter, signature)
+        if view is None or len(view[2]) > max_items:
+            continue
+        keys, ptr, ids, kind = view
+        name = f'view{len(views)}'
+        arrays.update({f'{name}_keys': keys, f'{name}_ptr': ptr, f'{name}_ids': ids})
+        views.append({'name': name, 'rel': signature[0], 'hops': [list(hop) for hop in signature[1]],
+                      'kind': kind, 'count': count, 'n_keys': int(len(keys)), 'n_ids': int(len(ids))})
+    return arrays, {'views': views}
+
+
+def save_path_views(snapshot_path, arrays, meta):
+    # next to the snapshot arrays, rebuilt with it: view ids are only valid for this snapshot
+    return save_kg_snapshot(os.path.join(snapshot_path, VIEWS_DIR), arrays, meta)
+
+
+class PathViews:
+    # materialized hop chains of a snapshot: the meta is read on first use, the arrays of a view are mapped the
+    # first time a program uses it
+    def __init__(self, snapshot_path):
+        self.path = os.path.join(snapshot_path, VIEWS_DIR)
+        self._signatures = None
+        self._arrays = None
+
+    @property
+    def signatures(self):
+        # signature -> view meta
+        if self._signatures is None:
+            signatures = dict()
+            if is_kg_snapshot(self.path):
+                with open(os.path.join(self.path, SNAPSHOT_META_FILE)) as f:
+                    for view in json.load(f)['views']:
+                        signatures[(view['rel'], tuple(tuple(hop) for hop in view['hops']))] = view
+            self._signatures = signatures
+        return self._signatures
+
+    def __bool__(self):
+        return len(self.signatures) > 0
+
+    def match(self, program):
+        # idx -> (view meta, lookup value) of every node computed by a view
+        if not self:
+            return {}
+        signatures, values = chain_signatures(program)
+        return {idx: (self.signatures[signature], values[idx]) for idx, signature in signatures.items()
+                if signature in self.signatures}
+
+    def lookup(self, interpreter, view, value):
+        # the end of the chain for one lookup value, None when the view does not hold it (the chain fails there,
+        # or the value is unknown): the program then runs the chain itself
+        if self._arrays is None:
+            self._arrays, _ = load_kg_snapshot(self.path)
+        keys, ptr = self._arrays[f"{view['name']}_keys"], self._arrays[f"{view['name']}_ptr"]
+        # views are only matched without case folding: one value, one id
+        value_id = interpreter.equal_value_ids(value, casefold=False)[0]
+        pos = int(np.searchsorted(keys, value_id))
+        if pos == len(keys) or keys[pos] != value_id:
+            return None
+        ids = self._arrays[f"{view['name']}_ids"][ptr[pos]:ptr[pos + 1]]
+        return IdLitSet(ids) if view['kind'] == 'litSet' else IdEntSet(ids)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Mine frequent hop chains from training traces and store them '
+                                                 'as views in a KG snapshot')
+    parser.add_argument('--snapshot_path',
+                        default=f'{os.getcwd()}/data/db/mimicstar_kg/mimic_sparqlstar_kg_snapshot')
+    parser.add_argument('--kg_path', default=f'{os.getcwd()}/data/db/mimicstar_kg/mimic_sparqlstar_kg.xml')
+    parser.add_argument('--ops_path', default=f'{os.getcwd()}/data/db/mimicstar_kg/mimicprogram_operations.json')
+    parser.add_argument('--train_files', nargs='+', required=True)
+    parser.add_argument('--min_count', type=int, default=20)
+    parser.add_argument('--min_hops', type=int, default=2)
+    parser.add_argument('--max_views', type=int, default=32)
+    parser.add_argument('--max_items', type=int, default=50000000)
+    args = parser.parse_args()
+
+    from utils.interpreter import MimicInterpreter
+    interpreter = MimicInterpreter(args.kg_path, args.ops_path, args.snapshot_path)
+    chains = mine_hop_chains(args.train_files, args.min_count, args.min_hops, args.max_views)
+    arrays, meta = build_path_views(interpreter, chains, args.max_items)
+    # the version the interpreter mapped when snapshot_path is a versioned root
+    save_path_views(interpreter.snapshot_path, arrays, meta)
+    for view in meta['views']:
+        print(f"{view['name']}: {view['rel']} {view['hops']} (in {view['count']} traces, {view['n_keys']} values, "
+              f"{view['n_ids']} ids)")
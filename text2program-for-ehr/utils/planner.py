@@ -0,0 +1,263 @@
+import weakref
+
+import numpy as np
+
+from utils.program import Ref
+from utils.temporal import parse_datetime
+
+
+SUB, OBJ = 0, 1
+ROLE_CHUNK_SIZE = 1 << 15
+INTERSECT_OP = 'intersect_entsets'
+RANGE_OPS = {
+    # op -> bounds passed to SortedValueIndex.range, same as the interpreter methods
+    'gen_entset_atleast': lambda value: {'upper': value},
+    'gen_entset_less': lambda value: {'upper': value, 'upper_inclusive': False},
+    'gen_entset_atmost': lambda value: {'lower': value},
+    'gen_entset_more': lambda value: {'lower': value, 'lower_inclusive': False},
+}
+TIME_OPS = {
+    # op -> bounds passed to the time SortedValueIndex.range
+    'gen_entset_before': lambda value: {'upper': value, 'upper_inclusive': False},
+    'gen_entset_after': lambda value: {'lower': value, 'lower_inclusive': False},
+    'gen_entset_between': lambda start, end: {'lower': start, 'upper': end},
+}
+HOP_OPS = {
+    # op -> (position of the input set, position of the relation, role the input must play, role of the output)
+    'gen_entset_down': (0, 1, SUB, OBJ),
+    'gen_entset_up': (1, 0, OBJ, SUB),
+    'gen_litset': (0, 1, SUB, OBJ),
+}
+SAFE_COMBINATORS = {'count_entset', 'count_litset', 'intersect_entsets', 'intersect_litsets',
+                    'union_entsets', 'union_litsets', 'concat_litsets'}
+
+
+def role(rel, side):
+    return 2 * rel + side
+
+
+def build_role_subset(sub, rel, obj, n_entities, n_rels):
+    # role_subset[p, q] is True when every entity playing role p also plays role q,
+    # role 2 * r is "subject of relation r" and 2 * r + 1 "object of relation r"
+    n_roles = 2 * n_rels
+    pairs = np.unique(np.concatenate([np.asarray(sub, dtype=np.int64) * n_roles + 2 * np.asarray(rel),
+                                      np.asarray(obj, dtype=np.int64) * n_roles + 2 * np.asarray(rel) + 1]))
+    ents, roles = pairs // n_roles, pairs % n_roles
+
+    # per entity role signature, 16 roles per uint16 column, then one row per distinct signature
+    n_chunks = max((n_roles + 15) // 16, 1)
+    signatures = np.zeros((n_entities, n_chunks), dtype=np.uint16)
+    for chunk in range(n_chunks):
+        in_chunk = roles // 16 == chunk
+        weights = np.left_shift(1, roles[in_chunk] % 16).astype(np.float64)
+        signatures[:, chunk] = np.bincount(ents[in_chunk], weights=weights, minlength=n_entities).astype(np.uint16)
+    signatures = np.unique(signatures, axis=0)
+
+    # violations[p, q]: number of signatures with role p but without role q
+    violations = np.zeros((n_roles, n_roles), dtype=np.int64)
+    for start in range(0, len(signatures), ROLE_CHUNK_SIZE):
+        chunk = signatures[start:start + ROLE_CHUNK_SIZE]
+        has_role = np.unpackbits(chunk.view(np.uint8), axis=1, bitorder='little')[:, :n_roles].astype(np.float32)
+        violations += (has_role.T @ (1 - has_role)).astype(np.int64)
+    return violations == 0
+
+
+def update_role_subset(role_subset, fwd_index, rev_index, ents, n_rels):
+    # role_subset after triples of the entities ents were appended, their roles read back from the indexes
+    # (which hold the new triples). only these entities changed: relations they break are dropped, and new
+    # roles (of new relations) are only known to contain each other and the roles implied by ents
+    n_old, n_roles = len(role_subset), 2 * n_rels
+    subset = np.ones((n_roles, n_roles), dtype=bool)
+    subset[:n_old, :n_old] = role_subset
+    subset[:n_old, n_old:] = False
+    rels = np.arange(n_rels)
+    for start in range(0, len(ents), ROLE_CHUNK_SIZE):
+        chunk = ents[start:start + ROLE_CHUNK_SIZE]
+        rel_ids, keys = np.tile(rels, len(chunk)), np.repeat(chunk, n_rels)
+        has_role = np.zeros((len(chunk), n_roles), dtype=np.float32)
+        has_role[:, 0::2] = fwd_index.has_keys(rel_ids, keys).reshape(len(chunk), n_rels)
+        has_role[:, 1::2] = rev_index.has_keys(rel_ids, keys).reshape(len(chunk), n_rels)
+        subset &= (has_role.T @ (1 - has_role)) == 0
+    subset[np.arange(n_roles), np.arange(n_roles)] = True
+    return subset
+
+
+class KGStats:
+    # cardinality statistics of a loaded KG: per relation edge/row counts and exact per value counts come
+    # straight from the indexes, role_subset (entity participation) is computed once and kept in the snapshot
+    ARRAYS = ['role_subset']
+
+    def __init__(self, fwd_index, rev_index, num_index, role_subset, time_index=None):
+        self.fwd_index = fwd_index
+        self.rev_index = rev_index
+        self.num_index = num_index
+        self.time_index = time_index
+        self.role_subset = np.asarray(role_subset, dtype=bool)
+
+    @classmethod
+    def build(cls, fwd_index, rev_index, num_index, triples, n_entities, n_rels, arrays=None, time_index=None):
+        arrays = arrays or {}
+        if 'stats_role_subset' in arrays:
+            role_subset = arrays['stats_role_subset']
+        else:
+            role_subset = build_role_subset(triples['sub'], triples['rel'], triples['obj'], n_entities, n_rels)
+        return cls(fwd_index, rev_index, num_index, role_subset, time_index)
+
+    def to_arrays(self, prefix='stats'):
+        return {f'{prefix}_{name}': getattr(self, name) for name in self.ARRAYS}
+
+    def out_degree(self, rel):
+        return self.fwd_index.n_edges(rel) / max(self.fwd_index.n_rows(rel), 1)
+
+    def in_degree(self, rel):
+        return self.rev_index.n_edges(rel) / max(self.rev_index.n_rows(rel), 1)
+
+    def domain(self, rel, side):
+        # roles every entity of this role also plays
+        return self.role_subset[role(rel, side)]
+
+
+class NodeEstimate:
+    # card: estimated output size, safe: the node can neither raise nor return None,
+    # nonempty: a safe node whose output is known to be non-empty,
+    # domain: bool vector of roles every output entity is known to play (None when unknown)
+    __slots__ = ('card', 'safe', 'nonempty', 'domain')
+
+    def __init__(self, card, safe, domain=None, nonempty=None):
+        self.card = card
+        self.safe = safe
+        self.nonempty = safe if nonempty is None else nonempty
+        self.domain = domain
+
+    def __repr__(self):
+        return f'NodeEstimate(card={self.card:.1f}, safe={self.safe})'
+
+
+class ProgramPlan:
+    # views: idx -> (path view, lookup value) of the hop chains a materialized path view answers
+    def __init__(self, program, estimates, views=None):
+        self.program = program
+        self.estimates = estimates
+        self.branches = dict()
+        self.views = views or {}
+
+    def __getitem__(self, idx):
+        return self.estimates[idx]
+
+    def intersection_branches(self, idx):
+        # operands of a chain of intersect_entsets nodes, most selective first.
+        # the intersection is commutative and associative, so any order yields the same set
+        if idx not in self.branches:
+            operands, stack = [], [idx]
+            while stack:
+                node = self.program.nodes[stack.pop()]
+                for arg in reversed(node.args):
+                    if isinstance(arg, Ref) and self.program.nodes[arg.idx].op == INTERSECT_OP:
+                        stack.append(arg.idx)
+                    else:
+                        operands.append(arg)
+            self.branches[idx] = sorted(operands, key=lambda arg: self.card_of(arg))
+        return self.branches[idx]
+
+    def card_of(self, arg):
+        return self.estimates[arg.idx].card if isinstance(arg, Ref) else 1.0
+
+
+class Planner:
+    # estimates every node of a compiled program from KGStats, plans are cached per program
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.plans = weakref.WeakKeyDictionary()
+
+    def plan(self, program):
+        path_views = self.interpreter.path_views
+        key = (self.interpreter.casefold_equal, path_views)
+        cached = self.plans.get(program)
+        if cached is None or cached[0] != key:
+            estimates = dict()
+            for idx in program.order:
+                estimates[idx] = self.estimate(program, program.nodes[idx], estimates)
+            # views are keyed by exact value ids, a case-folded lookup cannot use them
+            views = path_views.match(program) if path_views and not self.interpreter.casefold_equal else None
+            cached = (key, ProgramPlan(program, estimates, views))
+            self.plans[program] = cached
+        return cached[1]
+
+    def estimate(self, program, node, estimates):
+        stats = self.interpreter.stats
+        children = [estimates[arg.idx] for arg in node.args if isinstance(arg, Ref)]
+        children_safe = all(child.safe for child in children)
+
+        if node.op == 'gen_entset_equal':
+            rel, value = self.rel_id(node.args[0]), node.args[1]
+            if rel is None or isinstance(value, Ref):
+                return NodeEstimate(0.0, False)
+            card = stats.rev_index.count(rel, self.value_ids(value))
+            # a readable gen_* op with an empty result fails the trace
+            return NodeEstimate(float(card), card > 0, stats.domain(rel, SUB))
+
+        if node.op in RANGE_OPS:
+            rel, value = self.rel_id(node.args[0]), node.args[1]
+            if rel is None or isinstance(value, Ref):
+                return NodeEstimate(0.0, False)
+            try:
+                value = value if type(value) == float else float(value)
+            except (TypeError, ValueError):
+                return NodeEstimate(0.0, False)
+            card = stats.num_index.count(rel, **RANGE_OPS[node.op](value))
+            return NodeEstimate(float(card), card > 0, stats.domain(rel, SUB))
+
+        if node.op in TIME_OPS:
+            rel, values = self.rel_id(node.args[0]), node.args[1:]
+            if rel is None or stats.time_index is None or any(isinstance(value, Ref) for value in values):
+                return NodeEstimate(0.0, False)
+            values = [parse_datetime(value) for value in values]
+            if any(np.isnat(value) for value in values):
+                return NodeEstimate(0.0, False)
+            card = stats.time_index.count(rel, **TIME_OPS[node.op](*values))
+            return NodeEstimate(float(card), card > 0, stats.domain(rel, SUB))
+
+        if node.op in HOP_OPS:
+            set_pos, rel_pos, in_side, out_side = HOP_OPS[node.op]
+            source, rel = node.args[set_pos], self.rel_id(node.args[rel_pos])
+            if rel is None or not isinstance(source, Ref):
+                return NodeEstimate(1.0, False)
+            child = estimates[source.idx]
+            degree = stats.out_degree(rel) if in_side == SUB else stats.in_degree(rel)
+            edges = stats.fwd_index.n_edges(rel)
+            # gen_entSet_down/up raise on an empty input, so the input has to be known non-empty, and then all
+            # of its entities need the relation for the output to be non-empty as well
+            safe = child.safe and child.nonempty and child.domain is not None and \
+                bool(child.domain[role(rel, in_side)])
+            domain = stats.domain(rel, out_side) if node.op != 'gen_litset' else None
+            return NodeEstimate(min(child.card * degree, float(edges)), safe, domain)
+
+        sets_only = all(isinstance(arg, Ref) and program.nodes[arg.idx].out_type in ('entSet', 'litSet')
+                        for arg in node.args)
+        safe = node.op in SAFE_COMBINATORS and children_safe and sets_only
+
+        if node.op == INTERSECT_OP:
+            domain = None
+            for child in children:
+                if child.domain is not None:
+                    domain = child.domain if domain is None else domain | child.domain
+            return NodeEstimate(min([child.card for child in children] or [1.0]), safe, domain, nonempty=False)
+
+        if node.op == 'union_entsets':
+            domain = None
+            if all(child.domain is not None for child in children) and children:
+                domain = np.logical_and.reduce([child.domain for child in children])
+            return NodeEstimate(sum(child.card for child in children), safe, domain,
+                                nonempty=safe and any(child.nonempty for child in children))
+
+        card = sum(child.card for child in children) if node.op.endswith('litsets') else 1.0
+        nonempty = node.op == 'union_litsets' and safe and any(child.nonempty for child in children)
+        return NodeEstimate(card, safe, nonempty=nonempty)
+
+    def rel_id(self, rel):
+        if not isinstance(rel, str):
+            return None
+        return self.interpreter.rel2id.get(rel)
+
+    def value_ids(self, value):
+        return self.interpreter.equal_value_ids(value)
@@ -0,0 +1,225 @@
+import json
+import threading
+
+import numpy as np
+
+from utils.program import Ref
+from utils.budget import is_budget_exceeded
+
+
+# histogram bucket upper edges, the last bucket holds everything above the last edge
+TIME_BUCKETS_MS = [0.01, 0.1, 1.0, 10.0, 100.0, 1000.0]
+CARD_BUCKETS = [0, 1, 10, 100, 1000, 10000, 100000]
+
+
+def cardinality(value):
+    # number of items of an op input/output: sets and litSets by length, concatenated litSets summed,
+    # scalars count as one, None (failed op) has none
+    if value is None:
+        return None
+    if isinstance(value, list):
+        return sum(cardinality(item) or 0 for item in value)
+    if isinstance(value, (str, bytes)) or not hasattr(value, '__len__'):
+        return 1
+    return len(value)
+
+
+def bucket(edges, value):
+    # index of the histogram bucket holding value
+    return int(np.searchsorted(edges, value, 'left'))
+
+
+class NodeRecord:
+    # what happened to one op node of a profiled trace: seconds spent in the op itself (children excluded),
+    # set input cardinalities, output cardinality, and whether it came from the result cache,
+    # raised, or was skipped by an early exit
+    __slots__ = ('idx', 'op', 'calls', 'seconds', 'in_cards', 'out_card', 'cache', 'error', 'skipped')
+
+    def __init__(self, idx, op):
+        self.idx = idx
+        self.op = op
+        self.calls = 0
+        self.seconds = 0.0
+        self.in_cards = []
+        self.out_card = None
+        self.cache = None
+        self.error = None
+        self.skipped = False
+
+    def describe(self):
+        if self.skipped:
+            return 'skipped'
+        parts = []
+        if self.cache == 'hit':
+            parts.append('cache=hit')
+        else:
+            parts.append(f'time={self.seconds * 1000:.3f}ms')
+            if self.in_cards:
+                parts.append(f"in={self.in_cards}")
+            if self.cache == 'miss':
+                parts.append('cache=miss')
+        parts.append(f'out={self.out_card}')
+        if self.error is not None:
+            parts.append(f'error={type(self.error).__name__}')
+        return ' '.join(parts)
+
+
+class TraceProfile:
+    # per node records of one execute_trace call, str() gives the EXPLAIN tree
+    def __init__(self, trace):
+        self.trace = trace
+        self.program = None
+        self.records = dict()
+        self.result = None
+        self.error = None
+        self.compile_seconds = 0.0
+        self.decode_seconds = 0.0
+        self.total_seconds = 0.0
+
+    def record(self, idx):
+        if idx not in self.records:
+            self.records[idx] = NodeRecord(idx, self.program.nodes[idx].op)
+        return self.records[idx]
+
+    def op_done(self, idx, seconds, args, value=None, error=None):
+        # called once per apply_op of the node (a folded intersection applies it once per operand)
+        record = self.record(idx)
+        record.calls += 1
+        record.seconds += seconds
+        record.in_cards.extend(cardinality(arg) for arg in args if not isinstance(arg, (str, int, float)))
+        record.out_card = cardinality(value)
+        record.error = error
+
+    def cache_lookup(self, idx, hit, value=None):
+        record = self.record(idx)
+        record.cache = 'hit' if hit else 'miss'
+        if hit:
+            record.out_card = cardinality(value)
+
+    def skip(self, idx):
+        if idx not in self.records:
+            self.record(idx).skipped = True
+
+    def explain(self):
+        lines = [f'trace: {self.trace.strip()}']
+        if self.program is None:
+            lines.append(f'compile error: {self.error}')
+            return '\n'.join(lines)
+        lines.append(f'total={self.total_seconds * 1000:.3f}ms compile={self.compile_seconds * 1000:.3f}ms '
+                     f'decode={self.decode_seconds * 1000:.3f}ms result={self.describe_result()}')
+        self.explain_node(self.program.root, '', '', set(), lines)
+        return '\n'.join(lines)
+
+    def describe_result(self):
+        if is_budget_exceeded(self.result):
+            return f'budget exceeded ({self.error})'
+        return cardinality(self.result)
+
+    def explain_node(self, idx, head, indent, shown, lines):
+        node = self.program.nodes[idx]
+        literals = ', '.join(repr(arg) for arg in node.args if not isinstance(arg, Ref))
+        record = self.records.get(idx)
+        status = record.describe() if record is not None else 'not run'
+        if idx in shown:
+            lines.append(f'{head}{node.op}({literals}) [n{idx}] (shared, see above)')
+            return
+        shown.add(idx)
+        lines.append(f'{head}{node.op}({literals}) [n{idx}] {status}')
+        children = node.refs()
+        for i, child in enumerate(children):
+            last = i == len(children) - 1
+            self.explain_node(child, indent + ('`- ' if last else '|- '), indent + ('   ' if last else '|  '),
+                              shown, lines)
+
+    def __str__(self):
+        return self.explain()
+
+
+class OpProfiler:
+    # per op type aggregate of profiled traces: calls, errors, cache hits, skipped nodes, total/max time and
+    # histograms of op time and input/output cardinality. states of several processes can be merged
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.n_traces = 0
+        self.n_failed = 0
+        self.n_budget_exceeded = 0
+        self.total_seconds = 0.0
+        self.ops = dict()
+
+    def new_op_stats(self):
+        return {'calls': 0, 'errors': 0, 'cache_hits': 0, 'skipped': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                'time_hist': [0] * (len(TIME_BUCKETS_MS) + 1),
+                'in_card_hist': [0] * (len(CARD_BUCKETS) + 1),
+                'out_card_hist': [0] * (len(CARD_BUCKETS) + 1)}
+
+    def add(self, profile):
+        with self.lock:
+            self.n_traces += 1
+            self.n_failed += profile.result is None
+            self.n_budget_exceeded += is_budget_exceeded(profile.result)
+            self.total_seconds += profile.total_seconds
+            for record in profile.records.values():
+                stats = self.ops.setdefault(record.op, self.new_op_stats())
+                if record.skipped:
+                    stats['skipped'] += 1
+                    continue
+                if record.cache == 'hit':
+                    stats['cache_hits'] += 1
+                    continue
+                ms = record.seconds * 1000
+                stats['calls'] += 1
+                stats['errors'] += record.error is not None
+                stats['total_ms'] += ms
+                stats['max_ms'] = max(stats['max_ms'], ms)
+                stats['time_hist'][bucket(TIME_BUCKETS_MS, ms)] += 1
+                for card in record.in_cards:
+                    if card is not None:
+                        stats['in_card_hist'][bucket(CARD_BUCKETS, card)] += 1
+                if record.out_card is not None:
+                    stats['out_card_hist'][bucket(CARD_BUCKETS, record.out_card)] += 1
+
+    def state(self):
+        with self.lock:
+            return {'n_traces': self.n_traces, 'n_failed': self.n_failed,
+                    'n_budget_exceeded': self.n_budget_exceeded, 'total_seconds': self.total_seconds,
+                    'ops': json.loads(json.dumps(self.ops))}
+
+    def merge(self, state):
+        with self.lock:
+            self.n_traces += state['n_traces']
+            self.n_failed += state['n_failed']
+            self.n_budget_exceeded += state.get('n_budget_exceeded', 0)
+            self.total_seconds += state['total_seconds']
+            for op, other in state['ops'].items():
+                stats = self.ops.setdefault(op, self.new_op_stats())
+                for name, value in other.items():
+                    if name.endswith('_hist'):
+                        stats[name] = [a + b for a, b in zip(stats[name], value)]
+                    elif name == 'max_ms':
+                        stats[name] = max(stats[name], value)
+                    else:
+                        stats[name] += value
+
+    def summary(self):
+        state = self.state()
+        state['time_buckets_ms'] = TIME_BUCKETS_MS
+        state['card_buckets'] = CARD_BUCKETS
+        for stats in state['ops'].values():
+            stats['mean_ms'] = stats['total_ms'] / stats['calls'] if stats['calls'] else 0.0
+        return state
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+        return path
+
+    def __getstate__(self):
+        return self.state()
+
+    def __setstate__(self, state):
+        self.lock = threading.Lock()
+        self.reset()
+        self.merge(state)
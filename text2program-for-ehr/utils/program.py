@@ -0,0 +1,271 @@
+import re
+import ast
+import threading
+from collections import OrderedDict, namedtuple
+
+
+# trace op name -> MimicInterpreter method, number of arguments, output type,
+# and the id-native method used by execute_trace (None: always run on readable values)
+TraceOp = namedtuple('TraceOp', ['method', 'n_args', 'out_type', 'native'])
+TRACE_OPS = {
+    'gen_entset_down': TraceOp('gen_entSet_down', 2, 'entSet', 'gen_entSet_down_ids'),
+    'gen_entset_up': TraceOp('gen_entSet_up', 2, 'entSet', 'gen_entSet_up_ids'),
+    'gen_litset': TraceOp('gen_litSet', 2, 'litSet', 'gen_litSet_ids'),
+    'gen_entset_equal': TraceOp('gen_entSet_equal', 2, 'entSet', 'gen_entSet_equal_ids'),
+    'gen_entset_atleast': TraceOp('gen_entSet_atleast', 2, 'entSet', 'gen_entSet_atleast_ids'),
+    'gen_entset_less': TraceOp('gen_entSet_less', 2, 'entSet', 'gen_entSet_less_ids'),
+    'gen_entset_atmost': TraceOp('gen_entSet_atmost', 2, 'entSet', 'gen_entSet_atmost_ids'),
+    'gen_entset_more': TraceOp('gen_entSet_more', 2, 'entSet', 'gen_entSet_more_ids'),
+    'gen_entset_before': TraceOp('gen_entSet_before', 2, 'entSet', 'gen_entSet_before_ids'),
+    'gen_entset_after': TraceOp('gen_entSet_after', 2, 'entSet', 'gen_entSet_after_ids'),
+    'gen_entset_between': TraceOp('gen_entSet_between', 3, 'entSet', 'gen_entSet_between_ids'),
+    'count_litset': TraceOp('count_litSet', 1, 'value', 'count_ids'),
+    'count_entset': TraceOp('count_entSet', 1, 'value', 'count_ids'),
+    'maximum_litset': TraceOp('maximum_litSet', 1, 'value', 'maximum_ids'),
+    'minimum_litset': TraceOp('minimum_litSet', 1, 'value', 'minimum_ids'),
+    'average_litset': TraceOp('average_litSet', 1, 'value', 'average_ids'),
+    'intersect_entsets': TraceOp('intersect_entSets', 2, 'entSet', 'intersect_ids'),
+    'intersect_litsets': TraceOp('intersect_litSets', 2, 'litSet', 'intersect_ids'),
+    'union_entsets': TraceOp('union_entSets', 2, 'entSet', 'union_ids'),
+    'union_litsets': TraceOp('union_litSets', 2, 'litSet', 'union_ids'),
+    'concat_litsets': TraceOp('concat_litSets', 2, 'litSets', 'concat_litSets'),
+}
+
+# ops newer than the operations json: name -> (op whose argument and output types it takes,
+# number of extra arguments repeating the template's last argument type)
+EXTRA_OPERATIONS = {
+    'gen_entset_before': ('gen_entset_less', 0),
+    'gen_entset_after': ('gen_entset_more', 0),
+    'gen_entset_between': ('gen_entset_atleast', 1),
+}
+
+EXE_TOKEN = '<exe>'
+STEP_PREFIX_RE = re.compile(r'\s*<r\d+>\s*=')
+TOKEN_RE = re.compile(r"""\s*(?:
+    (?P<ref><r(?P<ref_idx>\d+)>)
+    |(?P<name>[A-Za-z_]\w*)
+    |(?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+    |(?P<number>[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+    |(?P<punct>[(),])
+    )""", re.VERBOSE)
+
+
+class TraceSyntaxError(ValueError):
+    pass
+
+
+class Ref:
+    # argument that points at the result of another node of the same program
+    __slots__ = ('idx',)
+
+    def __init__(self, idx):
+        self.idx = idx
+
+    def __eq__(self, other):
+        return isinstance(other, Ref) and other.idx == self.idx
+
+    def __hash__(self):
+        return hash(('ref', self.idx))
+
+    def __repr__(self):
+        return f'<n{self.idx}>'
+
+
+class OpNode:
+    # key is the canonical text of the whole sub-program rooted here, equal across programs
+    __slots__ = ('op', 'args', 'out_type', 'key')
+
+    def __init__(self, op, args, key):
+        self.op = op
+        self.args = tuple(args)
+        self.out_type = TRACE_OPS[op].out_type
+        self.key = key
+
+    def refs(self):
+        return [arg.idx for arg in self.args if isinstance(arg, Ref)]
+
+    def __repr__(self):
+        return f"{self.op}({', '.join(repr(arg) for arg in self.args)})"
+
+
+class Program:
+    # DAG of op nodes in topological order; identical sub-expressions are shared,
+    # order holds the nodes the root actually depends on (the only ones executed)
+    def __init__(self, nodes, root, steps):
+        self.nodes = nodes
+        self.root = root
+        self.steps = steps
+        self.order = self.reachable(root)
+
+    def reachable(self, root):
+        needed = {root}
+        for idx in range(root, -1, -1):
+            if idx in needed:
+                needed.update(self.nodes[idx].refs())
+        return sorted(needed)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __repr__(self):
+        return '\n'.join(f'n{idx} = {self.nodes[idx]!r}' for idx in self.order)
+
+
+class TraceCompiler:
+    def __init__(self):
+        self.nodes = []
+        self.node_ids = dict()
+
+    def compile(self, trace):
+        steps = trace.split(EXE_TOKEN)[:-1]
+        if len(steps) == 0:
+            raise TraceSyntaxError(f'no {EXE_TOKEN} step in trace')
+
+        step_nodes = []
+        for step in steps:
+            prefix = STEP_PREFIX_RE.match(step)
+            text = step[prefix.end():] if prefix else step
+            tokens = self.tokenize(text)
+            arg, pos = self.parse_expr(tokens, 0, step_nodes)
+            if pos != len(tokens):
+                raise TraceSyntaxError(f'unexpected {tokens[pos][1]!r} in step {text!r}')
+            if not isinstance(arg, Ref):
+                raise TraceSyntaxError(f'step {text!r} is not an op call')
+            step_nodes.append(arg.idx)
+
+        return Program(self.nodes, step_nodes[-1], step_nodes)
+
+    def tokenize(self, text):
+        tokens, pos = [], 0
+        text = text.rstrip()
+        while pos < len(text):
+            m = TOKEN_RE.match(text, pos)
+            if m is None or m.end() == pos:
+                raise TraceSyntaxError(f'cannot tokenize {text[pos:]!r}')
+            kind = m.lastgroup if m.lastgroup != 'ref_idx' else 'ref'
+            tokens.append((kind, m.group(kind), m))
+            pos = m.end()
+        return tokens
+
+    def parse_expr(self, tokens, pos, step_nodes):
+        if pos >= len(tokens):
+            raise TraceSyntaxError('unexpected end of step')
+        kind, text, m = tokens[pos]
+
+        if kind == 'ref':
+            # only earlier steps can be referenced
+            step_idx = int(m.group('ref_idx'))
+            if step_idx < 1 or step_idx > len(step_nodes):
+                raise TraceSyntaxError(f'{text} does not refer to an earlier step')
+            return Ref(step_nodes[step_idx - 1]), pos + 1
+
+        if kind in ('string', 'number'):
+            try:
+                return ast.literal_eval(text), pos + 1
+            except (ValueError, SyntaxError):
+                raise TraceSyntaxError(f'bad literal {text}')
+
+        if kind == 'name':
+            if text not in TRACE_OPS:
+                raise TraceSyntaxError(f'unknown op {text!r}')
+            if pos + 1 >= len(tokens) or tokens[pos + 1][1] != '(':
+                raise TraceSyntaxError(f'expected ( after {text}')
+            args, pos = [], pos + 2
+            if pos < len(tokens) and tokens[pos][1] == ')':
+                pos += 1
+            else:
+                while True:
+                    arg, pos = self.parse_expr(tokens, pos, step_nodes)
+                    args.append(arg)
+                    if pos >= len(tokens):
+                        raise TraceSyntaxError(f'unclosed call to {text}')
+                    if tokens[pos][1] == ')':
+                        pos += 1
+                        break
+                    if tokens[pos][1] != ',':
+                        raise TraceSyntaxError(f'expected , or ) in call to {text}')
+                    pos += 1
+            if len(args) != TRACE_OPS[text].n_args:
+                raise TraceSyntaxError(f'{text} takes {TRACE_OPS[text].n_args} arguments, got {len(args)}')
+            return Ref(self.add_node(text, args)), pos
+
+        raise TraceSyntaxError(f'unexpected {text!r}')
+
+    def add_node(self, op, args):
+        # hash-consing: an identical sub-program is compiled once and shared
+        arg_keys = [self.nodes[arg.idx].key if isinstance(arg, Ref) else repr(arg) for arg in args]
+        key = f"{op}({','.join(arg_keys)})"
+        if key not in self.node_ids:
+            self.node_ids[key] = len(self.nodes)
+            self.nodes.append(OpNode(op, args, key))
+        return self.node_ids[key]
+
+
+def compile_trace(trace):
+    return TraceCompiler().compile(trace)
+
+
+def extend_operations(ops):
+    # ops as read from the operations json plus the EXTRA_OPERATIONS it lacks (typed after their template),
+    # arg_types padded with 'None' to the widest op
+    by_name = {op['name']: op for op in ops}
+    ops = list(ops)
+    for name, (template, n_extra) in EXTRA_OPERATIONS.items():
+        if name in by_name or template not in by_name:
+            continue
+        arg_types = [_type for _type in by_name[template]['arg_types'] if _type != 'None']
+        arg_types += arg_types[-1:] * n_extra
+        ops.append({'name': name, 'arg_types': arg_types, 'out_type': by_name[template]['out_type']})
+
+    max_args = max([len(op['arg_types']) for op in ops] or [0])
+    return [dict(op, arg_types=op['arg_types'] + ['None'] * (max_args - len(op['arg_types']))) for op in ops]
+
+
+class ProgramCache:
+    # LRU of compiled programs (or their syntax error messages) keyed by the normalized trace text
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.programs = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def normalize(self, trace):
+        return trace.strip()
+
+    def compile(self, trace):
+        key = self.normalize(trace)
+        with self.lock:
+            program = self.programs.get(key)
+            if program is not None:
+                self.programs.move_to_end(key)
+                self.hits += 1
+        if program is None:
+            try:
+                program = compile_trace(key)
+            except TraceSyntaxError as e:
+                program = str(e)
+            with self.lock:
+                self.misses += 1
+                self.programs[key] = program
+                if len(self.programs) > self.maxsize:
+                    self.programs.popitem(last=False)
+
+        if isinstance(program, str):
+            raise TraceSyntaxError(program)
+        return program
+
+    def clear(self):
+        with self.lock:
+            self.programs.clear()
+            self.hits, self.misses = 0, 0
+
+    def __getstate__(self):
+        # a copy in another process starts empty
+        return {'maxsize': self.maxsize}
+
+    def __setstate__(self, state):
+        self.__init__(state['maxsize'])
+
+
+PROGRAM_CACHE = ProgramCache()
@@ -0,0 +1,99 @@
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class CachedError:
+    # an op that raised is remembered too, so a failing sub-program fails again without re-running
+    __slots__ = ('exc_type', 'args')
+
+    def __init__(self, exc):
+        self.exc_type = type(exc)
+        self.args = exc.args
+
+    def reraise(self):
+        raise self.exc_type(*self.args)
+
+
+def result_nbytes(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes + 96
+    if isinstance(value, (list, tuple)):
+        return sum(result_nbytes(item) for item in value) + 56
+    if hasattr(value, 'nbytes'):
+        return int(value.nbytes) + 96
+    return sys.getsizeof(value)
+
+
+def freeze(value):
+    # cached arrays are shared by every program that hits them, so they are made read-only
+    if isinstance(value, np.ndarray):
+        value.flags.writeable = False
+    elif isinstance(value, list):
+        for item in value:
+            freeze(item)
+    return value
+
+
+class SubResultCache:
+    # LRU memo of sub-program results keyed by the canonical node key, bounded by entries and/or bytes
+    def __init__(self, max_entries=10000, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __getstate__(self):
+        # a cache sent to another process arrives empty, with the same bounds
+        return {'max_entries': self.max_entries, 'max_bytes': self.max_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def get(self, key):
+        # -> (found, value)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, self.entries[key][0]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value):
+        size = result_nbytes(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return value
+        value = freeze(value)
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.nbytes += size
+            while (self.max_entries is not None and len(self.entries) > self.max_entries) or \
+                    (self.max_bytes is not None and self.nbytes > self.max_bytes):
+                self.nbytes -= self.entries.popitem(last=False)[1][1]
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'hit_rate': self.hits / lookups if lookups else 0.0,
+                    'entries': len(self.entries), 'bytes': self.nbytes}
+
+    def reset_stats(self):
+        with self.lock:
+            self.hits, self.misses, self.evictions = 0, 0, 0
@@ -0,0 +1,589 @@
+import os
+import json
+import zlib
+import shutil
+import multiprocessing as mp
+
+import numpy as np
+
+from utils.kg_snapshot import save_kg_snapshot
+from utils.string_pool import StringPool
+from utils.program import TRACE_OPS, PROGRAM_CACHE, Ref, TraceSyntaxError
+from utils.entity_set import IdEntSet, IdLitSet
+from utils.planner import HOP_OPS, RANGE_OPS, TIME_OPS
+from utils.profiler import cardinality
+from utils.interpreter import MimicInterpreter, Execution, POOL_LOCK
+
+
+SHARDS_META_FILE = 'shards.json'
+ROOT_PREFIX = '/subject_id/'
+# owner of a sub/obj id that no subject_id root reaches, or that roots of several shards reach
+UNREACHED, SHARED = -1, -2
+
+# distribution of a node's value over the shards:
+#   PART: every shard holds the items it owns, the parts are disjoint and add up to the value
+#   SPLIT: the parts add up to the value (as a multiset), but the same item may be in several parts
+#   REPL: every shard holds the whole value
+#   COORD: computed by the coordinator from gathered values
+PART, SPLIT, REPL, COORD = 'part', 'split', 'repl', 'coord'
+SELECT_OPS = {'gen_entset_equal'} | set(RANGE_OPS) | set(TIME_OPS)
+COUNT_OPS = {'count_entset', 'count_litset'}
+SET_OPS = {'intersect_entsets', 'union_entsets'}
+
+
+def shard_of(root, n_shards):
+    # stable across processes and runs, unlike hash()
+    return zlib.crc32(root.encode('utf-8')) % n_shards
+
+
+def shard_path(sharded_path, shard):
+    return os.path.join(sharded_path, f'shard_{shard:03d}')
+
+
+def is_sharded_kg(sharded_path):
+    return os.path.isfile(os.path.join(sharded_path, SHARDS_META_FILE))
+
+
+def entity_owners(interpreter, n_shards):
+    # shard of every sub/obj id: the shard of the subject_id roots it is reachable from (following triples
+    # subject -> object), SHARED when those roots are on several shards, UNREACHED when there is none
+    sub, obj = interpreter.triples['sub'], interpreter.triples['obj']
+    owner = np.full(len(interpreter.sub_obj_pool), UNREACHED, dtype=np.int64)
+    root_ids = np.unique(sub)
+    roots = interpreter.sub_obj_pool.decode(root_ids).tolist()
+    for root_id, root in zip(root_ids.tolist(), roots):
+        if root.startswith(ROOT_PREFIX):
+            owner[root_id] = shard_of(root, n_shards)
+
+    while True:
+        src = owner[sub]
+        reached = src != UNREACHED
+        lo = np.full(len(owner), n_shards, dtype=np.int64)
+        hi = np.full(len(owner), UNREACHED, dtype=np.int64)
+        np.minimum.at(lo, obj[reached], src[reached])
+        np.maximum.at(hi, obj[reached], src[reached])
+        ids = np.flatnonzero(hi != UNREACHED)
+        incoming = np.where(lo[ids] == hi[ids], lo[ids], SHARED)
+        current = owner[ids]
+        merged = np.where((current == UNREACHED) | (current == incoming), incoming, SHARED)
+        if (merged == current).all():
+            return owner
+        owner[ids] = merged
+
+
+def relation_placement(interpreter, owner):
+    # per relation id: whether all its subjects are owned by one shard (its triples then live on the shard
+    # of their subject, the others are copied to every shard), and whether its objects are owned as well
+    sub, rel, obj = interpreter.triples['sub'], interpreter.triples['rel'], interpreter.triples['obj']
+    n_rels = len(interpreter.rel_pool)
+    sub_owner = owner[sub]
+    foreign_sub = np.bincount(rel[sub_owner < 0], minlength=n_rels)
+    foreign_obj = np.bincount(rel[owner[obj] != sub_owner], minlength=n_rels)
+    sub_owned = foreign_sub == 0
+    return sub_owned, sub_owned & (foreign_obj == 0)
+
+
+def partition_kg(interpreter, sharded_path, n_shards):
+    # split the KG of interpreter into n_shards snapshots by subject_id root: everything a patient reaches
+    # through owned relations (admissions and all below /hadm_id) lands on the patient's shard, relations with
+    # shared subjects (code dictionaries) are replicated. each shard is a complete snapshot with its own vocab
+    owner = entity_owners(interpreter, n_shards)
+    sub_owned, obj_owned = relation_placement(interpreter, owner)
+    triples = interpreter.triples
+    placement = np.where(sub_owned[triples['rel']], owner[triples['sub']], SHARED)
+
+    tmp_path = f'{sharded_path}.tmp-{os.getpid()}'
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    n_triples = []
+    for shard in range(n_shards):
+        mask = (placement == shard) | (placement == SHARED)
+        sub, rel, obj = triples['sub'][mask], triples['rel'][mask], triples['obj'][mask]
+        # ids 0/1 (<PAD>, <UNK>) are kept so that every shard vocab starts like the full one
+        local_ids = np.unique(np.concatenate([np.arange(2), sub, obj]))
+        arrays = {
+            'sub': np.searchsorted(local_ids, sub),
+            'rel': rel,
+            'obj': np.searchsorted(local_ids, obj),
+            'sub_obj_isnum': interpreter.sub_obj_isnum[local_ids],
+            'sub_obj_num': interpreter.sub_obj_num[local_ids],
+            'sub_obj_isuri': interpreter.sub_obj_isuri[local_ids],
+            'sub_obj_nl_isnum': interpreter.sub_obj_nl_isnum[local_ids],
+            'sub_obj_nl_num': interpreter.sub_obj_nl_num[local_ids],
+            'sub_obj_time': interpreter.sub_obj_time[local_ids],
+        }
+        arrays['triples_num_idx'] = arrays['sub_obj_isnum'][arrays['obj']]
+        arrays.update(StringPool.from_strings(interpreter.sub_obj_pool.decode(local_ids).tolist())
+                      .to_arrays('sub_obj'))
+        arrays.update(interpreter.rel_pool.to_arrays('rel'))
+        meta = {'n_triples': int(mask.sum()), 'n_sub_obj': len(local_ids), 'n_rel': len(interpreter.rel_pool)}
+        save_kg_snapshot(shard_path(tmp_path, shard), arrays, meta)
+        # loading builds the missing indexes, saved back so that shard workers map them as they are
+        MimicInterpreter(None, interpreter.ops_path, shard_path(tmp_path, shard)).save_snapshot(
+            shard_path(tmp_path, shard))
+        n_triples.append(meta['n_triples'])
+
+    relations = interpreter.rel_pool.decode(np.arange(len(interpreter.rel_pool))).tolist()
+    meta = {'n_shards': n_shards, 'n_triples': n_triples,
+            'sub_owned': [rel for rel, owned in zip(relations, sub_owned.tolist()) if owned],
+            'obj_owned': [rel for rel, owned in zip(relations, obj_owned.tolist()) if owned]}
+    with open(os.path.join(tmp_path, SHARDS_META_FILE), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+    if os.path.exists(sharded_path):
+        shutil.rmtree(sharded_path)
+    os.rename(tmp_path, sharded_path)
+    return sharded_path
+
+
+class ShardInterpreter(MimicInterpreter):
+    # interpreter over one shard. a shard only holds part of every PART value, so gen_* ops return empty sets
+    # instead of raising and unknown entities are dropped instead of raising: whether the trace fails is
+    # decided by the coordinator on the gathered cardinalities
+    def id_entSet(self, ids):
+        return IdEntSet(ids)
+
+    def as_id_entSet(self, entSet):
+        if isinstance(entSet, IdEntSet):
+            return entSet
+        if isinstance(entSet, str):
+            entSet = np.array([entSet])
+        if isinstance(entSet, np.ndarray) and entSet.dtype.kind == 'U':
+            ids = self.sub_obj_pool.lookup(entSet.reshape(-1), default=-1)
+            return IdEntSet(ids[ids >= 0])
+        return None
+
+    def gen_entSet_down_ids(self, entSet, rel_ent):
+        return self.hop_ids(entSet, rel_ent, self.fwd_index, 'obj')
+
+    def gen_entSet_up_ids(self, rel_ent, entSet):
+        return self.hop_ids(entSet, rel_ent, self.rev_index, 'sub')
+
+    def hop_ids(self, entSet, rel, index, side):
+        if entSet is None:
+            return None
+        source = self.as_id_entSet(entSet)
+        if source is None or not isinstance(rel, str):
+            return NotImplemented
+        triple_idx = index.lookup(self.rel2id[rel], source.unique_ids())
+        return IdEntSet(self.triples[side][triple_idx])
+
+    def set_op_ids(self, entSet1, entSet2, op):
+        # an injected (readable) operand only matters where it meets local ids in an intersection;
+        # anything else keeps the readable op so that items unknown to this shard are not lost
+        if op == 'intersect' and isinstance(entSet1, IdEntSet) != isinstance(entSet2, IdEntSet):
+            local1, local2 = self.as_id_entSet(entSet1), self.as_id_entSet(entSet2)
+            if local1 is not None and local2 is not None:
+                entSet1, entSet2 = local1, local2
+        return super().set_op_ids(entSet1, entSet2, op)
+
+    def part_value(self, value):
+        # readable part of a value; litSets stay unshortened, obj_to_nl is decided on the gathered litSet
+        if isinstance(value, IdLitSet):
+            return self.sub_obj_pool.decode(value.ids)
+        if isinstance(value, IdEntSet) and len(value) == 0:
+            return np.zeros(0, dtype='U1')
+        return self.materialize(value)
+
+    def known_mask(self, entSet):
+        strings = np.unique(np.array([entSet]) if isinstance(entSet, str) else entSet)
+        return self.sub_obj_pool.lookup(strings, default=-1) >= 0
+
+    def evaluate_request(self, trace, targets, injected):
+        # evaluate the target nodes of trace (idx -> 'value' or 'card') on this shard, with the coordinator's
+        # values of the injected nodes. returns the readable parts of the 'value' targets, the cardinality of
+        # every node evaluated here, and for hops from a literal or injected set which of its (unique) items
+        # this shard knows
+        try:
+            program = self.compile_trace(trace)
+            run = Execution(program, None, True)
+            run.results.update(injected)
+            values = {idx: self.evaluate_node(run, idx) for idx in targets}
+            values = {idx: value for idx, value in values.items() if targets[idx] == 'value'}
+            known = dict()
+            for idx, node in enumerate(program.nodes):
+                if idx not in run.results or idx in injected or node.op not in HOP_OPS:
+                    continue
+                arg = node.args[HOP_OPS[node.op][0]]
+                if isinstance(arg, Ref) and arg.idx in injected:
+                    arg = injected[arg.idx]
+                if isinstance(arg, str) or (isinstance(arg, np.ndarray) and arg.dtype.kind == 'U'):
+                    known[idx] = self.known_mask(arg)
+            return {'values': {idx: self.part_value(value) for idx, value in values.items()},
+                    'cards': {idx: cardinality(value) for idx, value in run.results.items() if idx not in injected},
+                    'known': known}
+        except Exception as e:
+            return {'error': repr(e)}
+
+
+def serve_shards(conn, shard_paths, ops_path, interpreter_kwargs):
+    # worker process loop: one request batch per shard it hosts in, one response batch per shard out
+    shards = {shard: ShardInterpreter(None, ops_path, path, **interpreter_kwargs)
+              for shard, path in shard_paths.items()}
+    conn.send('ready')
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        conn.send({shard: [shards[shard].evaluate_request(*request) for request in requests]
+                   for shard, requests in message.items()})
+    conn.close()
+
+
+class ShardPool:
+    # worker processes hosting the shards (shard k on worker k % workers). with workers=0 the shards are
+    # evaluated in this process, one after another
+    def __init__(self, shard_paths, ops_path, workers=None, interpreter_kwargs=None, start_method=None):
+        interpreter_kwargs = dict(interpreter_kwargs or {})
+        n_shards = len(shard_paths)
+        self.workers = n_shards if workers is None else min(workers, n_shards)
+        self.local = None
+        self.conns, self.processes, self.hosted = [], [], []
+        if self.workers == 0:
+            self.local = {shard: ShardInterpreter(None, ops_path, path, **interpreter_kwargs)
+                          for shard, path in enumerate(shard_paths)}
+            return
+        ctx = mp.get_context(start_method)
+        for worker in range(self.workers):
+            hosted = {shard: shard_paths[shard] for shard in range(worker, n_shards, self.workers)}
+            conn, child_conn = ctx.Pipe()
+            process = ctx.Process(target=serve_shards, args=(child_conn, hosted, ops_path, interpreter_kwargs),
+                                  daemon=True)
+            process.start()
+            self.conns.append(conn)
+            self.processes.append(process)
+            self.hosted.append(list(hosted))
+        for conn in self.conns:
+            conn.recv()
+
+    def scatter(self, requests):
+        # requests: shard -> [(trace, targets, injected)], answered by all workers in parallel
+        if self.local is not None:
+            return {shard: [self.local[shard].evaluate_request(*request) for request in shard_requests]
+                    for shard, shard_requests in requests.items()}
+        for conn, hosted in zip(self.conns, self.hosted):
+            conn.send({shard: requests[shard] for shard in hosted if shard in requests})
+        responses = dict()
+        for conn in self.conns:
+            responses.update(conn.recv())
+        return responses
+
+    def close(self):
+        for conn in self.conns:
+            conn.send(None)
+        for process in self.processes:
+            process.join()
+        self.conns, self.processes = [], []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ShardedExecution:
+    # coordinator side state of one trace: the distribution of every node, the values computed or gathered
+    # so far, and the next local nodes to fetch from the shards
+    def __init__(self, coordinator, trace):
+        self.coordinator = coordinator
+        self.trace = trace
+        self.done = False
+        self.result = None
+        self.values = dict()
+        self.fetched = dict()
+        try:
+            self.program = coordinator.compile_trace(trace)
+            self.kinds, self.gathered = coordinator.distribute(self.program)
+        except TraceSyntaxError:
+            self.done = True
+            return
+        if self.kinds is None:
+            self.done = True
+            return
+        self.injectable = {idx for idx, kind in self.kinds.items() if kind == COORD} | self.gathered
+        root = self.program.root
+        self.pending = [idx for idx in self.program.order if idx in self.injectable or idx == root]
+
+    def inputs(self, idx):
+        # injectable nodes a local node is evaluated from (itself excluded)
+        found, stack = set(), [idx]
+        while stack:
+            node = self.program.nodes[stack.pop()]
+            for child in node.refs():
+                if child in self.injectable:
+                    found.add(child)
+                elif child not in found:
+                    stack.append(child)
+        return found
+
+    def needs(self, idx):
+        # local nodes (with 'value' or 'card') and computed nodes a pending node is computed from
+        if self.kinds[idx] != COORD:
+            return [(idx, 'value')], []
+        mode = 'card' if self.program.nodes[idx].op in COUNT_OPS else 'value'
+        local, computed = [], []
+        for child in self.program.nodes[idx].refs():
+            if child in self.injectable:
+                computed.append(child)
+            else:
+                local.append((child, mode))
+        return local, computed
+
+    def next_fetch(self):
+        fetch = dict()
+        for idx in self.pending:
+            local, computed = self.needs(idx)
+            if not all(child in self.values for child in computed):
+                continue
+            for child, mode in local:
+                if (child, mode) in self.fetched or (child, 'value') in self.fetched:
+                    continue
+                if all(dep in self.values for dep in self.inputs(child)):
+                    if fetch.get(child) != 'value':
+                        fetch[child] = mode
+        return fetch
+
+    def request(self, fetch):
+        injected = set()
+        for idx in fetch:
+            injected |= self.inputs(idx)
+        return self.trace, fetch, {idx: self.values[idx] for idx in injected}
+
+    def absorb(self, fetch, responses):
+        # responses: one per shard, in shard order
+        if any('error' in response for response in responses):
+            return self.finish(None)
+        cards = dict()
+        for idx in set().union(*[response['cards'] for response in responses]):
+            parts = [response['cards'].get(idx) for response in responses]
+            if self.kinds[idx] == REPL:
+                cards[idx] = parts[0]
+            else:
+                cards[idx] = None if None in parts else sum(parts)
+            op = self.program.nodes[idx].op
+            if cards[idx] is None or (cards[idx] == 0 and (op in SELECT_OPS or op in HOP_OPS)):
+                # a None result propagates to the root, an empty gen_* result fails the trace
+                return self.finish(None)
+        for idx in set().union(*[response['known'] for response in responses]):
+            masks = [response['known'][idx] for response in responses if idx in response['known']]
+            if not np.logical_or.reduce(masks).all():
+                return self.finish(None)
+        for idx, mode in fetch.items():
+            if mode == 'card':
+                self.fetched[(idx, mode)] = cards[idx]
+            else:
+                self.fetched[(idx, mode)] = self.coordinator.gather(
+                    self.program.nodes[idx], self.kinds[idx], [response['values'][idx] for response in responses])
+        self.compute()
+
+    def compute(self):
+        for idx in list(self.pending):
+            local, computed = self.needs(idx)
+            if not all(child in self.values for child in computed):
+                continue
+            if not all(key in self.fetched or (key[0], 'value') in self.fetched for key in local):
+                continue
+            if self.kinds[idx] == COORD:
+                try:
+                    self.values[idx] = self.coordinator.compute(self.program.nodes[idx], self.arg_values(idx))
+                except Exception:
+                    return self.finish(None)
+            else:
+                self.values[idx] = self.fetched[(idx, 'value')]
+            self.pending.remove(idx)
+        if self.program.root in self.values:
+            self.finish(self.values[self.program.root])
+
+    def arg_values(self, idx):
+        node = self.program.nodes[idx]
+        args = []
+        for arg in node.args:
+            if not isinstance(arg, Ref):
+                args.append(arg)
+            elif arg.idx in self.values:
+                args.append(self.values[arg.idx])
+            elif (arg.idx, 'value') in self.fetched:
+                args.append(self.fetched[(arg.idx, 'value')])
+            else:
+                # count of a local node: its gathered cardinality is all the count needs
+                card = self.fetched[(arg.idx, 'card')]
+                args.append(None if card is None else ShardCount(card))
+        return args
+
+    def finish(self, result):
+        self.done = True
+        self.result = result
+
+
+class ShardCount:
+    # stands for a set of which the coordinator only gathered the size
+    __slots__ = ('n',)
+
+    def __init__(self, n):
+        self.n = n
+
+    def __len__(self):
+        return self.n
+
+
+class ShardedInterpreter(MimicInterpreter):
+    # coordinator over a KG partitioned by partition_kg: runs each trace shard-local wherever the placement of
+    # the relations allows it, and merges unions, counts and aggregates of the shard parts in a gather step.
+    # results equal MimicInterpreter.execute_trace up to the order of multiset items
+    def __init__(self, sharded_path, ops_path, workers=None, casefold_equal=False, program_cache=None,
+                 start_method=None):
+        with open(os.path.join(sharded_path, SHARDS_META_FILE)) as f:
+            meta = json.load(f)
+        self.sharded_path = sharded_path
+        self.workers = workers
+        self.start_method = start_method
+        self.n_shards = meta['n_shards']
+        self.sub_owned = set(meta['sub_owned'])
+        self.obj_owned = set(meta['obj_owned'])
+        self.casefold_equal = casefold_equal
+        self.profiler = None
+        self.budget = None
+        self.program_cache = PROGRAM_CACHE if program_cache is None else program_cache
+        self.ops_path = ops_path
+        self.idx2op, self.op2idx, self.idx2type, self.type2idx, self.op2argtypes_mat, self.op2outtype_mat, \
+            self.max_args_over_ops = self.build_ops()
+        self.n_ops = len(self.idx2op)
+        self.n_types = len(self.idx2type)
+        self.type_checker = None
+        self.shards = self.start_shards(workers)
+
+    def start_shards(self, workers):
+        # no result cache on the shards: the local value of a node depends on which nodes its program injects
+        interpreter_kwargs = {'casefold_equal': self.casefold_equal, 'reorder': False}
+        return ShardPool([shard_path(self.sharded_path, shard) for shard in range(self.n_shards)], self.ops_path,
+                         workers, interpreter_kwargs, self.start_method)
+
+    def shard_pool(self, workers):
+        # the shard pool, restarted when execute_traces asks for another number of worker processes
+        with POOL_LOCK:
+            if workers is not None and min(workers, self.n_shards) != self.shards.workers:
+                self.shards.close()
+                self.workers = workers
+                self.shards = self.start_shards(workers)
+            return self.shards
+
+    def distribute(self, program):
+        # kind of every node, and the local nodes whose gathered value has to be injected into the shards
+        # (SPLIT inputs of shard-local ops). a node gathered for one consumer is injected for all of them,
+        # so kinds are recomputed until the gathered nodes settle. (None, None) when the trace fails whatever
+        # the KG holds
+        gathered = set()
+        while True:
+            kinds, needed = self.distribute_pass(program, gathered)
+            if kinds is None or needed <= gathered:
+                return kinds, gathered
+            gathered |= needed
+
+    def distribute_pass(self, program, gathered):
+        kinds, needed = dict(), set()
+
+        def local_kind(arg, accept=(PART, REPL)):
+            # kind of an argument as seen by a shard-local op, other kinds are gathered and injected
+            if not isinstance(arg, Ref) or arg.idx in gathered or kinds[arg.idx] == COORD:
+                return REPL
+            if kinds[arg.idx] not in accept:
+                needed.add(arg.idx)
+                return REPL
+            return kinds[arg.idx]
+
+        for idx in program.order:
+            node = program.nodes[idx]
+            if node.op in SELECT_OPS:
+                rel = node.args[0]
+                if not isinstance(rel, str):
+                    return None, None
+                for arg in node.args[1:]:
+                    local_kind(arg, accept=(REPL,))
+                kinds[idx] = PART if rel in self.sub_owned else REPL
+            elif node.op in HOP_OPS:
+                set_pos, rel_pos, _, _ = HOP_OPS[node.op]
+                rel = node.args[rel_pos]
+                if not isinstance(rel, str):
+                    return None, None
+                source = local_kind(node.args[set_pos])
+                if rel in self.sub_owned:
+                    # edges live on the shard of their subject
+                    owned = node.op == 'gen_entset_up' or rel in self.obj_owned
+                    kinds[idx] = PART if owned else SPLIT
+                else:
+                    kinds[idx] = REPL if source == REPL else SPLIT
+            elif node.op in SET_OPS:
+                left, right = local_kind(node.args[0]), local_kind(node.args[1])
+                if node.op == 'intersect_entsets':
+                    kinds[idx] = REPL if left == right == REPL else PART
+                else:
+                    kinds[idx] = left if left == right else COORD
+            else:
+                kinds[idx] = COORD
+        return kinds, needed
+
+    def gather(self, node, kind, parts):
+        # value of a local node from its shard parts
+        if kind == REPL:
+            value = parts[0]
+        elif any(part is None for part in parts):
+            return None
+        else:
+            value = np.concatenate([part for part in parts if len(part)] or parts[:1])
+            if node.op in SET_OPS:
+                value.sort()
+        if node.op == 'gen_litset' and value is not None:
+            value = self.litSet_to_nl(value)
+        return value
+
+    def compute(self, node, args):
+        if node.op in COUNT_OPS and isinstance(args[0], ShardCount):
+            return float(len(args[0]))
+        return getattr(self, TRACE_OPS[node.op].method)(*args)
+
+    def execute_trace(self, trace, profiler=None, budget=None):
+        return self.execute_traces([trace], profiler=profiler, budget=budget)[0]
+
+    def execute_traces(self, traces, workers=None, profiler=None, budget=None):
+        # every round sends the pending requests of all unfinished traces to the shards at once. workers is the
+        # number of processes hosting the shards (0: this process, None: those of the current shard pool).
+        # profiling and budgets are not supported across shards
+        if profiler is not None or budget is not None:
+            raise ValueError('profiling and execution budgets need an unsharded MimicInterpreter')
+        shards = self.shard_pool(workers)
+        runs = [ShardedExecution(self, trace) for trace in traces]
+        while True:
+            batch = []
+            for run in runs:
+                if run.done:
+                    continue
+                fetch = run.next_fetch()
+                if not fetch:
+                    # nodes computed from literals and earlier results only
+                    run.compute()
+                    if run.done:
+                        continue
+                    fetch = run.next_fetch()
+                    if not fetch:
+                        raise RuntimeError(f'sharded execution of {run.trace!r} cannot make progress')
+                batch.append((run, fetch))
+            if not batch:
+                return [run.result for run in runs]
+            request = [run.request(fetch) for run, fetch in batch]
+            responses = shards.scatter({shard: request for shard in range(self.n_shards)})
+            for i, (run, fetch) in enumerate(batch):
+                run.absorb(fetch, [responses[shard][i] for shard in range(self.n_shards)])
+
+    def __getstate__(self):
+        # a copy in another process starts its own shard workers on the same shard snapshots
+        program_cache = None if self.program_cache is PROGRAM_CACHE else self.program_cache
+        return {'sharded_ref': (self.sharded_path, self.ops_path, self.workers, self.casefold_equal, program_cache,
+                                self.start_method)}
+
+    def __setstate__(self, state):
+        self.__init__(*state['sharded_ref'])
+
+    def close(self):
+        self.shards.close()
@@ -0,0 +1,199 @@
+from collections.abc import Mapping
+
+import numpy as np
+
+
+HASH_BASE = 1099511628211
+HASH_LENGTH_MIX = 0x9E3779B97F4A7C15
+HASH_CHUNK_SIZE = 1 << 16
+
+
+def unicode_array(strings):
+    if isinstance(strings, np.ndarray) and strings.dtype.kind == 'U':
+        return np.ascontiguousarray(strings.reshape(-1))
+    strings = list(strings)
+    for s in strings:
+        if not isinstance(s, str):
+            raise KeyError(s)
+    return np.array(strings, dtype=str).reshape(-1)
+
+
+def hash_strings(strings):
+    # polynomial hash (mod 2 ** 64) over the code points of a numpy unicode array, no python loop
+    if len(strings) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    width = max(strings.itemsize // 4, 1)
+    codes = np.ascontiguousarray(strings, dtype=f'U{width}').view(np.uint32).reshape(len(strings), width)
+    nonzero = codes != 0
+    lengths = np.where(nonzero.any(axis=1), width - np.argmax(nonzero[:, ::-1], axis=1), 0).astype(np.uint64)
+
+    powers = np.ones(width, dtype=np.uint64)
+    powers[1:] = np.cumprod(np.full(width - 1, HASH_BASE, dtype=np.uint64))
+    exponent = lengths.astype(np.int64)[:, None] - 1 - np.arange(width)
+    terms = (codes.astype(np.uint64) + np.uint64(1)) * powers[np.maximum(exponent, 0)]
+    terms[exponent < 0] = 0
+    return terms.sum(axis=1, dtype=np.uint64) ^ (lengths * np.uint64(HASH_LENGTH_MIX))
+
+
+def encode_strings(strings):
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(s) for s in encoded])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+class StringPool:
+    # id -> string table stored as one contiguous utf-8 buffer plus (n + 1) byte offsets,
+    # string -> id goes through the sorted string hashes (hash_order[k] is the id of the k-th smallest hash)
+    ARRAYS = ['buffer', 'offsets', 'hashes', 'hash_order']
+
+    def __init__(self, buffer, offsets, hashes=None, hash_order=None):
+        self.buffer = buffer
+        self.offsets = offsets
+        self._is_ascii = None
+        self._char_lengths = None
+        if hashes is None or hash_order is None:
+            hashes = np.zeros(len(self), dtype=np.uint64)
+            for start in range(0, len(self), HASH_CHUNK_SIZE):
+                ids = np.arange(start, min(start + HASH_CHUNK_SIZE, len(self)))
+                hashes[ids] = hash_strings(self.decode(ids))
+            hash_order = np.argsort(hashes, kind='stable').astype(np.int64)
+            hashes = hashes[hash_order]
+        self.hashes = hashes
+        self.hash_order = hash_order
+
+    @classmethod
+    def from_strings(cls, strings):
+        return cls(*encode_strings(strings))
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix):
+        return cls(*[arrays.get(f'{prefix}_{name}') for name in cls.ARRAYS])
+
+    def to_arrays(self, prefix):
+        return {f'{prefix}_{name}': getattr(self, name) for name in self.ARRAYS}
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def extend(self, other):
+        # new pool holding these strings then the strings of other (ids len(self) + i). only other is hashed,
+        # its sorted hashes are merged into ours
+        offsets = np.concatenate([self.offsets, other.offsets[1:] + len(self.buffer)])
+        positions = np.searchsorted(self.hashes, other.hashes, 'right')
+        hashes = np.insert(self.hashes, positions, other.hashes)
+        hash_order = np.insert(self.hash_order, positions, other.hash_order + len(self))
+        return StringPool(np.concatenate([self.buffer, other.buffer]), offsets, hashes, hash_order)
+
+    def __getitem__(self, idx):
+        if idx < 0 or idx >= len(self):
+            raise KeyError(idx)
+        return self.buffer[self.offsets[idx]:self.offsets[idx + 1]].tobytes().decode('utf-8')
+
+    def tolist(self):
+        data = self.buffer.tobytes()
+        offsets = self.offsets.tolist()
+        return [data[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(self))]
+
+    @property
+    def is_ascii(self):
+        if self._is_ascii is None:
+            self._is_ascii = len(self.buffer) == 0 or int(self.buffer.max()) < 128
+        return self._is_ascii
+
+    def max_width(self, ids):
+        # itemsize (in characters) of the unicode array decode(ids) would return
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) == 0:
+            return 1
+        if self.is_ascii:
+            return max(int((self.offsets[ids + 1] - self.offsets[ids]).max()), 1)
+        if self._char_lengths is None:
+            # utf-8 continuation bytes do not start a character
+            starts = np.zeros(len(self.buffer) + 1, dtype=np.int64)
+            starts[1:] = np.cumsum((self.buffer & 0xC0) != 0x80)
+            self._char_lengths = starts[self.offsets[1:]] - starts[self.offsets[:-1]]
+        return max(int(self._char_lengths[ids].max()), 1)
+
+    def decode_bytes(self, ids):
+        # vectorized gather: ids -> fixed width numpy bytes array (utf-8)
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) and (ids.min() < 0 or ids.max() >= len(self)):
+            raise KeyError(int(ids[(ids < 0) | (ids >= len(self))][0]))
+
+        starts, ends = self.offsets[ids], self.offsets[ids + 1]
+        lengths = ends - starts
+        width = max(int(lengths.max()) if len(lengths) else 0, 1)
+        if len(self.buffer) == 0:
+            return np.zeros(len(ids), dtype=f'S{width}')
+
+        char_idx = starts[:, None] + np.arange(width)
+        np.minimum(char_idx, len(self.buffer) - 1, out=char_idx)
+        chars = self.buffer[char_idx]
+        chars[np.arange(width) >= lengths[:, None]] = 0
+        return chars.view(f'S{width}').reshape(len(ids))
+
+    def decode(self, ids):
+        # vectorized gather: ids -> numpy unicode array
+        raw = self.decode_bytes(ids)
+        if len(raw) == 0:
+            return np.zeros(0, dtype='U1')
+        return raw.astype(f'U{raw.itemsize}') if self.is_ascii else np.char.decode(raw, 'utf-8')
+
+    def lookup(self, strings, default=None):
+        # vectorized search: strings -> ids, unknown strings raise KeyError unless a default id is given
+        strings = unicode_array(strings)
+        q_hashes = hash_strings(strings)
+
+        pos = np.searchsorted(self.hashes, q_hashes)
+        ids = np.full(len(strings), -1, dtype=np.int64)
+        pending = np.arange(len(strings))
+        while len(pending):
+            # hash collisions are resolved by walking the run of equal hashes
+            pending = pending[pos[pending] < len(self.hashes)]
+            pending = pending[self.hashes[pos[pending]] == q_hashes[pending]]
+            if len(pending) == 0:
+                break
+
+            candidates = self.hash_order[pos[pending]]
+            found = self.decode(candidates) == strings[pending]
+            ids[pending[found]] = candidates[found]
+
+            pending = pending[~found]
+            pos[pending] += 1
+
+        missing = ids < 0
+        if missing.any():
+            if default is None:
+                raise KeyError(str(strings[np.flatnonzero(missing)[0]]))
+            ids[missing] = default
+        return ids
+
+    def index(self):
+        return StringIdMap(self)
+
+
+class StringIdMap(Mapping):
+    # read-only string -> id mapping over a StringPool, without decoding the pool into a dict
+    def __init__(self, pool):
+        self.pool = pool
+
+    def __getitem__(self, key):
+        if not isinstance(key, str):
+            raise KeyError(key)
+        return int(self.pool.lookup([key])[0])
+
+    def get(self, key, default=None):
+        if not isinstance(key, str):
+            return default
+        idx = int(self.pool.lookup([key], default=-1)[0])
+        return default if idx < 0 else idx
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __iter__(self):
+        return iter(self.pool.tolist())
+
+    def __len__(self):
+        return len(self.pool)
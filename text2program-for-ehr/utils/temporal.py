@@ -0,0 +1,41 @@
+import numpy as np
+
+
+# relations whose objects are date/time literals, typed as datetime64 columns at KG load
+TEMPORAL_RELATIONS = ['/admittime', '/dischtime', '/charttime', '/dob', '/dod']
+TIME_DTYPE = 'datetime64[s]'
+NAT = np.datetime64('NaT', 's')
+
+
+def parse_datetime(value):
+    # '2104-08-28T08:00:00', '2104-08-31 08:00:00', '2104-08-28' or '2104' (ints are read as years)
+    # at second resolution, NaT when value is not a date/time
+    if isinstance(value, np.datetime64):
+        return value.astype(TIME_DTYPE)
+    if isinstance(value, (int, np.integer)) and not isinstance(value, bool):
+        value = str(value)
+    if not isinstance(value, str):
+        return NAT
+    try:
+        return np.datetime64(value.strip(), 's')
+    except ValueError:
+        return NAT
+
+
+def build_time_column(pool, triples, rel2id, relations=TEMPORAL_RELATIONS):
+    # datetime64 side array indexed by sub/obj id: the parsed value of every object of a temporal relation,
+    # NaT everywhere else. each distinct string is parsed once
+    times = np.full(len(pool), NAT, dtype=TIME_DTYPE)
+    rel_ids = [rel2id[rel] for rel in relations if rel in rel2id]
+    if not rel_ids:
+        return times
+    obj_ids = np.unique(triples['obj'][np.isin(triples['rel'], rel_ids)])
+    if len(obj_ids):
+        times[obj_ids] = [parse_datetime(s) for s in pool.decode(obj_ids).tolist()]
+    return times
+
+
+def time_triples_mask(times, triples, rel2id, relations=TEMPORAL_RELATIONS):
+    # triples of a temporal relation whose object parsed as a date/time
+    rel_ids = [rel2id[rel] for rel in relations if rel in rel2id]
+    return np.isin(triples['rel'], rel_ids) & ~np.isnat(times[triples['obj']])
@@ -521,6 +521,15 @@ class TrainingArguments:
     beam_size: int = field(default=1, metadata={"help": "Number of beams for beam search. 1 means no beam search."})
     top_k: Optional[int] = field(default=None, metadata={"help": "The number of highest probability vocabulary tokens to keep for top-k-filtering."})
     top_p: Optional[float] = field(default=None, metadata={"help": "If set to float < 1, only the most probable tokens with probabilities that add up to top_p or higher are kept for generation."})
+    interpreter_workers: int = field(default=1, metadata={"help": "Number of processes executing predicted traces in evaluation. 1 means serial execution."})
+    profile_interpreter: bool = field(default=False, metadata={"help": "Whether or not to profile the interpreter ops in evaluation and dump per op histograms next to the decode output file."})
+    interpreter_max_cardinality: Optional[int] = field(default=None, metadata={"help": "Abort a predicted trace once an intermediate result would hold more items than this."})
+    interpreter_max_bytes: Optional[int] = field(default=None, metadata={"help": "Abort a predicted trace once its intermediate results would hold more bytes than this."})
+    interpreter_max_seconds: Optional[float] = field(default=None, metadata={"help": "Abort a predicted trace after this many seconds of execution."})
+    interpreter_socket: Optional[str] = field(default=None, metadata={"help": "Unix socket of a shared interpreter service. Started on first use, so that training, validation and evaluation load the KG once. The socket directory has to be private (0700, created if missing); clients authenticate with a key the service passes to child processes in MIMIC_INTERPRETER_AUTHKEY."})
+    interpreter_shards: int = field(default=0, metadata={"help": "Number of subject_id shards the KG is partitioned into for evaluation, each executed by its own process. 0 means an unsharded KG."})
+    interpreter_branch_threads: int = field(default=1, metadata={"help": "Threads per predicted trace execution: independent operands of set operations are evaluated concurrently. 1 evaluates them one after the other."})
+    type_check_programs: bool = field(default=True, metadata={"help": "Skip predicted traces that fail the static type check (an op input of a kind the op cannot run on) instead of executing them, counted as wrong and reported as type_pruned. The check only rejects traces that could not give an answer, so ex_acc is the same as without it. With num_samples > 1 the well-typed candidates of a question are ranked before the others."})
 
     attention_mask_type: Optional[str] = field(
         default="bi",
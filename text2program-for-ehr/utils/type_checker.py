@@ -0,0 +1,97 @@
+import weakref
+
+from utils.program import TRACE_OPS, Ref
+from utils.planner import HOP_OPS, RANGE_OPS, TIME_OPS
+
+
+# the kinds of values an op input can be: the output types of TRACE_OPS for the results of other nodes, and the
+# kind of a literal
+SET_KINDS = frozenset(['entSet', 'litSet', 'litSets'])
+STR_KIND = 'str'
+NUMBER_KIND = 'number'
+# a str literal written as a path, e.g. '/hadm_id'
+RELATION_KIND = 'relation'
+RELATION_PREFIX = '/'
+
+# op -> position -> the kinds the op runs on there. these are what the interpreter methods accept, not the types of
+# the operations json, which are stricter: the check only prunes traces that could not give an answer. positions
+# missing here accept any kind (the counts, the set ops, and the bounds of the range and time ops, read with float()
+# or parse_datetime)
+ARG_KINDS = {}
+for _op, (_set_pos, _rel_pos, _, _) in HOP_OPS.items():
+    # the items of the input set (a single str literal is a set of one) are looked up as entities, a number or a
+    # value is not one. the relation is looked up among the relations, the items of a set are entities
+    ARG_KINDS[_op] = {_set_pos: SET_KINDS | {STR_KIND}, _rel_pos: {RELATION_KIND}}
+for _op in ['gen_entset_equal', *RANGE_OPS, *TIME_OPS]:
+    ARG_KINDS[_op] = {0: {RELATION_KIND}}
+# equality on the sub/obj strings: a number or a value never matches one, and an empty lookup fails the trace
+ARG_KINDS['gen_entset_equal'][1] = SET_KINDS | {STR_KIND}
+# the aggregations take the length of the set and read its items as floats, anything else gives None
+for _op in ['maximum_litset', 'minimum_litset', 'average_litset']:
+    ARG_KINDS[_op] = {0: {'entSet', 'litSet'}}
+
+
+class ProgramTypeError(ValueError):
+    pass
+
+
+def literal_kind(arg):
+    if isinstance(arg, str):
+        return RELATION_KIND if arg.startswith(RELATION_PREFIX) else STR_KIND
+    if isinstance(arg, (int, float)) and not isinstance(arg, bool):
+        return NUMBER_KIND
+    return type(arg).__name__
+
+
+def well_typed_first(flags, n_candidates):
+    # order of the candidates putting, within each group of n_candidates (the beams or samples of one question,
+    # best first), the well-typed ones before the others; the order within both is kept
+    order = []
+    for start in range(0, len(flags), n_candidates):
+        order += sorted(range(start, min(start + n_candidates, len(flags))), key=lambda idx: not flags[idx])
+    return order
+
+
+class TypeChecker:
+    # static check of compiled programs: every op input has to be of a kind the op runs on (ARG_KINDS). runs on the
+    # program alone, before any data is touched; verdicts are kept per program
+    def __init__(self):
+        self.verdicts = weakref.WeakKeyDictionary()
+
+    def check(self, program):
+        # raises ProgramTypeError at the first ill-typed op input (in execution order)
+        error = self.verdicts.get(program)
+        if error is None:
+            error = self.find_error(program) or ''
+            self.verdicts[program] = error
+        if error:
+            raise ProgramTypeError(error)
+        return program
+
+    def is_well_typed(self, program):
+        try:
+            self.check(program)
+        except ProgramTypeError:
+            return False
+        return True
+
+    def find_error(self, program):
+        for idx in program.order:
+            node = program.nodes[idx]
+            for pos, kinds in ARG_KINDS.get(node.op, {}).items():
+                kind = self.arg_kind(program, node.args[pos])
+                # a relation is a str to the ops that take str items
+                if kind not in kinds and not (kind == RELATION_KIND and STR_KIND in kinds):
+                    return f'argument {pos + 1} of {node.op} [n{idx}]: expected {" or ".join(sorted(kinds))}, ' \
+                           f'got {self.describe(program, node.args[pos])}'
+        return None
+
+    def arg_kind(self, program, arg):
+        if isinstance(arg, Ref):
+            return TRACE_OPS[program.nodes[arg.idx].op].out_type
+        return literal_kind(arg)
+
+    def describe(self, program, arg):
+        if isinstance(arg, Ref):
+            return f'the {self.arg_kind(program, arg)} of {program.nodes[arg.idx].op}'
+        return f'the literal {arg!r}'
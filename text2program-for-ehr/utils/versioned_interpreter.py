@@ -0,0 +1,155 @@
+import os
+import logging
+import argparse
+import threading
+from contextlib import contextmanager
+
+from utils.kg_snapshot import is_versioned_snapshot, current_snapshot_version, prune_snapshot_versions
+from utils.result_cache import SubResultCache
+
+
+logger = logging.getLogger(__name__)
+
+
+class VersionedInterpreter:
+    # MimicInterpreter over a versioned snapshot root (see kg_snapshot.py) whose KG version can be swapped while
+    # it runs. every call leases the interpreter of the version current when it starts and finishes on it;
+    # swap maps the new version, sends new calls to it and releases the old interpreter (process pool, branch
+    # threads, mapped arrays) once its last leased call has returned. other attributes read the current version
+    def __init__(self, kg_path, ops_path, snapshot_root, watch_interval=None, **interpreter_kwargs):
+        from utils.interpreter import MimicInterpreter
+        self.kg_path = kg_path
+        self.ops_path = ops_path
+        self.snapshot_root = snapshot_root
+        self.interpreter_kwargs = interpreter_kwargs
+        self.lock = threading.Lock()
+        # serializes swaps, calls only wait for self.lock
+        self.swap_lock = threading.Lock()
+        # interpreter -> number of calls running on it
+        self.leases = dict()
+        if not is_versioned_snapshot(snapshot_root):
+            # first run: the KG is parsed once and published as the first version
+            MimicInterpreter(kg_path, ops_path, **interpreter_kwargs).save_snapshot_version(snapshot_root)
+        self.version = current_snapshot_version(snapshot_root)
+        self.interpreter = self.open(self.version, interpreter_kwargs.get('result_cache'))
+        # optional thread picking up every version published in CURRENT
+        self.watch_interval = watch_interval
+        self.stopped = threading.Event()
+        if watch_interval is not None:
+            threading.Thread(target=self.watch, daemon=True).start()
+
+    def __getstate__(self):
+        return {'versioned_ref': (self.kg_path, self.ops_path, self.snapshot_root, self.watch_interval,
+                                  self.interpreter_kwargs)}
+
+    def __setstate__(self, state):
+        kg_path, ops_path, snapshot_root, watch_interval, interpreter_kwargs = state['versioned_ref']
+        self.__init__(kg_path, ops_path, snapshot_root, watch_interval, **interpreter_kwargs)
+
+    def open(self, version, result_cache):
+        from utils.interpreter import MimicInterpreter
+        return MimicInterpreter(self.kg_path, self.ops_path, os.path.join(self.snapshot_root, version),
+                                **dict(self.interpreter_kwargs, result_cache=result_cache))
+
+    def swap(self, version=None):
+        # maps version (default: the one published in CURRENT) and sends new calls to it. returns the version
+        # in use afterwards
+        with self.swap_lock:
+            version = version or current_snapshot_version(self.snapshot_root)
+            if version == self.version:
+                return version
+            # results of one KG are not valid for another: the new version starts with an empty cache
+            cache = self.interpreter.result_cache
+            interpreter = self.open(version, None if cache is None else SubResultCache(cache.max_entries,
+                                                                                       cache.max_bytes))
+            with self.lock:
+                old, self.interpreter, self.version = self.interpreter, interpreter, version
+                idle = old not in self.leases
+            logger.info(f'KG snapshot {self.snapshot_root} swapped to version {version}')
+            if idle:
+                self.retire(old)
+            return version
+
+    def acquire(self):
+        with self.lock:
+            interpreter = self.interpreter
+            self.leases[interpreter] = self.leases.get(interpreter, 0) + 1
+        return interpreter
+
+    def release(self, interpreter):
+        with self.lock:
+            self.leases[interpreter] -= 1
+            idle = self.leases[interpreter] == 0
+            if idle:
+                del self.leases[interpreter]
+            retired = idle and interpreter is not self.interpreter
+        if retired:
+            self.retire(interpreter)
+
+    @contextmanager
+    def leased(self):
+        interpreter = self.acquire()
+        try:
+            yield interpreter
+        finally:
+            self.release(interpreter)
+
+    def retire(self, interpreter):
+        # no call runs on it anymore. its arrays are dropped here, so that a stray reference (or the reference
+        # cycle of its planner) does not keep the old version mapped
+        interpreter.close_pool()
+        interpreter.__dict__.clear()
+
+    def watch(self):
+        while not self.stopped.wait(self.watch_interval):
+            try:
+                self.swap()
+            except Exception as e:
+                logger.warning(f'KG snapshot swap of {self.snapshot_root} failed: {e!r}')
+
+    def execute_trace(self, trace, profiler=None, budget=None):
+        with self.leased() as interpreter:
+            return interpreter.execute_trace(trace, profiler, budget)
+
+    def execute_traces(self, traces, workers=None, profiler=None, budget=None):
+        with self.leased() as interpreter:
+            return interpreter.execute_traces(traces, workers, profiler, budget)
+
+    def close_pool(self):
+        self.stopped.set()
+        self.interpreter.close_pool()
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name in ('interpreter', 'lock', 'leases'):
+            raise AttributeError(name)
+        value = getattr(self.interpreter, name)
+        if not callable(value):
+            return value
+
+        def method(*args, **kwargs):
+            with self.leased() as interpreter:
+                return getattr(interpreter, name)(*args, **kwargs)
+        return method
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Publish the KG as a new version of a versioned snapshot root, '
+                                                 'and swap a running interpreter service to it')
+    parser.add_argument('--snapshot_root', required=True)
+    parser.add_argument('--kg_path', default=f'{os.getcwd()}/data/db/mimicstar_kg/mimic_sparqlstar_kg.xml')
+    parser.add_argument('--ops_path', default=f'{os.getcwd()}/data/db/mimicstar_kg/mimicprogram_operations.json')
+    parser.add_argument('--socket', default=None)
+    parser.add_argument('--prune', action='store_true')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    from utils.interpreter import MimicInterpreter
+    version = MimicInterpreter(args.kg_path, args.ops_path).save_snapshot_version(args.snapshot_root)
+    print(f'published version {version} in {args.snapshot_root}')
+    if args.socket is not None:
+        from utils.interpreter_service import InterpreterClient
+        with InterpreterClient(args.socket) as client:
+            print(f'service on {args.socket} swapped to {client.swap_snapshot(version)}')
+    if args.prune:
+        # versions still mapped by running processes stay readable to them
+        print(f'removed versions {prune_snapshot_versions(args.snapshot_root)}')